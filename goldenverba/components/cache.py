@@ -0,0 +1,435 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from contextvars import ContextVar
+
+from goldenverba.components.chunk import Chunk
+
+
+class LRUCache:
+    """
+    Thread-safe, size-bounded least-recently-used cache.
+    """
+
+    def __init__(self, maxsize: int = 128):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def set(self, key, value) -> None:
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def keys(self) -> list:
+        with self._lock:
+            return list(self._data.keys())
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key) -> bool:
+        with self._lock:
+            return key in self._data
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+
+class TTLCache(LRUCache):
+    """
+    LRUCache whose entries expire ttl seconds after they were set.
+    """
+
+    def __init__(self, maxsize: int = 128, ttl: float = 600.0):
+        super().__init__(maxsize)
+        self.ttl = ttl
+
+    def get(self, key, default=None):
+        entry = super().get(key)
+        if entry is None:
+            return default
+        expires, value = entry
+        if expires < time.monotonic():
+            self.pop(key)
+            return default
+        return value
+
+    def set(self, key, value) -> None:
+        super().set(key, (time.monotonic() + self.ttl, value))
+
+    def __contains__(self, key) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+
+_MISSING = object()
+
+
+class DocumentChunkCache:
+    """
+    Caches the chunks of a document by chunk_id so that window expansion around
+    retrieved chunks does not have to go back to Weaviate for neighbors it has already
+    seen. Entries are keyed by (chunk class, doc_name); a chunk_id mapped to None marks
+    a chunk that does not exist.
+    """
+
+    def __init__(self, maxsize: int = 256):
+        self.documents = LRUCache(maxsize)
+
+    def get_chunks(self, chunk_class: str, doc_name: str) -> dict[int, Chunk]:
+        """Returns a copy of the cached chunk map of a document
+        @parameter: chunk_class : str - Weaviate class of the chunks
+        @parameter: doc_name : str - Document name
+        @returns dict[int, Chunk] - Cached chunks by chunk_id (None for known missing
+            ids).
+        """
+        return dict(self.documents.get((chunk_class, doc_name), {}))
+
+    def add_chunks(
+        self, chunk_class: str, doc_name: str, chunks: dict[int, Chunk]
+    ) -> None:
+        """Merges chunks into the cached chunk map of a document
+        @parameter: chunk_class : str - Weaviate class of the chunks
+        @parameter: doc_name : str - Document name
+        @parameter: chunks : dict[int, Chunk] - Chunks by chunk_id (None for known
+            missing ids).
+        """
+        cached = self.get_chunks(chunk_class, doc_name)
+        cached.update(chunks)
+        self.documents.set((chunk_class, doc_name), cached)
+
+    def invalidate(
+        self, chunk_class: str, doc_name: str = None, doc_uuid: str = None
+    ) -> None:
+        """Drops a document from the cache by name or by uuid
+        @parameter: chunk_class : str - Weaviate class of the chunks
+        @parameter: doc_name : str - Document name
+        @parameter: doc_uuid : str - Document UUID.
+        """
+        if doc_name is not None:
+            self.documents.pop((chunk_class, doc_name))
+
+        if doc_uuid is not None:
+            for key in self.documents.keys():
+                if key[0] != chunk_class:
+                    continue
+                chunks = self.documents.get(key, {})
+                if any(
+                    chunk is not None and chunk.doc_uuid == doc_uuid
+                    for chunk in chunks.values()
+                ):
+                    self.documents.pop(key)
+
+    def clear(self) -> None:
+        self.documents.clear()
+
+
+chunk_cache = DocumentChunkCache(
+    int(os.environ.get("VERBA_CHUNK_CACHE_SIZE", "256"))
+)
+
+
+class EmbeddingCache:
+    """
+    Content-addressed cache of embeddings keyed by (vectorizer, model, sha256 of the
+    text). Vectors are kept in an in-memory LRU and persisted as float32 blobs in
+    sqlite so they survive restarts. The sqlite store is trimmed to the disk_maxsize
+    most recently used vectors (use is recorded when a vector is written or read
+    from disk).
+    """
+
+    def __init__(self, maxsize: int = 10000, path: str = "", disk_maxsize: int = 50000):
+        self.memory = LRUCache(maxsize)
+        self.path = path
+        self.disk_maxsize = disk_maxsize
+        self._connection = None
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def get_key(vectorizer: str, model: str, text: str) -> str:
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{vectorizer}:{model}:{digest}"
+
+    def get_connection(self):
+        if not self.path:
+            return None
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._connection = sqlite3.connect(
+                self.path, check_same_thread=False
+            )
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings "
+                "(key TEXT PRIMARY KEY, vector BLOB, used REAL)"
+            )
+            columns = [
+                row[1]
+                for row in self._connection.execute("PRAGMA table_info(embeddings)")
+            ]
+            if "used" not in columns:
+                # Stores written before the disk tier was bounded
+                self._connection.execute("ALTER TABLE embeddings ADD COLUMN used REAL")
+            self._connection.commit()
+        return self._connection
+
+    def get_many(self, keys: list[str]) -> dict[str, list[float]]:
+        """Looks up vectors, checking memory first and then the sqlite store
+        @parameter: keys : list[str] - Cache keys
+        @returns dict[str, list[float]] - Vectors of the keys that were found.
+        """
+        found = {}
+        missing = []
+        for key in keys:
+            vector = self.memory.get(key)
+            if vector is None:
+                missing.append(key)
+            else:
+                found[key] = vector
+
+        if missing:
+            with self._lock:
+                connection = self.get_connection()
+                rows = []
+                if connection is not None:
+                    # Stay below sqlite's host parameter limit
+                    for start in range(0, len(missing), 500):
+                        part = missing[start : start + 500]
+                        rows += connection.execute(
+                            "SELECT key, vector FROM embeddings WHERE key IN (%s)"
+                            % ",".join("?" * len(part)),
+                            part,
+                        ).fetchall()
+                    if rows:
+                        connection.executemany(
+                            "UPDATE embeddings SET used = ? WHERE key = ?",
+                            [(time.time(), key) for key, _ in rows],
+                        )
+                        connection.commit()
+            for key, blob in rows:
+                vector = array("f", blob).tolist()
+                self.memory.set(key, vector)
+                found[key] = vector
+
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def set_many(self, vectors: dict[str, list[float]]) -> None:
+        for key, vector in vectors.items():
+            self.memory.set(key, vector)
+
+        with self._lock:
+            connection = self.get_connection()
+            if connection is not None:
+                now = time.time()
+                connection.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector, used) "
+                    "VALUES (?, ?, ?)",
+                    [
+                        (key, array("f", vector).tobytes(), now)
+                        for key, vector in vectors.items()
+                    ],
+                )
+                self._writes += len(vectors)
+                # Keep the store bounded every so often
+                if self._writes >= 100:
+                    self._writes = 0
+                    connection.execute(
+                        "DELETE FROM embeddings WHERE key NOT IN "
+                        "(SELECT key FROM embeddings ORDER BY used DESC LIMIT ?)",
+                        (self.disk_maxsize,),
+                    )
+                connection.commit()
+
+    def clear(self) -> None:
+        self.memory.clear()
+        with self._lock:
+            connection = self.get_connection()
+            if connection is not None:
+                connection.execute("DELETE FROM embeddings")
+                connection.commit()
+
+
+embedding_cache = EmbeddingCache(
+    int(os.environ.get("VERBA_EMBEDDING_CACHE_SIZE", "10000")),
+    os.environ.get(
+        "VERBA_EMBEDDING_CACHE_PATH",
+        os.path.join(
+            os.path.expanduser("~"), ".cache", "goldenverba", "embeddings.sqlite"
+        ),
+    ),
+    int(os.environ.get("VERBA_EMBEDDING_CACHE_DISK_SIZE", "50000")),
+)
+
+
+# Path of the API request being served, used to attribute cache hits and misses
+request_endpoint: ContextVar[str] = ContextVar("request_endpoint", default="")
+
+
+def is_deterministic(options: dict) -> bool:
+    """Only greedy (temperature 0) generations are reproducible enough to be cached."""
+    return bool(options) and options.get("temperature") == 0
+
+
+class CompletionCache:
+    """
+    Cache of deterministic LLM completions keyed by a hash of (model, full message list,
+    sampling options). Entries expire after ttl seconds. The in-memory LRU is backed by
+    an optional sqlite store (bounded to disk_maxsize entries) so that completions
+    survive restarts. Hits and misses are counted per API endpoint.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1000,
+        ttl: float = 7 * 24 * 3600,
+        path: str = "",
+        disk_maxsize: int = 100000,
+    ):
+        self.memory = LRUCache(maxsize)
+        self.ttl = ttl
+        self.path = path
+        self.disk_maxsize = disk_maxsize
+        self._connection = None
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.stats = {}
+
+    @staticmethod
+    def get_key(*parts) -> str:
+        return hashlib.sha256(
+            json.dumps(parts, sort_keys=True, default=str).encode("utf-8")
+        ).hexdigest()
+
+    def get_connection(self):
+        if not self.path:
+            return None
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._connection = sqlite3.connect(
+                self.path, check_same_thread=False
+            )
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS completions "
+                "(key TEXT PRIMARY KEY, value TEXT, expires REAL)"
+            )
+            self._connection.commit()
+        return self._connection
+
+    def get(self, key: str, endpoint: str = None):
+        """Looks up a completion
+        @parameter: key : str - Cache key, see get_key
+        @parameter: endpoint : str - Endpoint the hit or miss is counted for, defaults
+            to the current request's
+        @returns Any - Cached value, None on a miss or if the entry expired.
+        """
+        now = time.time()
+        value = None
+        entry = self.memory.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                value = entry[1]
+            else:
+                self.memory.pop(key)
+        else:
+            with self._lock:
+                connection = self.get_connection()
+                row = None
+                if connection is not None:
+                    row = connection.execute(
+                        "SELECT value, expires FROM completions WHERE key = ?",
+                        (key,),
+                    ).fetchone()
+            if row is not None and row[1] > now:
+                value = json.loads(row[0])
+                self.memory.set(key, (row[1], value))
+
+        self.record(request_endpoint.get() if endpoint is None else endpoint, value)
+        return value
+
+    def set(self, key: str, value) -> None:
+        """Stores a JSON-serializable completion for ttl seconds."""
+        expires = time.time() + self.ttl
+        self.memory.set(key, (expires, value))
+        with self._lock:
+            connection = self.get_connection()
+            if connection is None:
+                return
+            connection.execute(
+                "INSERT OR REPLACE INTO completions (key, value, expires) "
+                "VALUES (?, ?, ?)",
+                (key, json.dumps(value), expires),
+            )
+            self._writes += 1
+            # Prune expired entries and keep the store bounded every so often
+            if self._writes % 100 == 0:
+                connection.execute(
+                    "DELETE FROM completions WHERE expires <= ?", (time.time(),)
+                )
+                connection.execute(
+                    "DELETE FROM completions WHERE key NOT IN "
+                    "(SELECT key FROM completions ORDER BY expires DESC LIMIT ?)",
+                    (self.disk_maxsize,),
+                )
+            connection.commit()
+
+    def record(self, endpoint: str, value) -> None:
+        with self._lock:
+            stats = self.stats.setdefault(endpoint or "other", {"hits": 0, "misses": 0})
+            stats["hits" if value is not None else "misses"] += 1
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self.memory),
+                "endpoints": {
+                    endpoint: {
+                        **stats,
+                        "hit_ratio": round(
+                            stats["hits"] / (stats["hits"] + stats["misses"]), 3
+                        ),
+                    }
+                    for endpoint, stats in self.stats.items()
+                },
+            }
+
+    def clear(self) -> None:
+        self.memory.clear()
+        with self._lock:
+            connection = self.get_connection()
+            if connection is not None:
+                connection.execute("DELETE FROM completions")
+                connection.commit()
+
+
+completion_cache = CompletionCache(
+    int(os.environ.get("VERBA_COMPLETION_CACHE_SIZE", "1000")),
+    float(os.environ.get("VERBA_COMPLETION_CACHE_TTL", str(7 * 24 * 3600))),
+    os.environ.get("VERBA_COMPLETION_CACHE_PATH", ""),
+    int(os.environ.get("VERBA_COMPLETION_CACHE_DISK_SIZE", "100000")),
+)
@@ -10,6 +10,7 @@ except:
 
 from goldenverba.components.interfaces import Embedder
 from goldenverba.components.document import Document
+from goldenverba.components.types import InputNumber
 
 
 class MiniLMEmbedder(Embedder):
@@ -23,6 +24,13 @@ class MiniLMEmbedder(Embedder):
         self.requires_library = ["torch", "transformers", "accelerate"]
         self.description = "Embeds and retrieves objects using SentenceTransformer's all-MiniLM-L6-v2 model"
         self.vectorizer = "MiniLM"
+        self.config = {
+            "batch_size": InputNumber(
+                type="number",
+                value=32,
+                description="Number of token windows per forward pass",
+            ),
+        }
         self.model = None
         self.tokenizer = None
         try:
@@ -57,72 +65,94 @@ class MiniLMEmbedder(Embedder):
         @parameter: batch_size : int - Batch Size of Input
         @returns bool - Bool whether the embedding what successful.
         """
-        for document in tqdm(
-            documents, total=len(documents), desc="Vectorizing document chunks"
+        chunks = [chunk for document in documents for chunk in document.chunks]
+        texts = [
+            document.name + " : " + chunk.text
+            for document in documents
+            for chunk in document.chunks
+        ]
+
+        # Tokenize and vectorize a few batches worth of chunks at a time to bound memory
+        step = self.config["batch_size"].value * 8
+        for start in tqdm(
+            range(0, len(texts), step),
+            total=-(-len(texts) // step),
+            desc="Vectorizing document chunks",
         ):
-            for chunk in tqdm(
-                document.chunks,
-                total=len(document.chunks),
-                desc="Vectorizing Chunks",
-            ):
-                chunk.set_vector(
-                    self.vectorize_chunk(document.name + " : " + chunk.text)
-                )
+            vectors = self.vectorize_texts(texts[start : start + step])
+            for chunk, vector in zip(chunks[start : start + step], vectors):
+                chunk.set_vector(vector)
 
         return self.import_data(documents, client, logging)
 
-    def vectorize_chunk(self, chunk) -> list[float]:
-        try:
-            text = chunk
-            tokens = self.tokenizer.tokenize(text)
-
-            max_length = (
-                self.tokenizer.model_max_length
-            )  # Get the max sequence length for the model
-            batches = []
-            batch = []
-            token_count = 0
-
-            for token in tokens:
-                token_length = len(
-                    self.tokenizer.encode(token, add_special_tokens=False)
-                )
-                if token_count + token_length <= max_length:
-                    batch.append(token)
-                    token_count += token_length
-                else:
-                    batches.append(" ".join(batch))
-                    batch = [token]
-                    token_count = token_length
-
-            # Don't forget to add the last batch
-            if batch:
-                batches.append(" ".join(batch))
-
-            embeddings = []
-
-            for batch in batches:
-                inputs = self.tokenizer(
-                    batch, return_tensors="pt", padding=True, truncation=True
+    def vectorize_chunks(self, texts: list[str]) -> list[list[float]]:
+        """Vectorize a list of texts in padded batches
+        Texts longer than the model's max length are split into overflow windows whose
+        embeddings are averaged.
+        @parameter: texts : list[str] - Texts to vectorize
+        @returns list[list[float]] - One embedding per text.
+        """
+        if not texts:
+            return []
+
+        encoded = self.tokenizer(
+            texts,
+            truncation=True,
+            max_length=self.tokenizer.model_max_length,
+            return_overflowing_tokens=True,
+        )
+        sample_mapping = encoded.pop("overflow_to_sample_mapping")
+        features = list(encoded.keys())
+
+        # Sort windows by length so every batch is padded as little as possible
+        order = sorted(
+            range(len(sample_mapping)),
+            key=lambda i: len(encoded["input_ids"][i]),
+        )
+        batch_size = max(1, self.config["batch_size"].value)
+        sums = [None] * len(texts)
+        counts = [0] * len(texts)
+
+        with torch.inference_mode():
+            for start in range(0, len(order), batch_size):
+                window_ids = order[start : start + batch_size]
+                inputs = self.tokenizer.pad(
+                    {
+                        feature: [encoded[feature][i] for i in window_ids]
+                        for feature in features
+                    },
+                    return_tensors="pt",
                 )
                 inputs = {k: v.to(self.device) for k, v in inputs.items()}
-                with torch.no_grad():
-                    outputs = self.model(**inputs)
-                # Taking the mean of the hidden states to obtain an embedding for the batch
-                embedding = outputs.last_hidden_state.mean(dim=1)
-                embeddings.append(embedding)
-
-            # Concatenate the embeddings to make averaging easier
-            all_embeddings = torch.cat(embeddings)
+                outputs = self.model(**inputs)
 
-            averaged_embedding = all_embeddings.mean(dim=0)
-
-            averaged_embedding_list = averaged_embedding.tolist()
-
-            return averaged_embedding_list
+                # Mean pooling over the real tokens only
+                mask = (
+                    inputs["attention_mask"]
+                    .unsqueeze(-1)
+                    .to(outputs.last_hidden_state.dtype)
+                )
+                embeddings = (outputs.last_hidden_state * mask).sum(
+                    dim=1
+                ) / mask.sum(dim=1).clamp(min=1e-9)
+
+                for window_id, embedding in zip(window_ids, embeddings):
+                    sample = sample_mapping[window_id]
+                    if sums[sample] is None:
+                        sums[sample] = embedding
+                    else:
+                        sums[sample] = sums[sample] + embedding
+                    counts[sample] += 1
+
+        return [
+            (sums[i] / counts[i]).tolist() for i in range(len(texts))
+        ]
 
-        except Exception:
-            raise
+    def vectorize_chunk(self, chunk) -> list[float]:
+        return self.vectorize_chunks([chunk])[0]
 
     def vectorize_query(self, query: str) -> list[float]:
-        return self.vectorize_chunk(query)
+        return self.vectorize_texts([query])[0]
+
+    def get_model_name(self) -> str:
+        return "sentence-transformers/all-MiniLM-L6-v2"
@@ -1,11 +1,15 @@
+from concurrent.futures import ThreadPoolExecutor
+
 from tqdm import tqdm
+from wasabi import msg
 from weaviate import Client
 import os
-import requests
 import json
 
 from goldenverba.components.interfaces import Embedder
 from goldenverba.components.document import Document
+from goldenverba.components.ollama_client import ollama_client
+from goldenverba.components.types import InputNumber
 
 
 class OllamaEmbedder(Embedder):
@@ -16,10 +20,23 @@ class OllamaEmbedder(Embedder):
         self.requires_env = ["OLLAMA_URL"]
         self.description = "Embeds and retrieves objects using Ollama and the model specified in the environment variable 'OLLAMA_EMBED_MODEL' or 'OLLAMA_MODEL'"
         self.vectorizer = "OLLAMA"
-        self.url = os.environ.get("OLLAMA_URL", "")
+        self.config = {
+            "batch_size": InputNumber(
+                type="number",
+                value=int(os.environ.get("OLLAMA_EMBED_BATCH_SIZE", "32")),
+                description="Number of chunks per embedding request",
+            ),
+            "concurrency": InputNumber(
+                type="number",
+                value=int(os.environ.get("OLLAMA_EMBED_CONCURRENCY", "4")),
+                description="Number of embedding requests in flight",
+            ),
+        }
         self.model = os.environ.get(
             "OLLAMA_EMBED_MODEL", os.environ.get("OLLAMA_MODEL", "")
         )
+        # None until the first batch request tells us whether /api/embed exists
+        self.supports_batch = None
 
     def embed(
         self,
@@ -33,32 +50,90 @@ class OllamaEmbedder(Embedder):
         @parameter: batch_size : int - Batch Size of Input
         @returns bool - Bool whether the embedding what successful.
         """
-        for document in tqdm(
-            documents, total=len(documents), desc="Vectorizing document chunks"
-        ):
-            for chunk in tqdm(
-                document.chunks,
-                total=len(document.chunks),
-                desc="Vectorizing Chunks",
+        chunks = [chunk for document in documents for chunk in document.chunks]
+        texts = [
+            document.name + " : " + chunk.text
+            for document in documents
+            for chunk in document.chunks
+        ]
+
+        vectors = self.vectorize_texts(texts)
+        for chunk, vector in zip(chunks, vectors):
+            chunk.set_vector(vector)
+
+        return self.import_data(documents, client, logging)
+
+    def vectorize_chunks(self, texts: list[str]) -> list[list[float]]:
+        """Vectorize a list of texts with batched requests, running a bounded number of
+        requests concurrently
+        @parameter: texts : list[str] - Texts to vectorize
+        @returns list[list[float]] - One embedding per text.
+        """
+        if not texts:
+            return []
+
+        batch_size = max(1, self.config["batch_size"].value)
+        concurrency = max(1, self.config["concurrency"].value)
+
+        batches = [
+            texts[start : start + batch_size]
+            for start in range(0, len(texts), batch_size)
+        ]
+
+        # Probe batch support with the first request before fanning out
+        vectors = self.vectorize_batch(batches[0], concurrency)
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            for batch_vectors in tqdm(
+                executor.map(
+                    lambda batch: self.vectorize_batch(batch, concurrency),
+                    batches[1:],
+                ),
+                total=len(batches) - 1,
+                desc="Vectorizing document chunks",
             ):
-                chunk.set_vector(
-                    self.vectorize_chunk(document.name + " : " + chunk.text)
+                vectors.extend(batch_vectors)
+
+        return vectors
+
+    def vectorize_batch(
+        self, texts: list[str], pool_size: int = 1
+    ) -> list[list[float]]:
+        if self.supports_batch is not False:
+            response = ollama_client.post(
+                "/api/embed",
+                {"model": self.model, "input": texts},
+                pool_size,
+            )
+            if response.status_code == 404 and "model" not in response.text:
+                # Servers before /api/embed only know the single-prompt endpoint
+                msg.warn(
+                    "Ollama does not support batch embeddings, "
+                    "falling back to /api/embeddings"
                 )
+                self.supports_batch = False
+            else:
+                response.raise_for_status()
+                self.supports_batch = True
+                return json.loads(response.text).get("embeddings", [])
 
-        return self.import_data(documents, client, logging)
+        return [self.vectorize_single(text, pool_size) for text in texts]
+
+    def vectorize_single(self, text: str, pool_size: int = 1) -> list[float]:
+        response = ollama_client.post(
+            "/api/embeddings",
+            {"model": self.model, "prompt": text},
+            pool_size,
+        )
+        response.raise_for_status()
+        json_data = json.loads(response.text)
+        return json_data.get("embedding", [])
 
     def vectorize_chunk(self, chunk) -> list[float]:
-        try:
-            embeddings = []
-            embedding_url = self.url + "/api/embeddings"
-            data = {"model": self.model, "prompt": chunk}
-            response = requests.post(embedding_url, json=data)
-            json_data = json.loads(response.text)
-            embeddings = json_data.get("embedding", [])
-            return embeddings
-
-        except Exception:
-            raise
+        return self.vectorize_chunks([chunk])[0]
 
     def vectorize_query(self, query: str) -> list[float]:
-        return self.vectorize_chunk(query)
+        return self.vectorize_texts([query])[0]
+
+    def get_model_name(self) -> str:
+        return self.model
@@ -1,7 +1,18 @@
 import os
-import json
-import aiohttp
+from contextlib import aclosing
+
 from goldenverba.components.interfaces import Generator
+from goldenverba.components.ollama_client import ollama_client
+from goldenverba.components.types import ClassificationResult
+from goldenverba.components.cache import completion_cache
+
+# Greedy, seeded sampling: the same prompt always gets the same answer, which also makes
+# it cacheable
+DETERMINISTIC_OPTIONS = {"temperature": 0, "top_k": 1, "seed": 0}
+
+# Enough tokens for labels like "Highly Irrelevant", anything longer is the model
+# explaining itself
+CLASSIFY_NUM_PREDICT = int(os.environ.get("OLLAMA_CLASSIFY_NUM_PREDICT", "8"))
 
 
 class OllamaGenerator(Generator):
@@ -20,6 +31,8 @@ class OllamaGenerator(Generator):
         conversation: dict = None,
         system_prompt: str = "",
         user_prompt: str = "",
+        format: dict = None,
+        options: dict = None,
     ):
         """Generate a stream of response dicts based on a list of queries and list of contexts, and includes conversational context.
         @parameter: queries : list[str] - List of queries
@@ -27,6 +40,8 @@ class OllamaGenerator(Generator):
         @parameter: conversation : dict - Conversational context
         @parameter: system_prompt : str - System prompt to guide the behavior of the model.
         @parameter: user_prompt : str - Custom user prompt to use in the conversation.
+        @parameter: format : dict - JSON schema the output has to follow.
+        @parameter: options : dict - Ollama model options, e.g. temperature.
         @returns Iterator[dict] - Token response generated by the Generator in this format {system:TOKEN, finish_reason:stop or empty}.
         """
 
@@ -41,7 +56,7 @@ class OllamaGenerator(Generator):
 
         system_prompt = system_prompt or default_system_prompt
 
-        url = os.environ.get("OLLAMA_URL", "")
+        url = ollama_client.get_url()
         model = os.environ.get("OLLAMA_MODEL", "")
         if url == "":
             yield {
@@ -49,42 +64,77 @@ class OllamaGenerator(Generator):
                 "finish_reason": "stop",
             }
 
-        url += "/api/chat"
-
         if conversation is None:
             conversation = {}
         messages = self.prepare_messages(
             queries, context, conversation, system_prompt, user_prompt
         )
         try:
-            data = {"model": model, "messages": messages}
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, json=data) as response:
-                    async for line in response.content:
-                        if line.strip():  # Ensure line is not just whitespace
-                            json_data = json.loads(
-                                line.decode("utf-8")
-                            )  # Decode bytes to string then to JSON
-                            message = json_data.get("message", {}).get(
-                                "content", ""
-                            )
-                            finish_reason = (
-                                "stop" if json_data.get("done", False) else ""
-                            )
-
-                            yield {
-                                "message": message,
-                                "finish_reason": finish_reason,
-                            }
-                        else:
-                            yield {
-                                "message": "",
-                                "finish_reason": "stop",
-                            }
+            async for result in ollama_client.chat_stream(
+                model, messages, format, options
+            ):
+                yield result
 
         except Exception:
             raise
 
+    async def classify(
+        self,
+        labels: list[str],
+        system_prompt: str,
+        user_prompt: str,
+    ) -> ClassificationResult:
+        """Classify a prompt into one of a fixed set of labels, stopping as soon as the
+        answer is unambiguous
+        @parameter: labels : list[str] - Allowed answers, e.g. ["YES", "NO"]
+        @parameter: system_prompt : str - System prompt
+        @parameter: user_prompt : str - User prompt
+        @returns ClassificationResult - Matched label (None if the output matched none)
+            and the raw output.
+        """
+        model = os.environ.get("OLLAMA_MODEL", "")
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt},
+        ]
+        options = {**DETERMINISTIC_OPTIONS, "num_predict": CLASSIFY_NUM_PREDICT}
+
+        key = completion_cache.get_key("classify", labels, model, messages, options)
+        cached = completion_cache.get(key)
+        if cached is not None:
+            return ClassificationResult(**cached)
+
+        result = await self.stream_classification(model, messages, options, labels)
+        if result.text:
+            completion_cache.set(key, result.model_dump())
+        return result
+
+    async def stream_classification(
+        self, model: str, messages: list[dict], options: dict, labels: list[str]
+    ) -> ClassificationResult:
+        text = ""
+        stats = {}
+        # aclosing releases the connection when we stop reading early
+        async with aclosing(
+            ollama_client.chat_stream(model, messages, options=options)
+        ) as stream:
+            async for result in stream:
+                text += result["message"]
+                if result["finish_reason"] == "stop":
+                    stats = result.get("stats", {})
+                    break
+                label = self.match_label(text, labels)
+                if label is not None:
+                    return ClassificationResult(
+                        label=label, text=text, early_stop=True
+                    )
+
+        return ClassificationResult(
+            label=self.match_label(text, labels, final=True),
+            text=text,
+            stats=stats,
+        )
+
     def prepare_messages(
         self,
         queries: list[str],
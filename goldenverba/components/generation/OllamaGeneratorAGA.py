@@ -1,9 +1,8 @@
 import os
 
-import json
-import aiohttp
 
 from goldenverba.components.interfaces import Generator
+from goldenverba.components.ollama_client import ollama_client
 
 
 class OllamaGeneratorAGA(Generator):
@@ -28,7 +27,7 @@ class OllamaGeneratorAGA(Generator):
         @returns Iterator[dict] - Token response generated by the Generator in this format {system:TOKEN, finish_reason:stop or empty}.
         """
 
-        url = os.environ.get("OLLAMA_URL", "")
+        url = ollama_client.get_url()
         model = os.environ.get("OLLAMA_MODEL", "")
         if url == "":
             yield {
@@ -36,37 +35,13 @@ class OllamaGeneratorAGA(Generator):
                 "finish_reason": "stop",
             }
 
-        url += "/api/chat"
-
         if conversation is None:
             conversation = {}
         messages = self.prepare_messages(queries, context, conversation)
 
         try:
-            data = {"model": model, "messages": messages}
-            async with aiohttp.ClientSession() as session:
-                async with session.post(url, json=data) as response:
-                    async for line in response.content:
-                        if line.strip():  # Ensure line is not just whitespace
-                            json_data = json.loads(
-                                line.decode("utf-8")
-                            )  # Decode bytes to string then to JSON
-                            message = json_data.get("message", {}).get(
-                                "content", ""
-                            )
-                            finish_reason = (
-                                "stop" if json_data.get("done", False) else ""
-                            )
-
-                            yield {
-                                "message": message,
-                                "finish_reason": finish_reason,
-                            }
-                        else:
-                            yield {
-                                "message": "",
-                                "finish_reason": "stop",
-                            }
+            async for result in ollama_client.chat_stream(model, messages):
+                yield result
 
         except Exception:
             raise
@@ -0,0 +1,91 @@
+import os
+import threading
+from collections import deque
+
+
+class RequestHedger:
+    """
+    Decides when a slow LLM call gets a duplicate (hedge) sent to another backend. The
+    hedge delay is a percentile of recently observed times to first token, clamped to
+    [min_delay, max_delay], and hedges are limited to a fraction (budget) of all
+    requests so a slow cluster is not doubled in load.
+    """
+
+    def __init__(
+        self,
+        enabled: bool = False,
+        percentile: float = 95.0,
+        min_delay: float = 1.0,
+        max_delay: float = 30.0,
+        budget: float = 0.1,
+        window: int = 500,
+        min_samples: int = 20,
+    ):
+        self.enabled = enabled
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.budget = budget
+        self.min_samples = min_samples
+        self.ttft = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.budget_exhausted = 0
+
+    def record_request(self) -> None:
+        with self._lock:
+            self.requests += 1
+
+    def record_ttft(self, seconds: float) -> None:
+        with self._lock:
+            self.ttft.append(seconds)
+
+    def get_delay(self) -> float:
+        """Returns how long to wait for the first token before hedging, max_delay until
+        enough samples exist."""
+        with self._lock:
+            samples = sorted(self.ttft)
+        if len(samples) < self.min_samples:
+            return self.max_delay
+        index = min(len(samples) - 1, int(len(samples) * self.percentile / 100))
+        return min(self.max_delay, max(self.min_delay, samples[index]))
+
+    def try_hedge(self) -> bool:
+        """Takes a hedge from the budget
+        @returns bool - Whether a hedge may be sent.
+        """
+        with self._lock:
+            if self.hedges + 1 > self.budget * self.requests:
+                self.budget_exhausted += 1
+                return False
+            self.hedges += 1
+            return True
+
+    def record_win(self, hedge_won: bool) -> None:
+        if hedge_won:
+            with self._lock:
+                self.hedge_wins += 1
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = {
+                "enabled": self.enabled,
+                "requests": self.requests,
+                "hedges": self.hedges,
+                "hedge_wins": self.hedge_wins,
+                "budget_exhausted": self.budget_exhausted,
+                "ttft_samples": len(self.ttft),
+            }
+        stats["delay"] = round(self.get_delay(), 3)
+        return stats
+
+
+request_hedger = RequestHedger(
+    enabled=os.environ.get("OLLAMA_HEDGE", "false").lower() in ("1", "true", "yes"),
+    percentile=float(os.environ.get("OLLAMA_HEDGE_PERCENTILE", "95")),
+    min_delay=float(os.environ.get("OLLAMA_HEDGE_MIN_DELAY", "1")),
+    max_delay=float(os.environ.get("OLLAMA_HEDGE_MAX_DELAY", "30")),
+    budget=float(os.environ.get("OLLAMA_HEDGE_BUDGET", "0.1")),
+)
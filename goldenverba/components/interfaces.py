@@ -1,8 +1,15 @@
 from goldenverba.components.document import Document
 from goldenverba.components.chunk import Chunk
-from goldenverba.components.types import InputText, FileData, InputNumber
+from goldenverba.components.cache import chunk_cache, embedding_cache
+from goldenverba.components.types import (
+    InputText,
+    FileData,
+    InputNumber,
+    ClassificationResult,
+)
 
 import os
+import re
 import time
 from dotenv import load_dotenv
 
@@ -20,6 +27,7 @@ except Exception:
 from goldenverba.components.schema.schema_generation import (
     EMBEDDINGS,
     VECTORIZERS,
+    get_course_properties,
     strip_non_letters,
 )
 
@@ -221,6 +229,7 @@ class Embedder(VerbaComponent):
                         "doc_link": str(document.link),
                         "chunk_count": len(document.chunks),
                         "timestamp": str(document.timestamp),
+                        **self.get_course_properties(document),
                     }
 
                     class_name = "VERBA_Document_" + strip_non_letters(
@@ -231,6 +240,8 @@ class Embedder(VerbaComponent):
                     for chunk in document.chunks:
                         chunk.set_uuid(uuid)
 
+                chunk_cache.invalidate(self.get_chunk_class(), document.name)
+
                 chunk_count = 0
                 for _batch_id, chunk_batch in tqdm(
                     enumerate(batches),
@@ -248,6 +259,7 @@ class Embedder(VerbaComponent):
                                 "doc_uuid": chunk.doc_uuid,
                                 "doc_type": chunk.doc_type,
                                 "chunk_id": chunk.chunk_id,
+                                **self.get_course_properties(document),
                             }
                             class_name = "VERBA_Chunk_" + strip_non_letters(
                                 self.vectorizer
@@ -381,6 +393,8 @@ class Embedder(VerbaComponent):
             },
         )
 
+        chunk_cache.invalidate(chunk_class_name, doc_name)
+
         msg.warn(f"Deleted document {doc_name} and its chunks")
 
     def remove_document_by_id(self, client: Client, doc_id: str):
@@ -398,8 +412,18 @@ class Embedder(VerbaComponent):
             },
         )
 
+        chunk_cache.invalidate(chunk_class_name, doc_uuid=doc_id)
+
         msg.warn(f"Deleted document {doc_id} and its chunks")
 
+    def get_course_properties(self, document: Document) -> dict:
+        """Returns the course properties of a document, from the course id it was
+        imported with or, without one, from its name (e.g. CS101_lecture1.pdf)
+        @parameter: document : Document - Verba document
+        @returns dict - course_id and course_from_name.
+        """
+        return get_course_properties(document.name, document.meta.get("course_id"))
+
     def get_document_class(self) -> str:
         return "VERBA_Document_" + strip_non_letters(self.vectorizer)
 
@@ -470,6 +494,63 @@ class Embedder(VerbaComponent):
             "vectorize_query method must be implemented by a subclass."
         )
 
+    def vectorize_chunk(self, chunk: str) -> list[float]:
+        raise NotImplementedError(
+            "vectorize_chunk method must be implemented by a subclass."
+        )
+
+    def vectorize_chunks(self, texts: list[str]) -> list[list[float]]:
+        """Vectorize a list of texts, subclasses can override this with a batched
+        implementation
+        @parameter: texts : list[str] - Texts to vectorize
+        @returns list[list[float]] - One embedding per text.
+        """
+        return [self.vectorize_chunk(text) for text in texts]
+
+    def get_model_name(self) -> str:
+        """Name of the model producing the vectors, part of the embedding cache key."""
+        return self.name
+
+    def vectorize_texts(self, texts: list[str]) -> list[list[float]]:
+        """Vectorize a list of texts through the embedding cache, only texts that
+        were never embedded by this vectorizer and model reach vectorize_chunks
+        @parameter: texts : list[str] - Texts to vectorize
+        @returns list[list[float]] - One embedding per text.
+        """
+        model = self.get_model_name()
+        keys = [
+            embedding_cache.get_key(self.vectorizer, model, text)
+            for text in texts
+        ]
+        vectors = embedding_cache.get_many(keys)
+
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                missing[key] = text
+
+        if missing:
+            new_vectors = self.vectorize_chunks(list(missing.values()))
+            # A short or empty answer must not end up in the cache, it would be
+            # returned for these texts from then on
+            if len(new_vectors) != len(missing):
+                raise Exception(
+                    f"{self.name} returned {len(new_vectors)} vectors for "
+                    f"{len(missing)} texts"
+                )
+            dimensions = {len(vector) for vector in new_vectors}
+            dimensions.update(len(vector) for vector in vectors.values())
+            if 0 in dimensions or len(dimensions) > 1:
+                raise Exception(
+                    f"{self.name} returned vectors of inconsistent dimensions "
+                    f"{sorted(dimensions)}"
+                )
+            new_vectors = dict(zip(missing.keys(), new_vectors))
+            embedding_cache.set_many(new_vectors)
+            vectors.update(new_vectors)
+
+        return [vectors[key] for key in keys]
+
     def conversation_to_query(
         self, queries: list[str], conversation: dict
     ) -> str:
@@ -608,11 +689,13 @@ class Retriever(VerbaComponent):
         queries: list[str],
         client: Client,
         embedder: Embedder,
+        course_id: str = None,
     ) -> tuple[list[Chunk], str]:
         """Ingest data into Weaviate
         @parameter: queries : list[str] - List of queries
         @parameter: client : Client - Weaviate client
         @parameter: embedder : Embedder - Current selected Embedder
+        @parameter: course_id : str - Only retrieve chunks of this course
         @returns tuple(list[Chunk],str) - List of retrieved chunks and the context string.
         """
         raise NotImplementedError(
@@ -683,6 +766,61 @@ class Generator(VerbaComponent):
             "generate_stream method must be implemented by a subclass."
         )
 
+    async def classify(
+        self,
+        labels: list[str],
+        system_prompt: str,
+        user_prompt: str,
+    ) -> ClassificationResult:
+        """Classify a prompt into one of a fixed set of labels with a short,
+        deterministic generation
+        @parameter: labels : list[str] - Allowed answers, e.g. ["YES", "NO"]
+        @parameter: system_prompt : str - System prompt
+        @parameter: user_prompt : str - User prompt
+        @returns ClassificationResult - Matched label (None if the output matched none)
+            and the raw output.
+        """
+        raise NotImplementedError(
+            "classify method must be implemented by a subclass."
+        )
+
+    @staticmethod
+    def normalize_label(text: str) -> str:
+        return " ".join(re.sub(r"[^a-z0-9]+", " ", text.lower()).split())
+
+    def match_label(self, text: str, labels: list[str], final: bool = False) -> str:
+        """Match generated text against the allowed labels
+        @parameter: text : str - Generated text so far
+        @parameter: labels : list[str] - Allowed answers
+        @parameter: final : bool - Whether the generation is complete
+        @returns str - Matched label, None while the text is still ambiguous or matches
+            no label.
+        """
+        normalized = self.normalize_label(text)
+        by_normalized = {self.normalize_label(label): label for label in labels}
+
+        # Exact answer, unambiguous unless a longer label continues it (e.g. "highly" ->
+        # "highly irrelevant")
+        if normalized in by_normalized:
+            if final or not any(
+                other != normalized and other.startswith(normalized)
+                for other in by_normalized
+            ):
+                return by_normalized[normalized]
+            return None
+
+        if not final:
+            return None
+
+        # Rambling answer: take the earliest label mentioned as whole words, longest
+        # first on ties
+        matches = []
+        for candidate, label in by_normalized.items():
+            match = re.search(rf"\b{re.escape(candidate)}\b", normalized)
+            if match:
+                matches.append((match.start(), -len(candidate), label))
+        return min(matches)[2] if matches else None
+
     def prepare_messages(
         self,
         queries: list[str],
@@ -247,15 +247,17 @@ class RetrieverManager:
         client: Client,
         embedder: Embedder,
         generator: Generator,
+        course_id: str = None,
     ) -> list[Chunk]:
         """Ingest data into Weaviate
         @parameter: queries : list[str] - List of queries
         @parameter: client : Client - Weaviate client
         @parameter: embedder : Embedder - Current selected Embedder
+        @parameter: course_id : str - Only retrieve chunks of this course
         @returns list[Chunk] - List of retrieved chunks.
         """
         chunks, context = self.retrievers[self.selected_retriever].retrieve(
-            queries, client, embedder
+            queries, client, embedder, course_id
         )
         managed_context = self.retrievers[self.selected_retriever].cutoff_text(
             context, generator.context_window
@@ -0,0 +1,316 @@
+import os
+import json
+import time
+import asyncio
+from contextlib import aclosing
+
+import requests
+from dotenv import load_dotenv
+from wasabi import msg
+
+from goldenverba.components.scheduler import llm_scheduler
+from goldenverba.components.ollama_router import ollama_router, OllamaRequestError
+from goldenverba.components.hedging import request_hedger
+
+try:
+    import aiohttp
+except Exception:
+    msg.warn("aiohttp not installed, Ollama generators will not be available.")
+
+load_dotenv()
+
+
+class OllamaClient:
+    """
+    Process-wide connection pool for all Ollama calls.
+    Generators share one keep-alive aiohttp session and embedders one requests session,
+    instead of opening a new connection for every generation or embedding.
+    """
+
+    def __init__(self):
+        self.max_connections = int(
+            os.environ.get("OLLAMA_POOL_MAX_CONNECTIONS", "32")
+        )
+        self.keepalive_timeout = float(
+            os.environ.get("OLLAMA_POOL_KEEPALIVE", "75")
+        )
+        self.connect_timeout = float(
+            os.environ.get("OLLAMA_CONNECT_TIMEOUT", "10")
+        )
+        # Maximum time between two streamed lines, a full generation can take much
+        # longer
+        self.read_timeout = float(os.environ.get("OLLAMA_READ_TIMEOUT", "300"))
+        self._session = None
+        self._sync_session = None
+        self._sync_pool_size = 0
+        self._probe_task = None
+
+    def get_url(self) -> str:
+        """Returns the first configured Ollama host, calls are spread over all of them
+        by the router."""
+        return ollama_router.get_url()
+
+    async def start(self) -> None:
+        """Opens the async session and starts the backend health probes, called on
+        FastAPI startup."""
+        self.get_session()
+        if self._probe_task is None:
+            self._probe_task = asyncio.create_task(self.probe_backends())
+        msg.info(
+            f"Ollama client pool started ({self.max_connections} connections, "
+            f"{len(ollama_router.get_backends())} backends)"
+        )
+
+    async def probe_backends(self) -> None:
+        """Periodically health-checks the Ollama hosts and refreshes their model
+        lists."""
+        while True:
+            try:
+                await asyncio.to_thread(ollama_router.probe_all)
+            except Exception as e:
+                msg.warn(f"Ollama backend probe failed: {str(e)}")
+            await asyncio.sleep(ollama_router.probe_interval)
+
+    async def close(self) -> None:
+        """Closes all pooled connections, called on FastAPI shutdown."""
+        if self._probe_task is not None:
+            self._probe_task.cancel()
+            self._probe_task = None
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        if self._sync_session is not None:
+            self._sync_session.close()
+            self._sync_session = None
+            self._sync_pool_size = 0
+
+    def get_session(self) -> "aiohttp.ClientSession":
+        """Returns the shared async session, created lazily if startup did not run (e.g.
+        scripts)."""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.max_connections,
+                    keepalive_timeout=self.keepalive_timeout,
+                ),
+                timeout=aiohttp.ClientTimeout(
+                    total=None,
+                    connect=self.connect_timeout,
+                    sock_read=self.read_timeout,
+                ),
+            )
+        return self._session
+
+    def get_sync_session(self, pool_size: int = 1) -> requests.Session:
+        """Returns the shared blocking session, grown so that pool_size threads can each
+        hold a connection."""
+        if self._sync_session is None:
+            self._sync_session = requests.Session()
+        if self._sync_pool_size < pool_size:
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1, pool_maxsize=pool_size
+            )
+            self._sync_session.mount("http://", adapter)
+            self._sync_session.mount("https://", adapter)
+            self._sync_pool_size = pool_size
+        return self._sync_session
+
+    def post(self, path: str, data: dict, pool_size: int = 1):
+        """Blocking POST to the Ollama API
+        @parameter: path : str - API path, e.g. /api/embed
+        @parameter: data : dict - JSON request body
+        @parameter: pool_size : int - Number of threads sharing the session
+        @returns requests.Response - The response.
+        """
+        with ollama_router.route(data.get("model")) as route:
+            response = self.get_sync_session(pool_size).post(
+                route.url + path,
+                json=data,
+                timeout=(self.connect_timeout, self.read_timeout),
+            )
+            route.failed = response.status_code >= 500
+        return response
+
+    def get_stats(self, json_data: dict) -> dict:
+        """Extracts the token counts and timings (converted from ns to ms) of a finished
+        Ollama response."""
+        stats = {}
+        for key in ["prompt_eval_count", "eval_count"]:
+            if key in json_data:
+                stats[key] = json_data[key]
+        for key in [
+            "total_duration",
+            "load_duration",
+            "prompt_eval_duration",
+            "eval_duration",
+        ]:
+            if key in json_data:
+                stats[key.replace("_duration", "_ms")] = round(
+                    json_data[key] / 1e6, 1
+                )
+        return stats
+
+    async def chat_stream(
+        self,
+        model: str,
+        messages: list[dict],
+        format: dict = None,
+        options: dict = None,
+    ):
+        """Streams a chat completion from Ollama
+        @parameter: model : str - Ollama model
+        @parameter: messages : list[dict] - Chat messages
+        @parameter: format : dict - JSON schema (or "json") the output has to follow
+        @parameter: options : dict - Model options, e.g. temperature or num_predict
+        @returns Iterator[dict] - Token responses in this format {message:TOKEN,
+            finish_reason:stop or empty}, the last one also carries the response stats.
+        """
+        data = {"model": model, "messages": messages}
+        if format is not None:
+            data["format"] = format
+        if options:
+            data["options"] = options
+        final = None
+        # Waits for a backend slot according to the priority class of the current
+        # request
+        async with llm_scheduler.slot():
+            async with aclosing(self.hedged_stream(model, data)) as stream:
+                async for result in stream:
+                    if result["finish_reason"] == "stop" and "stats" in result:
+                        # Free the slot before handing out the last chunk, callers stop
+                        # reading there
+                        final = result
+                        break
+                    yield result
+        if final is not None:
+            yield final
+
+    async def stream_chat(self, model: str, data: dict, used: list, exclude=None):
+        """Streams one /api/chat call on a routed backend
+        @parameter: model : str - Ollama model, used for routing
+        @parameter: data : dict - Request body
+        @parameter: used : list - Receives the url of the selected backend
+        @parameter: exclude : list[str] - Backend urls to avoid
+        @returns Iterator[dict] - Token responses, see chat_stream.
+        """
+        session = self.get_session()
+        with ollama_router.route(model, exclude) as route:
+            used.append(route.url)
+            async with session.post(route.url + "/api/chat", json=data) as response:
+                # An error body is not a token. A 5xx counts against the host, a 4xx
+                # was caused by the request and leaves the host's health untouched
+                route.failed = response.status >= 500
+                if 400 <= response.status < 500:
+                    raise OllamaRequestError(response.status, await response.text())
+                response.raise_for_status()
+                async for line in response.content:
+                    if line.strip():  # Ensure line is not just whitespace
+                        json_data = json.loads(
+                            line.decode("utf-8")
+                        )  # Decode bytes to string then to JSON
+                        message = json_data.get("message", {}).get("content", "")
+                        finish_reason = "stop" if json_data.get("done", False) else ""
+
+                        result = {
+                            "message": message,
+                            "finish_reason": finish_reason,
+                        }
+                        if finish_reason == "stop":
+                            result["stats"] = self.get_stats(json_data)
+                        yield result
+                    else:
+                        yield {
+                            "message": "",
+                            "finish_reason": "stop",
+                        }
+
+    async def hedged_stream(self, model: str, data: dict):
+        """Streams a chat call, sending a duplicate to another backend if no first token
+        arrives within the hedge delay.
+        Whichever stream yields first is used, the other one is cancelled. If every
+        stream fails before its first token, the call is retried once on a backend that
+        was not tried yet.
+        """
+        start = time.perf_counter()
+        request_hedger.record_request()
+        used = []
+        hedged = False
+        primary = self.stream_chat(model, data, used)
+        streams = [primary]
+        pending = {asyncio.create_task(get_first(primary)): primary}
+        try:
+            if request_hedger.enabled and ollama_router.count_available(model) > 1:
+                done, _ = await asyncio.wait(
+                    set(pending), timeout=request_hedger.get_delay()
+                )
+                if not done and request_hedger.try_hedge():
+                    msg.info(f"Hedging slow Ollama call on {used}")
+                    hedged = True
+                    secondary = self.stream_chat(model, data, used, exclude=list(used))
+                    streams.append(secondary)
+                    pending[asyncio.create_task(get_first(secondary))] = secondary
+
+            winner = None
+            failed_over = False
+            while winner is None:
+                done, _ = await asyncio.wait(
+                    set(pending), return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    stream = pending.pop(task)
+                    if task.exception() is None:
+                        winner = (stream, task)
+                        break
+                    # A failed stream only counts if there is nothing left to wait for
+                    if pending:
+                        continue
+                    # A request error would fail on every backend, a host error is
+                    # retried once on a backend that has not been tried
+                    if (
+                        not failed_over
+                        and not isinstance(task.exception(), OllamaRequestError)
+                        and ollama_router.count_available(model, exclude=used) > 0
+                    ):
+                        failed_over = True
+                        msg.warn(f"Ollama call failed on {used}, retrying elsewhere")
+                        retry = self.stream_chat(model, data, used, exclude=list(used))
+                        streams.append(retry)
+                        pending[asyncio.create_task(get_first(retry))] = retry
+                        continue
+                    winner = (stream, task)
+                    break
+
+            stream, task = winner
+            if hedged:
+                request_hedger.record_win(stream is not primary)
+            # Cancel the loser and close its connection before streaming on
+            for loser in pending:
+                loser.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            for loser in pending.values():
+                await loser.aclose()
+            pending.clear()
+
+            first = task.result()  # Raises the error of a failed stream
+            if first is None:
+                return
+            request_hedger.record_ttft(time.perf_counter() - start)
+            yield first
+            async for result in stream:
+                yield result
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            for stream in streams:
+                await stream.aclose()
+
+
+async def get_first(stream):
+    """Returns the first item of an async iterator, None if it is empty."""
+    async for item in stream:
+        return item
+    return None
+
+
+ollama_client = OllamaClient()
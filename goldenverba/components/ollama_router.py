@@ -0,0 +1,256 @@
+import json
+import os
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+
+
+def normalize_model(model: str) -> str:
+    """Ollama treats "llama3.1" and "llama3.1:latest" as the same model."""
+    return model if ":" in model else model + ":latest"
+
+
+class OllamaBackend:
+    """
+    State of one Ollama host as seen by the router.
+    """
+
+    def __init__(self, url: str):
+        self.url = url.rstrip("/")
+        self.outstanding = 0
+        self.requests = 0
+        self.failures = 0
+        self.total_failures = 0
+        self.ejected_until = 0.0
+        # None until the first successful probe, then the models the host has pulled
+        self.models = None
+        self.last_probe = 0.0
+
+    def is_available(self, now: float) -> bool:
+        return self.ejected_until <= now
+
+    def has_model(self, model: str) -> bool:
+        return self.models is None or normalize_model(model) in self.models
+
+    def get_stats(self, now: float) -> dict:
+        return {
+            "url": self.url,
+            "available": self.is_available(now),
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "failures": self.total_failures,
+            "consecutive_failures": self.failures,
+            "models": sorted(self.models) if self.models is not None else None,
+        }
+
+
+class OllamaRequestError(Exception):
+    """
+    Error response caused by the request rather than the host (4xx, e.g. an unknown
+    model or a malformed body), it does not count against the host's health.
+    """
+
+    def __init__(self, status: int, message: str):
+        super().__init__(f"Ollama answered {status}: {message}")
+        self.status = status
+
+
+class OllamaRoute:
+    """
+    A routed call, set failed to count a failure that did not raise (e.g. a 5xx
+    response).
+    """
+
+    def __init__(self, backend: OllamaBackend):
+        self.backend = backend
+        self.url = backend.url
+        self.failed = False
+
+
+class OllamaRouter:
+    """
+    Spreads Ollama calls over several hosts (OLLAMA_URLS, comma-separated, falling back
+    to OLLAMA_URL). Each call goes to the available host with the fewest outstanding
+    requests that has the requested model. A host is ejected for eject_seconds after
+    max_failures consecutive failures and re-admitted by a successful health probe of
+    /api/tags or, once the ejection expires, by a successful call.
+    """
+
+    def __init__(
+        self,
+        urls: list[str] = None,
+        max_failures: int = 3,
+        eject_seconds: float = 30.0,
+        probe_interval: float = 30.0,
+        probe_timeout: float = 5.0,
+    ):
+        self.max_failures = max_failures
+        self.eject_seconds = eject_seconds
+        self.probe_interval = probe_interval
+        self.probe_timeout = probe_timeout
+        self._lock = threading.Lock()
+        self._static_urls = urls
+        self._config = None
+        self.backends = []
+        if urls is not None:
+            self.set_urls(urls)
+
+    @staticmethod
+    def get_env_urls() -> list[str]:
+        urls = os.environ.get("OLLAMA_URLS", "") or os.environ.get("OLLAMA_URL", "")
+        return [url.strip() for url in urls.split(",") if url.strip()]
+
+    def set_urls(self, urls: list[str]) -> None:
+        """Replaces the backend list, keeping the state of hosts that stay."""
+        with self._lock:
+            existing = {backend.url: backend for backend in self.backends}
+            self.backends = [
+                existing.get(url.rstrip("/")) or OllamaBackend(url) for url in urls
+            ]
+            self._config = list(urls)
+
+    def get_backends(self) -> list[OllamaBackend]:
+        if self._static_urls is None:
+            urls = self.get_env_urls()
+            if urls != self._config:
+                self.set_urls(urls)
+        return self.backends
+
+    def get_url(self) -> str:
+        """Returns the first configured host, for callers that only need to know one is
+        set."""
+        backends = self.get_backends()
+        return backends[0].url if backends else ""
+
+    def acquire(self, model: str = None, exclude: list[str] = None) -> OllamaBackend:
+        """Picks a host for a call and counts it as outstanding
+        @parameter: model : str - Model the call needs, None if any host will do
+        @parameter: exclude : list[str] - Host urls to avoid if any other host is left,
+            e.g. for a hedged duplicate
+        @returns OllamaBackend - Selected host.
+        """
+        backends = self.get_backends()
+        if not backends:
+            raise ValueError("No Ollama URL configured (OLLAMA_URL or OLLAMA_URLS)")
+
+        now = time.monotonic()
+        with self._lock:
+            available = [
+                backend for backend in backends if backend.is_available(now)
+            ]
+            # Every host ejected: try all of them rather than failing outright
+            candidates = available or backends
+            if exclude:
+                candidates = [
+                    backend for backend in candidates if backend.url not in exclude
+                ] or candidates
+            if model:
+                candidates = [
+                    backend for backend in candidates if backend.has_model(model)
+                ] or candidates
+            backend = min(
+                candidates, key=lambda backend: (backend.outstanding, backend.requests)
+            )
+            backend.outstanding += 1
+            backend.requests += 1
+            return backend
+
+    def release(self, backend: OllamaBackend, success: bool = None) -> None:
+        """Ends a call on a host
+        @parameter: backend : OllamaBackend - Host returned by acquire
+        @parameter: success : bool - Outcome of the call, None leaves the host's health
+            untouched.
+        """
+        with self._lock:
+            backend.outstanding -= 1
+            if success:
+                backend.failures = 0
+                backend.ejected_until = 0.0
+            elif success is not None:
+                self._record_failure(backend)
+
+    def _record_failure(self, backend: OllamaBackend) -> None:
+        backend.failures += 1
+        backend.total_failures += 1
+        if backend.failures >= self.max_failures:
+            backend.ejected_until = time.monotonic() + self.eject_seconds
+
+    @contextmanager
+    def route(self, model: str = None, exclude: list[str] = None):
+        """Routes one call, an exception inside the block counts as a host failure,
+        except for an OllamaRequestError
+        @parameter: model : str - Model the call needs
+        @parameter: exclude : list[str] - Host urls to avoid if possible
+        @returns OllamaRoute - Route with the selected host url.
+        """
+        route = OllamaRoute(self.acquire(model, exclude))
+        # Stays None on cancellation (BaseException), which is not the host's fault
+        success = None
+        try:
+            yield route
+            success = not route.failed
+        except OllamaRequestError:
+            raise
+        except Exception:
+            success = False
+            raise
+        finally:
+            self.release(route.backend, success)
+
+    def count_available(self, model: str = None, exclude: list[str] = None) -> int:
+        now = time.monotonic()
+        return sum(
+            1
+            for backend in self.get_backends()
+            if backend.is_available(now)
+            and (not model or backend.has_model(model))
+            and backend.url not in (exclude or [])
+        )
+
+    def probe(self, backend: OllamaBackend) -> bool:
+        """Checks a host through /api/tags and refreshes its model list
+        @parameter: backend : OllamaBackend - Host to probe
+        @returns bool - Whether the host answered.
+        """
+        try:
+            with urllib.request.urlopen(
+                backend.url + "/api/tags", timeout=self.probe_timeout
+            ) as response:
+                tags = json.loads(response.read().decode("utf-8"))
+            models = {
+                normalize_model(model["name"]) for model in tags.get("models", [])
+            }
+        except Exception:
+            with self._lock:
+                backend.last_probe = time.monotonic()
+                self._record_failure(backend)
+            return False
+
+        with self._lock:
+            backend.last_probe = time.monotonic()
+            backend.models = models
+            backend.failures = 0
+            backend.ejected_until = 0.0
+        return True
+
+    def probe_all(self, force: bool = False) -> None:
+        """Probes every host whose last probe is older than probe_interval."""
+        now = time.monotonic()
+        for backend in self.get_backends():
+            if force or now - backend.last_probe >= self.probe_interval:
+                self.probe(backend)
+
+    def get_stats(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                "backends": [backend.get_stats(now) for backend in self.backends]
+            }
+
+
+ollama_router = OllamaRouter(
+    max_failures=int(os.environ.get("OLLAMA_MAX_FAILURES", "3")),
+    eject_seconds=float(os.environ.get("OLLAMA_EJECT_SECONDS", "30")),
+    probe_interval=float(os.environ.get("OLLAMA_PROBE_INTERVAL", "30")),
+)
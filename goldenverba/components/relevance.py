@@ -0,0 +1,219 @@
+import math
+import os
+import threading
+
+try:
+    from sentence_transformers import CrossEncoder
+except Exception:
+    CrossEncoder = None
+
+# Default (low, high) thresholds per backend, uncalibrated: run the gate in shadow
+# mode and compare its stats with the LLM verdicts before turning it on.
+# Embedder scores are cosine similarities, cross-encoder scores are the sigmoid
+# relevance probabilities of an MS MARCO model.
+DEFAULT_THRESHOLDS = {
+    "embedder": (0.15, 0.55),
+    "cross_encoder": (0.05, 0.9),
+}
+
+
+def cosine_similarity(a: list[float], b: list[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+class RelevanceGate:
+    """
+    Cheap local relevance check in front of the LLM relevance filters.
+    A pair scoring at or above the high threshold is relevant and one below the low
+    threshold is irrelevant, only pairs in between (or that cannot be scored) are
+    escalated to the LLM.
+    The gate is off by default. In shadow mode it scores every pair and records what
+    it would have decided, but leaves every decision to the LLM, whose verdicts are
+    counted as agreeing or disagreeing with the gate.
+    """
+
+    MODES = ("off", "shadow", "on")
+
+    def __init__(
+        self,
+        backend: str = "embedder",
+        low: float = None,
+        high: float = None,
+        cross_encoder_model: str = "cross-encoder/ms-marco-MiniLM-L-6-v2",
+        mode: str = "off",
+    ):
+        if mode not in self.MODES:
+            raise ValueError(f"Relevance gate mode must be one of {self.MODES}")
+        default_low, default_high = DEFAULT_THRESHOLDS.get(backend, (0.0, 1.0))
+        self.mode = mode
+        self.backend = backend
+        self.low = default_low if low is None else low
+        self.high = default_high if high is None else high
+        self.cross_encoder_model = cross_encoder_model
+        self._cross_encoder = None
+        self._lock = threading.Lock()
+        self.stats = {}
+
+    def get_cross_encoder(self):
+        if self._cross_encoder is None:
+            if CrossEncoder is None:
+                raise ImportError(
+                    "sentence_transformers is required for the cross_encoder "
+                    "relevance gate"
+                )
+            self._cross_encoder = CrossEncoder(self.cross_encoder_model, device="cpu")
+        return self._cross_encoder
+
+    def score(self, query: str, text: str, embedder=None) -> float:
+        """Scores how relevant a text is to a query
+        @parameter: query : str - Query
+        @parameter: text : str - Context or response to score
+        @parameter: embedder : Embedder - Active embedder, used by the embedder backend
+        @returns float - Relevance score, None if the backend cannot score the pair.
+        """
+        if self.backend == "cross_encoder":
+            return float(self.get_cross_encoder().predict([(query, text)])[0])
+
+        if self.backend == "embedder":
+            # Weaviate-side vectorizers leave nothing to compare locally
+            if embedder is None or not embedder.get_need_vectorization():
+                return None
+            # Not through the embedding cache, contexts and responses are one-off
+            # texts that would only fill its disk store
+            query_vector, text_vector = embedder.vectorize_chunks([query, text])
+            return cosine_similarity(query_vector, text_vector)
+
+        return None
+
+    def decide(
+        self, kind: str, query: str, text: str, embedder=None
+    ) -> tuple[bool, float]:
+        """Decides relevance locally when the score is outside the ambiguous band
+        @parameter: kind : str - Name of the calling filter, used for the stats
+        @parameter: query : str - Query
+        @parameter: text : str - Context or response to check
+        @parameter: embedder : Embedder - Active embedder
+        @returns tuple[bool, float] - True (relevant), False (irrelevant) or None
+            when the LLM has to decide, and the score.
+        """
+        if self.mode == "off":
+            return None, None
+
+        if not text.strip():
+            self.record(kind, "irrelevant")
+            return False, None
+
+        try:
+            score = self.score(query, text, embedder)
+        except Exception:
+            score = None
+
+        if score is None:
+            self.record(kind, "unscored")
+            return None, None
+        is_relevant = self.get_decision(score)
+        if is_relevant is None:
+            self.record(kind, "escalated", score)
+        else:
+            self.record(kind, "relevant" if is_relevant else "irrelevant", score)
+        if self.mode == "shadow":
+            return None, score
+        return is_relevant, score
+
+    def get_decision(self, score: float) -> bool:
+        if score >= self.high:
+            return True
+        if score < self.low:
+            return False
+        return None
+
+    def record(self, kind: str, decision: str, score: float = None) -> None:
+        with self._lock:
+            stats = self.stats.setdefault(
+                kind,
+                {
+                    "relevant": 0,
+                    "irrelevant": 0,
+                    "escalated": 0,
+                    "unscored": 0,
+                    "escalated_relevant": 0,
+                    "escalated_irrelevant": 0,
+                    "shadow_agreed": 0,
+                    "shadow_disagreed": 0,
+                    "score_sum": {},
+                },
+            )
+            stats[decision] += 1
+            if score is not None:
+                stats["score_sum"][decision] = (
+                    stats["score_sum"].get(decision, 0.0) + score
+                )
+
+    def record_escalation(
+        self, kind: str, relevant: bool, score: float = None
+    ) -> None:
+        """Records the LLM verdict of an escalated pair, so thresholds can be tuned
+        against it. In shadow mode it is also compared with the gate's decision."""
+        self.record(
+            kind,
+            "escalated_relevant" if relevant else "escalated_irrelevant",
+            score,
+        )
+        if self.mode == "shadow" and score is not None:
+            is_relevant = self.get_decision(score)
+            if is_relevant is not None:
+                self.record(
+                    kind,
+                    "shadow_agreed" if is_relevant == relevant else "shadow_disagreed",
+                )
+
+    def get_stats(self) -> dict:
+        """Returns the decision counts per filter, with the share decided locally
+        (or that would be, in shadow mode) and the mean score per decision."""
+        with self._lock:
+            result = {
+                "mode": self.mode,
+                "backend": self.backend,
+                "low": self.low,
+                "high": self.high,
+                "filters": {},
+            }
+            for kind, stats in self.stats.items():
+                local = stats["relevant"] + stats["irrelevant"]
+                total = local + stats["escalated"] + stats["unscored"]
+                result["filters"][kind] = {
+                    **{
+                        key: value
+                        for key, value in stats.items()
+                        if key != "score_sum"
+                    },
+                    "local_ratio": round(local / total, 3) if total else 0.0,
+                    "mean_score": {
+                        decision: round(score_sum / stats[decision], 4)
+                        for decision, score_sum in stats["score_sum"].items()
+                        if stats[decision]
+                    },
+                }
+            return result
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self.stats = {}
+
+
+def _get_threshold(name: str):
+    value = os.environ.get(name, "")
+    return float(value) if value else None
+
+
+relevance_gate = RelevanceGate(
+    os.environ.get("RELEVANCE_GATE_BACKEND", "embedder"),
+    _get_threshold("RELEVANCE_GATE_LOW"),
+    _get_threshold("RELEVANCE_GATE_HIGH"),
+    os.environ.get(
+        "RELEVANCE_GATE_CROSS_ENCODER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2"
+    ),
+    os.environ.get("RELEVANCE_GATE_MODE", "off"),
+)
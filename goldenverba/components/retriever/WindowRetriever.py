@@ -1,8 +1,12 @@
 from weaviate import Client
 from weaviate.gql.get import HybridFusion
 
+from goldenverba.components.cache import chunk_cache
 from goldenverba.components.chunk import Chunk
 from goldenverba.components.interfaces import Embedder, Retriever
+from goldenverba.components.schema.schema_generation import (
+    course_where_filter,
+)
 
 
 class WindowRetriever(Retriever):
@@ -20,11 +24,13 @@ class WindowRetriever(Retriever):
         queries: list[str],
         client: Client,
         embedder: Embedder,
+        course_id: str = None,
     ) -> list[Chunk]:
         """Ingest data into Weaviate
         @parameter: queries : list[str] - List of queries
         @parameter: client : Client - Weaviate client
         @parameter: embedder : Embedder - Current selected Embedder
+        @parameter: course_id : str - Only retrieve chunks of this course
         @returns list[Chunk] - List of retrieved chunks.
         """
         chunk_class = embedder.get_chunk_class()
@@ -47,6 +53,11 @@ class WindowRetriever(Retriever):
                 .with_autocut(1)
             )
 
+            if course_id:
+                query_results = query_results.with_where(
+                    course_where_filter(course_id)
+                )
+
             if needs_vectorization:
                 vector = embedder.vectorize_query(query)
                 query_results = query_results.with_hybrid(
@@ -98,7 +109,7 @@ class WindowRetriever(Retriever):
             if chunk.doc_name not in doc_name_map:
                 doc_name_map[chunk.doc_name] = {"score": 0, "chunks": {}}
 
-            doc_name_map[chunk.doc_name]["chunks"][chunk.chunk_id] = chunk
+            doc_name_map[chunk.doc_name]["chunks"][int(chunk.chunk_id)] = chunk
             doc_name_map[chunk.doc_name]["score"] += float(chunk.score)
 
         doc_name_map = dict(
@@ -109,88 +120,30 @@ class WindowRetriever(Retriever):
             )
         )
 
+        chunk_class = embedder.get_chunk_class()
+        window = 2
+
         for doc in doc_name_map:
             chunk_map = doc_name_map[doc]["chunks"]
-            window = 2
-            added_chunks = {}
-            for chunk in chunk_map:
-                chunk_id = int(chunk)
-                all_chunk_range = list(
-                    range(chunk_id - window, chunk_id + window + 1)
-                )
-                for _range in all_chunk_range:
-                    if (
-                        _range >= 0
-                        and _range not in chunk_map
-                        and _range not in added_chunks
-                    ):
-                        chunk_retrieval_results = (
-                            client.query.get(
-                                class_name=embedder.get_chunk_class(),
-                                properties=[
-                                    "text",
-                                    "doc_name",
-                                    "chunk_id",
-                                    "doc_uuid",
-                                    "doc_type",
-                                ],
-                            )
-                            .with_where(
-                                {
-                                    "operator": "And",
-                                    "operands": [
-                                        {
-                                            "path": ["chunk_id"],
-                                            "operator": "Equal",
-                                            "valueNumber": _range,
-                                        },
-                                        {
-                                            "path": ["doc_name"],
-                                            "operator": "Equal",
-                                            "valueText": chunk_map[
-                                                chunk
-                                            ].doc_name,
-                                        },
-                                    ],
-                                }
-                            )
-                            .with_limit(1)
-                            .do()
-                        )
-
-                        if "data" in chunk_retrieval_results:
-                            if chunk_retrieval_results["data"]["Get"][
-                                embedder.get_chunk_class()
-                            ]:
-                                chunk_obj = Chunk(
-                                    chunk_retrieval_results["data"]["Get"][
-                                        embedder.get_chunk_class()
-                                    ][0]["text"],
-                                    chunk_retrieval_results["data"]["Get"][
-                                        embedder.get_chunk_class()
-                                    ][0]["doc_name"],
-                                    chunk_retrieval_results["data"]["Get"][
-                                        embedder.get_chunk_class()
-                                    ][0]["doc_type"],
-                                    chunk_retrieval_results["data"]["Get"][
-                                        embedder.get_chunk_class()
-                                    ][0]["doc_uuid"],
-                                    chunk_retrieval_results["data"]["Get"][
-                                        embedder.get_chunk_class()
-                                    ][0]["chunk_id"],
-                                )
-                                added_chunks[str(_range)] = chunk_obj
-
-            for chunk in added_chunks:
-                if chunk not in doc_name_map[doc]:
-                    doc_name_map[doc]["chunks"][chunk] = added_chunks[chunk]
+            needed_ids = set()
+            for chunk_id in chunk_map:
+                for _range in range(chunk_id - window, chunk_id + window + 1):
+                    if _range >= 0 and _range not in chunk_map:
+                        needed_ids.add(_range)
+
+            added_chunks = self.get_window_chunks(
+                client, chunk_class, doc, sorted(needed_ids)
+            )
+            chunk_cache.add_chunks(chunk_class, doc, chunk_map)
+
+            for chunk_id, chunk in added_chunks.items():
+                if chunk is not None and chunk_id not in chunk_map:
+                    chunk_map[chunk_id] = chunk
 
         for doc in doc_name_map:
             sorted_dict = {
                 k: doc_name_map[doc]["chunks"][k]
-                for k in sorted(
-                    doc_name_map[doc]["chunks"], key=lambda x: int(x)
-                )
+                for k in sorted(doc_name_map[doc]["chunks"])
             }
 
             context += "--- Document " + doc + " ---" + "\n\n"
@@ -205,3 +158,91 @@ class WindowRetriever(Retriever):
                 )
 
         return context
+
+    def get_window_chunks(
+        self,
+        client: Client,
+        chunk_class: str,
+        doc_name: str,
+        chunk_ids: list[int],
+    ) -> dict[int, Chunk]:
+        """Fetch the chunks of a document by chunk_id, serving known chunks from the
+        chunk cache and the rest with a single query
+        @parameter: client : Client - Weaviate client
+        @parameter: chunk_class : str - Weaviate class of the chunks
+        @parameter: doc_name : str - Document name
+        @parameter: chunk_ids : list[int] - Chunk ids to fetch
+        @returns dict[int, Chunk] - Chunks by chunk_id, None for chunk ids that do not
+            exist.
+        """
+        cached = chunk_cache.get_chunks(chunk_class, doc_name)
+        chunks = {
+            chunk_id: cached[chunk_id]
+            for chunk_id in chunk_ids
+            if chunk_id in cached
+        }
+        missing_ids = [
+            chunk_id for chunk_id in chunk_ids if chunk_id not in cached
+        ]
+
+        if not missing_ids:
+            return chunks
+
+        id_filters = [
+            {
+                "path": ["chunk_id"],
+                "operator": "Equal",
+                "valueNumber": chunk_id,
+            }
+            for chunk_id in missing_ids
+        ]
+        if len(id_filters) == 1:
+            id_filter = id_filters[0]
+        else:
+            id_filter = {"operator": "Or", "operands": id_filters}
+
+        chunk_retrieval_results = (
+            client.query.get(
+                class_name=chunk_class,
+                properties=[
+                    "text",
+                    "doc_name",
+                    "chunk_id",
+                    "doc_uuid",
+                    "doc_type",
+                ],
+            )
+            .with_where(
+                {
+                    "operator": "And",
+                    "operands": [
+                        id_filter,
+                        {
+                            "path": ["doc_name"],
+                            "operator": "Equal",
+                            "valueText": doc_name,
+                        },
+                    ],
+                }
+            )
+            .with_limit(len(missing_ids))
+            .do()
+        )
+
+        if "data" not in chunk_retrieval_results:
+            # Don't cache anything on errors, the ids might exist
+            return chunks
+
+        fetched = {chunk_id: None for chunk_id in missing_ids}
+        for result in chunk_retrieval_results["data"]["Get"][chunk_class] or []:
+            fetched[int(result["chunk_id"])] = Chunk(
+                result["text"],
+                result["doc_name"],
+                result["doc_type"],
+                result["doc_uuid"],
+                result["chunk_id"],
+            )
+
+        chunk_cache.add_chunks(chunk_class, doc_name, fetched)
+        chunks.update(fetched)
+        return chunks
@@ -0,0 +1,124 @@
+import asyncio
+import heapq
+import itertools
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+
+# Lower value is served first
+PRIORITIES = {"interactive": 0, "single": 1, "batch": 2}
+
+# Priority class of the LLM calls made by the current request, set per request by the
+# API
+llm_priority: ContextVar[str] = ContextVar("llm_priority", default="single")
+
+
+class PriorityScheduler:
+    """
+    Admission control for LLM calls. At most max_parallel calls run at once (matched to
+    the backend's parallel slots), waiting calls are admitted strictly by priority class
+    and first-come-first-served within a class.
+    """
+
+    def __init__(self, max_parallel: int = 4, window: int = 1000):
+        self.max_parallel = max_parallel
+        self.running = 0
+        self._waiting = []
+        self._sequence = itertools.count()
+        self.stats = {
+            priority: {
+                "queued": 0,
+                "running": 0,
+                "admitted": 0,
+                "wait_ms": deque(maxlen=window),
+            }
+            for priority in PRIORITIES
+        }
+
+    async def acquire(self, priority: str = "single") -> None:
+        """Waits for a free slot
+        @parameter: priority : str - interactive, single or batch.
+        """
+        if priority not in PRIORITIES:
+            priority = "single"
+        stats = self.stats[priority]
+        start = time.perf_counter()
+
+        if self.running < self.max_parallel and not self._waiting:
+            self.running += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            heapq.heappush(
+                self._waiting,
+                (PRIORITIES[priority], next(self._sequence), future),
+            )
+            stats["queued"] += 1
+            try:
+                await future
+            except asyncio.CancelledError:
+                # Granted right before the cancellation arrived, hand the slot on
+                if future.done() and not future.cancelled():
+                    self.release()
+                raise
+            finally:
+                stats["queued"] -= 1
+
+        stats["running"] += 1
+        stats["admitted"] += 1
+        stats["wait_ms"].append((time.perf_counter() - start) * 1000)
+
+    def release(self, priority: str = None) -> None:
+        """Frees a slot and admits the next waiting call
+        @parameter: priority : str - Priority class the released call was admitted with.
+        """
+        if priority is not None:
+            self.stats.get(priority, self.stats["single"])["running"] -= 1
+        self.running -= 1
+        while self._waiting:
+            _, _, future = heapq.heappop(self._waiting)
+            if not future.done():
+                self.running += 1
+                future.set_result(None)
+                break
+
+    @asynccontextmanager
+    async def slot(self, priority: str = None):
+        """Holds a slot for the duration of the block, priority defaults to the
+        request's llm_priority."""
+        priority = priority or llm_priority.get()
+        if priority not in PRIORITIES:
+            priority = "single"
+        await self.acquire(priority)
+        try:
+            yield
+        finally:
+            self.release(priority)
+
+    def get_stats(self) -> dict:
+        """Returns queue depth, running calls and wait-time percentiles per priority
+        class."""
+        result = {
+            "max_parallel": self.max_parallel,
+            "running": self.running,
+            "classes": {},
+        }
+        for priority, stats in self.stats.items():
+            waits = sorted(stats["wait_ms"])
+            result["classes"][priority] = {
+                "queued": stats["queued"],
+                "running": stats["running"],
+                "admitted": stats["admitted"],
+                "wait_ms_p50": round(waits[len(waits) // 2], 1) if waits else 0.0,
+                "wait_ms_p95": (
+                    round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 1)
+                    if waits
+                    else 0.0
+                ),
+                "wait_ms_max": round(waits[-1], 1) if waits else 0.0,
+            }
+        return result
+
+
+llm_scheduler = PriorityScheduler(int(os.environ.get("OLLAMA_MAX_PARALLEL", "4")))
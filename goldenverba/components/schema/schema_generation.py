@@ -21,6 +21,147 @@ def strip_non_letters(s: str):
     return re.sub(r"[^a-zA-Z0-9]", "_", s)
 
 
+# Filterable course/tenant of a document: the course id it was imported with, or its
+# lowercased name for documents imported without one, whose course is matched by
+# name prefix at query time
+COURSE_ID_PROPERTY = {
+    "name": "course_id",
+    "dataType": ["text"],
+    "description": "Course the document belongs to",
+    "tokenization": "field",
+    "indexFilterable": True,
+}
+
+COURSE_FROM_NAME_PROPERTY = {
+    "name": "course_from_name",
+    "dataType": ["boolean"],
+    "description": "Whether course_id is the document name",
+    "indexFilterable": True,
+}
+
+COURSE_PROPERTIES = [COURSE_ID_PROPERTY, COURSE_FROM_NAME_PROPERTY]
+
+
+def normalize_course_id(course_id: str) -> str:
+    return course_id.strip().lower()
+
+
+def get_course_properties(doc_name: str, course_id: str = None) -> dict:
+    """Returns the course properties stored with a document and its chunks
+    @parameter doc_name : str - Document name
+    @parameter course_id : str - Course id the document was imported with, if any
+    @returns dict - course_id and course_from_name.
+    """
+    if course_id:
+        return {"course_id": normalize_course_id(course_id), "course_from_name": False}
+    return {"course_id": normalize_course_id(doc_name), "course_from_name": True}
+
+
+def course_where_filter(course_id: str) -> dict:
+    """Builds the where filter restricting chunks to a course
+    Documents imported with a course id match it exactly, documents imported without
+    one match when their name starts with the course id.
+    @parameter course_id : str - Course id
+    @returns dict - Weaviate where filter.
+    """
+    course_id = normalize_course_id(course_id)
+    return {
+        "operator": "Or",
+        "operands": [
+            {
+                "operator": "And",
+                "operands": [
+                    {
+                        "path": ["course_from_name"],
+                        "operator": "Equal",
+                        "valueBoolean": False,
+                    },
+                    {
+                        "path": ["course_id"],
+                        "operator": "Equal",
+                        "valueText": course_id,
+                    },
+                ],
+            },
+            {
+                "operator": "And",
+                "operands": [
+                    {
+                        "path": ["course_from_name"],
+                        "operator": "Equal",
+                        "valueBoolean": True,
+                    },
+                    {
+                        "path": ["course_id"],
+                        "operator": "Like",
+                        "valueText": course_id + "*",
+                    },
+                ],
+            },
+        ],
+    }
+
+
+def backfill_course_properties(client: Client, class_name: str) -> int:
+    """Sets the course properties of objects imported before they existed, from their
+    doc_name
+    @parameter client : Client - Weaviate client
+    @parameter class_name : str - Name of the class
+    @returns int - Number of updated objects.
+    """
+    updated = 0
+    after = None
+    while True:
+        query = (
+            client.query.get(
+                class_name, ["doc_name", "course_id", "course_from_name"]
+            )
+            .with_additional(["id"])
+            .with_limit(100)
+        )
+        if after is not None:
+            query = query.with_after(after)
+        objects = query.do()["data"]["Get"][class_name]
+        if not objects:
+            return updated
+        for object in objects:
+            if object.get("course_from_name") is None and object.get("doc_name"):
+                client.data_object.update(
+                    data_object=get_course_properties(
+                        object["doc_name"], object.get("course_id")
+                    ),
+                    class_name=class_name,
+                    uuid=object["_additional"]["id"],
+                )
+                updated += 1
+        after = objects[-1]["_additional"]["id"]
+
+
+def add_missing_properties(
+    client: Client, class_name: str, properties: list[dict]
+) -> None:
+    """Adds properties to an existing class, used to migrate schemas created by older
+    versions. Existing objects get their course properties from their doc_name, so
+    that course filters match them
+    @parameter client : Client - Weaviate client
+    @parameter class_name : str - Name of the class
+    @parameter properties : list[dict] - Property definitions.
+    """
+    existing = {
+        property["name"]
+        for property in client.schema.get(class_name).get("properties", [])
+    }
+    added = []
+    for property in properties:
+        if property["name"] not in existing:
+            client.schema.property.create(class_name, dict(property))
+            msg.info(f"Added {property['name']} property to {class_name}")
+            added.append(property["name"])
+    if "course_from_name" in added:
+        updated = backfill_course_properties(client, class_name)
+        msg.info(f"Set the course of {updated} objects in {class_name}")
+
+
 def verify_vectorizer(
     schema: dict, vectorizer: str, skip_properties: list[str] = None
 ) -> dict:
@@ -199,6 +340,8 @@ def init_documents(
                         "dataType": ["number"],
                         "description": "Document chunk from the whole document",
                     },
+                    dict(COURSE_ID_PROPERTY),
+                    dict(COURSE_FROM_NAME_PROPERTY),
                 ],
             }
         ]
@@ -240,6 +383,8 @@ def init_documents(
                         "dataType": ["number"],
                         "description": "Number of chunks",
                     },
+                    dict(COURSE_ID_PROPERTY),
+                    dict(COURSE_FROM_NAME_PROPERTY),
                 ],
             }
         ]
@@ -249,7 +394,7 @@ def init_documents(
     chunk_schema = verify_vectorizer(
         SCHEMA_CHUNK,
         vectorizer,
-        ["doc_type", "doc_uuid", "chunk_id"],
+        ["doc_type", "doc_uuid", "chunk_id", "course_id", "course_from_name"],
     )
 
     # Add Suffix
@@ -258,6 +403,16 @@ def init_documents(
 
     if client.schema.exists(document_name):
         if check:
+            add_missing_properties(client, document_name, COURSE_PROPERTIES)
+            add_missing_properties(
+                client,
+                chunk_name,
+                [
+                    property
+                    for property in chunk_schema["classes"][0]["properties"]
+                    if property["name"] in ("course_id", "course_from_name")
+                ],
+            )
             return document_schema, chunk_schema
         if not force:
             user_input = input(
@@ -0,0 +1,69 @@
+import asyncio
+import hashlib
+import json
+
+from goldenverba.components.scheduler import llm_priority
+
+
+def make_key(*parts) -> str:
+    """Builds a coalescing key from the parts that fully determine a call's result."""
+    return hashlib.sha256(
+        json.dumps(parts, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+class SingleFlight:
+    """
+    Coalesces identical concurrent calls: while a call for a key is in flight, further
+    callers with the same key await its result instead of starting their own. Nothing is
+    cached once the call finishes. The shared call is only cancelled when every caller
+    waiting on it has been cancelled.
+    Calls are only shared within one priority class, the shared call runs with the
+    context (and so the scheduler priority) of the caller that started it.
+    """
+
+    def __init__(self, name: str = ""):
+        self.name = name
+        self._calls = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key: str, fn):
+        """Runs fn() once for all concurrent callers of a key
+        @parameter: key : str - Key of the call, see make_key
+        @parameter: fn : Callable[[], Awaitable] - Starts the call
+        @returns Any - Result of the shared call (its exception is raised to every
+            caller).
+        """
+        # An interactive caller must not wait behind a batch caller's queued call
+        key = (llm_priority.get(), key)
+        call = self._calls.get(key)
+        if call is None:
+            self.calls += 1
+            task = asyncio.ensure_future(fn())
+            call = self._calls[key] = {"task": task, "waiters": 0}
+            task.add_done_callback(lambda _: self._forget(key, task))
+        else:
+            self.shared += 1
+
+        call["waiters"] += 1
+        try:
+            return await asyncio.shield(call["task"])
+        except asyncio.CancelledError:
+            if not call["task"].done() and call["waiters"] == 1:
+                call["task"].cancel()
+            raise
+        finally:
+            call["waiters"] -= 1
+
+    def _forget(self, key: tuple, task) -> None:
+        call = self._calls.get(key)
+        if call is not None and call["task"] is task:
+            del self._calls[key]
+
+    def get_stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "shared": self.shared,
+            "in_flight": len(self._calls),
+        }
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Literal
+from typing import Literal, Optional
 
 
 class InputText(BaseModel):
@@ -18,3 +18,12 @@ class FileData(BaseModel):
     filename: str
     extension: str
     content: str
+
+
+class ClassificationResult(BaseModel):
+    # Matched label as spelled in the label list, None if the output matched no label
+    label: Optional[str] = None
+    text: str
+    # True if generation was cut off as soon as the label was unambiguous
+    early_stop: bool = False
+    stats: dict = {}
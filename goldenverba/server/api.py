@@ -10,7 +10,12 @@ from fastapi import (
     Depends,
 )
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi.responses import (
+    FileResponse,
+    JSONResponse,
+    Response,
+    StreamingResponse,
+)
 from fastapi.staticfiles import StaticFiles
 import asyncio
 from ollama import chat as ollama_chat
@@ -24,8 +29,9 @@ import httpx
 import re, asyncio
 import zipfile
 import ollama
-from pydantic import BaseModel
+from pydantic import BaseModel, ValidationError
 import base64
+from functools import partial
 import logging
 from typing import List
 from fastapi import BackgroundTasks
@@ -33,7 +39,26 @@ import os
 from pathlib import Path
 from dotenv import load_dotenv
 from starlette.websockets import WebSocketDisconnect
-from goldenverba.components.generation.OllamaGenerator import OllamaGenerator
+from goldenverba.components.generation.OllamaGenerator import (
+    OllamaGenerator,
+    DETERMINISTIC_OPTIONS,
+)
+from goldenverba.components.cache import (
+    completion_cache,
+    TTLCache,
+    is_deterministic,
+    request_endpoint,
+)
+from goldenverba.components.ollama_client import ollama_client
+from goldenverba.components.ollama_router import ollama_router
+from goldenverba.components.hedging import request_hedger
+from goldenverba.components.singleflight import SingleFlight, make_key
+from goldenverba.components.relevance import relevance_gate, cosine_similarity
+from goldenverba.components.scheduler import llm_priority, llm_scheduler
+from goldenverba.server.moodle_client import moodle_client, MoodleError
+from goldenverba.server.extraction import extraction_pool
+from goldenverba.server.grading_jobs import grading_jobs, get_ground_truth_hash
+from goldenverba.server.grading import grade_submissions
 from goldenverba.server.types import (
     CourseIDRequest,
     AuthDetails,
@@ -43,6 +68,8 @@ from goldenverba.server.types import (
     TokenWithRoles,
     RequestAGA,
     QueryRequestResume,
+    QueryRequestResumeBulk,
+    ResumeDimensionScore,
 )
 from wasabi import msg  # type: ignore[import]
 import time
@@ -73,14 +100,9 @@ from goldenverba.server.types import (
 )
 from typing import Dict
 from goldenverba.server.spanda_utils import chatbot, dimensions_AFE
-import requests
-from docx import Document
-import fitz  # PyMuPDF
-import pytesseract
-from PIL import Image
-import io
 import re
 import csv
+import io
 import httpx
 import asyncio
 import jwt
@@ -153,6 +175,76 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+# Priority class of the LLM calls made while serving a path (prefix match), everything
+# else is "single"
+LLM_PRIORITY_ROUTES = {
+    "interactive": [
+        "/api/spandachat",
+        "/api/answergen",
+        "/api/ollamaAQG",
+        "/api/query",
+    ],
+    "batch": ["/api/process", "/api/evaluate_Resume_bulk"],
+}
+
+
+def get_route_priority(path: str) -> str:
+    for priority, prefixes in LLM_PRIORITY_ROUTES.items():
+        if any(path.startswith(prefix) for prefix in prefixes):
+            return priority
+    return "single"
+
+
+@app.middleware("http")
+async def assign_request_context(request: Request, call_next):
+    llm_priority.set(get_route_priority(request.url.path))
+    request_endpoint.set(request.url.path)
+    return await call_next(request)
+
+
+@app.get("/api/completion_cache/stats")
+async def completion_cache_stats():
+    return JSONResponse(content=completion_cache.get_stats())
+
+
+@app.get("/api/scheduler/stats")
+async def scheduler_stats():
+    return JSONResponse(content=llm_scheduler.get_stats())
+
+
+@app.get("/api/ollama/backends")
+async def ollama_backends():
+    return JSONResponse(
+        content={**ollama_router.get_stats(), "hedging": request_hedger.get_stats()}
+    )
+
+
+@app.on_event("startup")
+async def startup_clients():
+    await ollama_client.start()
+    await moodle_client.start()
+    interrupted = grading_jobs.interrupt_running()
+    if interrupted:
+        msg.warn(
+            f"{interrupted} grading jobs were interrupted, resume them to continue"
+        )
+
+
+@app.on_event("shutdown")
+async def shutdown_clients():
+    await ollama_client.close()
+    await moodle_client.close()
+    extraction_pool.close()
+
+
+@app.get("/api/moodle/stats")
+async def moodle_stats():
+    return JSONResponse(
+        content={**moodle_client.get_stats(), "extraction": extraction_pool.get_stats()}
+    )
+
+
 BASE_DIR = Path(__file__).resolve().parent
 
 # Serve the assets (JS, CSS, images, etc.)
@@ -175,36 +267,70 @@ async def serve_frontend():
 
 
 # Constants
-editing_teacher_courses: List[str] = []
+# Roles by (userid, courseid), shared across logins
+role_cache = TTLCache(
+    maxsize=int(os.getenv("MOODLE_ROLE_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("MOODLE_ROLE_CACHE_TTL", "600")),
+)
+# Shortnames of the courses a user edits, by username, kept as long as their access
+# token
+editing_teacher_courses = TTLCache(
+    maxsize=int(os.getenv("MOODLE_ROLE_CACHE_SIZE", "10000")),
+    ttl=ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+)
+# Cleared when Moodle rejects core_user_get_course_user_profiles, the roster is used
+# from then on
+course_user_profiles_available = True
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 
 # Function to make a Moodle API call
-def moodle_api_call(params, extra_params=None):
+async def moodle_api_call(params, extra_params=None):
     if extra_params:
         params.update(extra_params)
-    endpoint = f"{MOODLE_URL}/webservice/rest/server.php"
-    response = requests.get(endpoint, params=params)
-    print(
-        f"API Call to {params['wsfunction']} - Status Code: {response.status_code}"
-    )
-    print(f"API Request URL: {response.url}")  # Log the full URL for debugging
+    return await moodle_client.call(params)
 
-    try:
-        result = response.json()
-    except ValueError as e:
-        raise ValueError(
-            f"Error parsing JSON response: {response.text}"
-        ) from e
 
-    if "exception" in result:
-        raise Exception(f"Error: {result['exception']['message']}")
+def get_active_embedder():
+    return manager.embedder_manager.embedders[
+        manager.embedder_manager.selected_embedder
+    ]
+
 
-    return result
+retrieval_flight = SingleFlight("retrieval")
+relevance_flight = SingleFlight("context_relevance")
+generation_flight = SingleFlight("generation")
+
+
+@app.get("/api/singleflight/stats")
+async def singleflight_stats():
+    return JSONResponse(
+        content={
+            flight.name: flight.get_stats()
+            for flight in [retrieval_flight, relevance_flight, generation_flight]
+        }
+    )
 
 
 async def context_relevance_filter(query: str, context: str) -> str:
+    # Concurrent checks of the same query and context (e.g. one per student in a grading
+    # run) share one call
+    return await relevance_flight.do(
+        make_key(query, context), lambda: check_context_relevance(query, context)
+    )
+
+
+async def check_context_relevance(query: str, context: str) -> str:
+    # Clear cases are decided by the local relevance gate (if it is on), only the
+    # ambiguous band reaches the LLM
+    is_relevant, score = await asyncio.to_thread(
+        relevance_gate.decide, "context", query, context, get_active_embedder()
+    )
+    if is_relevant is not None:
+        msg.info(f"Is this context relevant? {is_relevant} (gate score {score})")
+        return context if is_relevant else " "
+
     evaluate_system_prompt = """You are an AI responsible for assessing whether the provided content is relevant to a specific query. Carefully analyze the content and determine if it directly addresses or provides pertinent information related to the query. Only respond with "YES" if the content is relevant, or "NO" if it is not. Do not provide any explanations, scores, or additional text—just a single word: "YES" or "NO"."""
     evaluate_user_prompt = f"""
         Content: {context}
@@ -213,108 +339,84 @@ async def context_relevance_filter(query: str, context: str) -> str:
 
         You are an AI responsible for assessing whether the provided content is relevant to a specific query. Carefully analyze the content and determine if it directly addresses or provides pertinent information related to the query. Only respond with "YES" if the content is relevant, or "NO" if it is not. Do not provide any explanations, scores, or additional text—just a single word: "YES" or "NO".
         """
-    request = QueryRequest(query=query)
-    is_context_relevant = await generate_response(
-        request, context, evaluate_system_prompt, evaluate_user_prompt
+    is_context_relevant = await OllamaGenerator().classify(
+        ["YES", "NO"], evaluate_system_prompt, evaluate_user_prompt
+    )
+    msg.info(f"Is this context relevant? {is_context_relevant.text}")
+    relevance_gate.record_escalation(
+        "context", is_context_relevant.label != "NO", score
     )
-    # print("Is this context relevant? ")
-    print("Is this context relevant? " + is_context_relevant)
-    if is_context_relevant.lower() == "no":
+    if is_context_relevant.label == "NO":
         return " "  # Returns an empty coroutine
     return context
 
 
+@app.get("/api/relevance_gate/stats")
+async def relevance_gate_stats():
+    return JSONResponse(content=relevance_gate.get_stats())
+
+
 # Function to get the user ID by username
-def authenticate_user(username: str, password: str) -> Optional[dict]:
-    global editing_teacher_courses  # Access the global variable
+async def authenticate_user(username: str, password: str) -> Optional[dict]:
+    if not await moodle_client.login(username, password):
+        print("Login failed or unexpected response.")
+        return None
+
+    print("Login successful.")
+    userid = await get_user_id_by_username(TOKEN, ACCESS_URL, username)
+    if not userid:
+        print("User ID not found.")
+        return None
+
+    print("User ID found:", userid)
+    courses = await get_user_courses(TOKEN, ACCESS_URL, userid)
+    if not courses:
+        print("No courses found for user.")
 
-    credentials = {"username": username, "password": password}
+    teacher_courses = []
+    roles_found = []
 
-    with requests.Session() as session:
-        try:
-            response = session.get(LOGIN_URL)
-            response.raise_for_status()
-            print("Login page fetched successfully.")
-        except requests.RequestException as e:
-            print(f"Failed to get login page: {e}")
-            return None
+    # Resolving the roles of all courses concurrently
+    course_roles_list = await asyncio.gather(
+        *[
+            get_user_role_in_course(TOKEN, ACCESS_URL, course["id"], userid)
+            for course in courses
+        ]
+    )
+    for course, roles in zip(courses, course_roles_list):
+        course_roles = [role["shortname"] for role in roles]
+        print(
+            "Roles found for course:",
+            course.get("shortname", "Unnamed Course"),
+            course_roles,
+        )
 
-        soup = BeautifulSoup(response.text, "html.parser")
-        logintoken = soup.find("input", {"name": "logintoken"})
-        if logintoken:
-            credentials["logintoken"] = logintoken["value"]
-            print("Login token found:", logintoken["value"])
-        else:
+        if "bitseditingteacher" in course_roles:
+            teacher_courses.append(
+                course["shortname"]
+            )  # Append only the shortname
+            roles_found.append("bitseditingteacher")
             print(
-                "Login token not found. Check if the login page structure has changed."
+                "User has 'bitseditingteacher' role in course:",
+                course.get("shortname", "Unnamed Course"),
             )
-            return None
-
-        try:
-            response = session.post(LOGIN_URL, data=credentials)
-            response.raise_for_status()
-            print("Login attempt response status code:", response.status_code)
-        except requests.RequestException as e:
-            print(f"Login failed: {e}")
-            return None
-
-        if "Log out" in response.text:
-            print("Login successful.")
-            userid = get_user_id_by_username(TOKEN, ACCESS_URL, username)
-            if userid:
-                print("User ID found:", userid)
-                courses = get_user_courses(TOKEN, ACCESS_URL, userid)
-                if not courses:
-                    print("No courses found for user.")
-
-                global editing_teacher_courses
-                editing_teacher_courses = []  # Reset the global variable
-                roles_found = []
-
-                for course in courses:
-                    roles = get_user_role_in_course(
-                        TOKEN, ACCESS_URL, course["id"], userid
-                    )
-                    course_roles = [role["shortname"] for role in roles]
-                    print(
-                        "Roles found for course:",
-                        course.get("shortname", "Unnamed Course"),
-                        course_roles,
-                    )
-
-                    if "bitseditingteacher" in course_roles:
-                        editing_teacher_courses.append(
-                            course["shortname"]
-                        )  # Append only the shortname
-                        roles_found.append("bitseditingteacher")
-                        print(
-                            "User has 'bitseditingteacher' role in course:",
-                            course.get("shortname", "Unnamed Course"),
-                        )
 
-                    if "bitsmanager" in course_roles:
-                        roles_found.append("bitsmanager")
-                        print(
-                            "User has 'bitsmanager' role in course:",
-                            course.get("shortname", "Unnamed Course"),
-                        )
+        if "bitsmanager" in course_roles:
+            roles_found.append("bitsmanager")
+            print(
+                "User has 'bitsmanager' role in course:",
+                course.get("shortname", "Unnamed Course"),
+            )
 
-                print("Roles found for user:", roles_found)
-                if roles_found:
-                    # Generate an access token with the roles embedded in the payload
-                    token = create_access_token(
-                        data={"sub": username, "roles": roles_found}
-                    )
-                    return {"access_token": token, "roles": roles_found}
-                else:
-                    print("No valid roles found for user.")
-                    return None
-            else:
-                print("User ID not found.")
-                return None
-        else:
-            print("Login failed or unexpected response.")
-            return None
+    print("Roles found for user:", roles_found)
+    editing_teacher_courses.set(username, teacher_courses)
+    if roles_found:
+        # Generate an access token with the roles embedded in the payload
+        token = create_access_token(data={"sub": username, "roles": roles_found})
+        return {"access_token": token, "roles": roles_found}
+    else:
+        print("No valid roles found for user.")
+        return None
 
 
 def create_access_token(
@@ -355,7 +457,7 @@ def get_current_user(request: Request) -> TokenData:
     return verify_token(token)
 
 
-def get_user_id_by_username(token, moodle_url, username):
+async def get_user_id_by_username(token, moodle_url, username):
     params = {
         "wstoken": token,
         "wsfunction": "core_user_get_users_by_field",
@@ -364,22 +466,16 @@ def get_user_id_by_username(token, moodle_url, username):
         "values[0]": username,
     }
     try:
-        response = requests.get(moodle_url, params=params)
-        response.raise_for_status()
-        print("User ID fetch response status code:", response.status_code)
-        print("Response Text:", response.text)
-        users = response.json()
+        users = await moodle_api_call(params)
+        print("Response:", users)
         if users:
             return users[0]["id"]
-    except (
-        requests.RequestException,
-        requests.exceptions.JSONDecodeError,
-    ) as e:
+    except (MoodleError, aiohttp.ClientError, asyncio.TimeoutError) as e:
         print(f"Error fetching user ID: {e}")
     return None
 
 
-def get_user_courses(token, moodle_url, userid):
+async def get_user_courses(token, moodle_url, userid):
     params = {
         "wstoken": token,
         "wsfunction": "core_enrol_get_users_courses",
@@ -387,47 +483,74 @@ def get_user_courses(token, moodle_url, userid):
         "userid": userid,
     }
     try:
-        response = requests.get(moodle_url, params=params)
-        response.raise_for_status()
-        print("User courses fetch response status code:", response.status_code)
-        print("Response Text:", response.text)
-        return response.json()
-    except (
-        requests.RequestException,
-        requests.exceptions.JSONDecodeError,
-    ) as e:
+        courses = await moodle_api_call(params)
+        print("Response:", courses)
+        return courses
+    except (MoodleError, aiohttp.ClientError, asyncio.TimeoutError) as e:
         print(f"Error fetching user courses: {e}")
     return []
 
 
-def get_user_role_in_course(token, moodle_url, courseid, userid):
+async def get_user_role_in_course(token, moodle_url, courseid, userid):
+    roles = role_cache.get((userid, courseid))
+    if roles is not None:
+        return roles
+    try:
+        roles = await fetch_user_role_in_course(token, courseid, userid)
+    except (MoodleError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+        # Not cached, the next login tries again
+        print(f"Error fetching user roles: {e}")
+        return []
+    role_cache.set((userid, courseid), roles)
+    return roles
+
+
+async def fetch_user_role_in_course(token, courseid, userid):
+    """Fetches a user's roles in a course from Moodle
+    @parameter: token : str - Moodle web service token
+    @parameter: courseid : int - Course id
+    @parameter: userid : int - User id
+    @returns list[dict] - Roles of the user in the course (empty if not enrolled).
+    """
+    global course_user_profiles_available
+    if course_user_profiles_available:
+        # Returns only this user's profile instead of the whole roster
+        params = {
+            "wstoken": token,
+            "wsfunction": "core_user_get_course_user_profiles",
+            "moodlewsrestformat": "json",
+            "userlist[0][userid]": userid,
+            "userlist[0][courseid]": courseid,
+        }
+        try:
+            profiles = await moodle_api_call(params)
+            return profiles[0].get("roles", []) if profiles else []
+        except MoodleError as e:
+            if e.errorcode is None:
+                raise
+            print(
+                f"core_user_get_course_user_profiles unavailable ({e}), "
+                "falling back to the course roster"
+            )
+            course_user_profiles_available = False
+
     params = {
         "wstoken": token,
         "wsfunction": "core_enrol_get_enrolled_users",
         "moodlewsrestformat": "json",
         "courseid": courseid,
     }
-    try:
-        response = requests.get(moodle_url, params=params)
-        response.raise_for_status()
-        print("User roles fetch response status code:", response.status_code)
-        print("Response Text:", response.text)
-        users = response.json()
-        for user in users:
-            if user["id"] == userid:
-                return user["roles"]
-    except (
-        requests.RequestException,
-        requests.exceptions.JSONDecodeError,
-    ) as e:
-        print(f"Error fetching user roles: {e}")
+    users = await moodle_api_call(params)
+    for user in users:
+        if user["id"] == userid:
+            return user["roles"]
     return []
 
 
 # FastAPI endpoints
 @app.post("/token", response_model=TokenWithRoles)
 async def login(form_data: OAuth2PasswordRequestForm = Depends()):
-    auth_data = authenticate_user(form_data.username, form_data.password)
+    auth_data = await authenticate_user(form_data.username, form_data.password)
     print("AUTH", auth_data)
     if auth_data is None:
         raise HTTPException(
@@ -448,10 +571,15 @@ async def check_auth(current_user: TokenData = Depends(get_current_user)):
 
 
 @app.get("/editing_teacher_courses", response_model=List[str])
-def get_editing_teacher_courses():
-    if not editing_teacher_courses:
+def get_editing_teacher_courses(request: Request):
+    try:
+        username = get_current_user(request).username
+    except ValueError as e:
+        raise HTTPException(status_code=401, detail=str(e))
+    courses = editing_teacher_courses.get(username)
+    if not courses:
         raise HTTPException(status_code=404, detail="No courses found.")
-    return editing_teacher_courses
+    return courses
 
 
 # @app.post("/api/spandachat")
@@ -577,6 +705,8 @@ async def retrieve_config():
 @app.websocket("/ws/generate_stream")
 async def websocket_generate_stream(websocket: WebSocket):
     await websocket.accept()
+    # Websockets bypass the HTTP middleware
+    llm_priority.set("interactive")
     while True:  # Start a loop to keep the connection alive.
         try:
             data = await websocket.receive_text()
@@ -656,7 +786,7 @@ async def import_data(payload: ImportPayload):
     try:
         set_config(manager, payload.config)
         documents, logging = manager.import_data(
-            payload.data, payload.textValues, logging
+            payload.data, payload.textValues, logging, payload.course_id
         )
 
         return JSONResponse(
@@ -708,7 +838,7 @@ async def query(payload: QueryPayload):
 
     try:
         chunks, context = manager.retrieve_chunks(
-            payload.query, payload.course_id
+            [payload.query], payload.course_id
         )
         retrieved_chunks = [
             {
@@ -905,15 +1035,29 @@ async def delete_document(payload: GetDocumentPayload):
 
 
 # for bitspprojs
-async def make_request(query_user):
+async def make_request(query_user, course_id=None):
     # Escape the query to handle special characters and newlines
     formatted_query = json.dumps(query_user)
 
     # Create a payload with the formatted query
-    payload = QueryPayload(query=formatted_query)
+    payload = QueryPayload(query=formatted_query, course_id=course_id)
+
+    # Identical concurrent retrievals (same query, course and components) share one call
+    key = make_key(
+        " ".join(payload.query.split()),
+        payload.course_id,
+        manager.embedder_manager.selected_embedder,
+        manager.retriever_manager.selected_retriever,
+    )
 
-    # Retrieve chunks and context
-    chunks, context = manager.retrieve_chunks([payload.query])
+    # Retrieve chunks and context, restricted to the course if one is given.
+    # Weaviate and the embedder block, so run them off the event loop
+    chunks, context = await retrieval_flight.do(
+        key,
+        lambda: asyncio.to_thread(
+            manager.retrieve_chunks, [payload.query], payload.course_id
+        ),
+    )
 
     return context
 
@@ -1126,53 +1270,50 @@ async def make_request(query_user):
 #     return {"content": content}, scores_dict
 
 
-async def instructor_eval(transcript, context, score_criterion, explanation):
+async def instructor_eval(
+    transcript, context, score_criterion, explanation, metrics=None
+):
     # Ensure score_criterion is hashable by converting it to a string if necessary
     score_criterion = str(score_criterion)
 
-    # # Define the criterion to evaluate
-    # user_context = "".join(context)
-
     # Initialize empty dictionaries to store relevant responses and scores
     responses = {}
     score = 0
 
-    # Evaluation prompt template
-    evaluate_instructions = f"""
+    # The system prompt only depends on the transcript, so it is an identical prefix for
+    # every criterion and the backend can reuse its prompt cache. Only the tail varies.
+    afe_new_system_prompt = f"""
         -Instructions:
-            You are tasked with evaluating a teacher's performance based on the criterion: {score_criterion} - {explanation}.
+            You are tasked with evaluating a teacher's performance from the textual transcript of a class, one criterion at a time.
 
         -Evaluation Details:
             -Focus exclusively on the provided textual transcript.
             -Ignore interruptions from student entries/exits and notifications of participants 'joining' or 'leaving' the meeting.
-            -Assign scores from 1 to 5:
-        -Criteria:
-            -Criterion Explanation: {explanation}
-            -If the transcript lacks sufficient information to judge {score_criterion}, mark it as N/A and provide a clear explanation.
+            -Assign scores from 1 to 5.
             -Justify any score that is not a perfect 5.
             -Consider the context surrounding the example statements, as the context in which a statement is made is extremely important.
 
             Rate strictly on a scale of 1 to 5 using whole numbers only.
 
             Ensure the examples are directly relevant to the evaluation criterion and discard any irrelevant excerpts.
-    """
+
+        Transcript -
+          {transcript}
+        """
 
     output_format = f"""Strictly follow the output format-
         -Output Format:
             -{score_criterion}: Score(range of 1 to 5, or N/A) - note: Do not use bold or italics or any formatting in this line.
             """
 
-    # system_message = """You are a judge. The judge gives helpful, detailed, and polite suggestions for improvement for a particular teacher from the given context - the context contains transcripts of videos. The judge should also indicate when the judgment can be found in the context."""
+    afe_new_user_prompt = f"""
+        Evaluate the transcript based on the criterion: {score_criterion} - {explanation}.
 
-    formatted_transcripts = f"""Evaluate the following transcript based on {score_criterion}:
-    Transcript -
-      {transcript} """
+        -Criteria:
+            -Criterion Explanation: {explanation}
+            -If the transcript lacks sufficient information to judge {score_criterion}, mark it as N/A and provide a clear explanation.
 
-    afe_new_system_prompt = f""" 
-        {evaluate_instructions}
-        """
-    afe_new_user_prompt = f"""
-        {formatted_transcripts} + "/n/n" + {output_format}
+        {output_format}
         """
     # Correct request creation
     request_obj = QueryRequest(
@@ -1181,7 +1322,12 @@ async def instructor_eval(transcript, context, score_criterion, explanation):
 
     # Generate the response using the utility function
     full_text = await generate_response(
-        request_obj, context, afe_new_system_prompt, afe_new_user_prompt
+        request_obj,
+        context,
+        afe_new_system_prompt,
+        afe_new_user_prompt,
+        metrics,
+        options=GRADING_OPTIONS,
     )
 
     # Store the response
@@ -1294,17 +1440,11 @@ async def instructor_eval(transcript, context, score_criterion, explanation):
 #     return response
 
 
-# Define the endpoint
-@app.post("/api/answergen")
-async def answergen_ollama(request: QueryRequest):
+# Example custom prompts
+def build_answergen_prompts(
+    request: QueryRequest, filtered_context_answergen: str
+) -> tuple[str, str]:
     query = request.query
-    context = await make_request(query)
-    if context is None:
-        raise HTTPException(status_code=500, detail="Failed to fetch context")
-
-    filtered_context_answergen = await context_relevance_filter(query, context)
-    print("Filtered context for answergen: " + filtered_context_answergen)
-    # Example custom prompts
     answergen_system_prompt = f"""
         ### Context:
         Ensure that each generated answer is relevant to the following context:
@@ -1348,10 +1488,22 @@ async def answergen_ollama(request: QueryRequest):
     answergen_user_prompt = (
         f"""Please answer the following question - {query}"""
     )
+    return answergen_system_prompt, answergen_user_prompt
+
+
+# Define the endpoint
+@app.post("/api/answergen")
+async def answergen_ollama(request: QueryRequest):
+    query = request.query
+    context = await make_request(query, request.course_id)
+    if context is None:
+        raise HTTPException(status_code=500, detail="Failed to fetch context")
+
     # Generate the response using the utility function
-    full_text = await generate_response(
-        request, context, answergen_system_prompt, answergen_user_prompt
+    filtered_context_answergen, full_text = await generate_with_context_filter(
+        request, context, partial(build_answergen_prompts, request)
     )
+    print("Filtered context for answergen: " + filtered_context_answergen)
 
     relevance_filtered_response_for_answer_generation = (
         await response_relevance_filter_for_answer_generation(
@@ -1363,6 +1515,29 @@ async def answergen_ollama(request: QueryRequest):
     return response
 
 
+@app.post("/api/answergen/stream")
+async def answergen_ollama_stream(request: QueryRequest):
+    context = await make_request(request.query, request.course_id)
+    if context is None:
+        raise HTTPException(status_code=500, detail="Failed to fetch context")
+
+    async def finish(full_text: str, filtered_context: str):
+        relevance_filtered_response_for_answer_generation = (
+            await response_relevance_filter_for_answer_generation(
+                request.query, full_text
+            )
+        )
+        return "verdict", {
+            "answer": relevance_filtered_response_for_answer_generation,
+            "relevant": relevance_filtered_response_for_answer_generation
+            == full_text,
+        }
+
+    return sse_generation_response(
+        request, context, partial(build_answergen_prompts, request), finish
+    )
+
+
 # # we do not need this
 # async def generate_question_variants(base_question, n, context):
 #     # Join the context into a single string
@@ -1518,11 +1693,11 @@ def extract_variants(base_question, content):
 @app.post("/api/assignments")
 async def get_the_assignments(request: CourseIDRequest):
     try:
-        course_id, course_name = get_course_info_by_shortname(
+        course_id, course_name = await get_course_info_by_shortname(
             request.course_shortname
         )
 
-        assignments = get_assignments(course_id)
+        assignments = await get_assignments(course_id)
         return JSONResponse(
             content={
                 "course_name": course_name,
@@ -1538,38 +1713,38 @@ async def get_the_assignments(request: CourseIDRequest):
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
 
-def get_all_courses():
+async def get_all_courses():
     params = {
         "wstoken": TOKEN,
         "wsfunction": "core_course_get_courses",
         "moodlewsrestformat": "json",
     }
-    return moodle_api_call(params)
+    return await moodle_api_call(params)
 
 
 # Function to get enrolled users in a specific course
-def get_enrolled_users(course_id):
+async def get_enrolled_users(course_id):
     params = {
         "wstoken": TOKEN,
         "wsfunction": "core_enrol_get_enrolled_users",
         "moodlewsrestformat": "json",
         "courseid": course_id,
     }
-    return moodle_api_call(params)
+    return await moodle_api_call(params)
 
 
 # Function to check admin capabilities
-def check_admin_capabilities():
+async def check_admin_capabilities():
     params = {
         "wstoken": TOKEN,
         "wsfunction": "core_webservice_get_site_info",
         "moodlewsrestformat": "json",
     }
-    site_info = moodle_api_call(params)
+    site_info = await moodle_api_call(params)
     print("Site Info:", site_info)
 
 
-def get_course_info_by_shortname(course_shortname):
+async def get_course_info_by_shortname(course_shortname):
     params = {
         "wstoken": TOKEN,
         "wsfunction": "core_course_get_courses_by_field",
@@ -1577,7 +1752,7 @@ def get_course_info_by_shortname(course_shortname):
         "field": "shortname",
         "value": course_shortname,
     }
-    result = moodle_api_call(params)
+    result = await moodle_api_call(params)
     if result["courses"]:
         course = result["courses"][0]
         return course["id"], course["fullname"]
@@ -1586,7 +1761,7 @@ def get_course_info_by_shortname(course_shortname):
 
 
 # Function to get assignments for a specific course
-def get_assignments(course_id):
+async def get_assignments(course_id):
     params = {
         "wstoken": TOKEN,
         "wsfunction": "mod_assign_get_assignments",
@@ -1595,7 +1770,7 @@ def get_assignments(course_id):
     }
 
     extra_params = {"includenotenrolledcourses": 1}
-    assignments = moodle_api_call(params, extra_params)
+    assignments = await moodle_api_call(params, extra_params)
 
     if not assignments.get("courses"):
         print("No courses found.")
@@ -1618,14 +1793,14 @@ def get_assignments(course_id):
 
 
 # Function to get submissions for a specific assignment
-def get_assignment_submissions(assignment_id):
+async def get_assignment_submissions(assignment_id):
     params = {
         "wstoken": TOKEN,
         "wsfunction": "mod_assign_get_submissions",
         "moodlewsrestformat": "json",
         "assignmentids[0]": assignment_id,
     }
-    submissions = moodle_api_call(params)
+    submissions = await moodle_api_call(params)
 
     if not submissions.get("assignments"):
         return []
@@ -1645,48 +1820,12 @@ def get_assignment_submissions(assignment_id):
 
 
 # Function to download a file from a given URL
-def download_file(url):
-    response = requests.get(url)
-    if response.status_code == 200:
-        return response.content
-    else:
-        raise Exception(
-            f"Failed to download file: {response.status_code}, URL: {url}"
-        )
-
-
-# Function to extract text from a PDF file
-def extract_text_from_pdf(file_content):
-    try:
-        doc = fitz.open(stream=file_content, filetype="pdf")
-        text = ""
-        for page in doc:
-            text += page.get_text()
-        return text
-    except Exception as e:
-        return f"Error extracting text from PDF: {str(e)}"
-
-
-# Function to extract text from a DOCX file
-def extract_text_from_docx(file_content):
-    with io.BytesIO(file_content) as f:
-        doc = Document(f)
-        return "\n".join([para.text for para in doc.paragraphs])
-
-
-# Function to extract text from a TXT file
-def extract_text_from_txt(file_content):
-    return file_content.decode("utf-8")
-
-
-# Function to extract text from an image file
-def extract_text_from_image(file_content):
-    image = Image.open(io.BytesIO(file_content))
-    return pytesseract.image_to_string(image)
+async def download_file(url):
+    return await moodle_client.download(url)
 
 
 # Function to extract text from a submission file based on file type
-def extract_text_from_submission(file):
+async def extract_text_from_submission(file):
     file_url = file["fileurl"]
     file_url_with_token = (
         f"{file_url}&token={TOKEN}"
@@ -1697,23 +1836,12 @@ def extract_text_from_submission(file):
         f"Downloading file from URL: {file_url_with_token}"
     )  # Log the file URL
 
-    file_content = download_file(file_url_with_token)
+    file_content = await download_file(file_url_with_token)
     file_name = file["filename"].lower()
     print(f"Processing file: {file_name}")  # Log the file name
 
-    try:
-        if file_name.endswith(".pdf"):
-            return extract_text_from_pdf(file_content)
-        elif file_name.endswith(".docx"):
-            return extract_text_from_docx(file_content)
-        elif file_name.endswith(".txt"):
-            return extract_text_from_txt(file_content)
-        elif file_name.endswith((".png", ".jpg", ".jpeg")):
-            return extract_text_from_image(file_content)
-        else:
-            return "Unsupported file format."
-    except Exception as e:
-        return f"Error extracting text: {str(e)}"
+    # CPU-bound (OCR, PDF parsing), runs in the extraction process pool
+    return await extraction_pool.extract(file_name, file_content)
 
 
 # Function to extract Q&A pairs using regex
@@ -1742,105 +1870,124 @@ def split_qa_pair(qa_pair):
     return question, answer
 
 
-# Function to send Q&A pair to grading endpoint and get response
-async def process_user_submissions(
-    user,
-    submissions_by_user,
-    activity_type,
-    rubric_payload,
-    ground_truth_payload,
-):
-    user_id = user["id"]
-    user_fullname = user["fullname"]
-    user_email = user["email"]
-    user_submission = submissions_by_user.get(user_id)
-
+# Function to extract the Q&A pairs of a user's submitted files
+async def extract_user_submission(user, submissions_by_user, activity_type):
+    """Extracts the Q&A pairs of every file a user submitted
+    @parameter: user : dict - Moodle user
+    @parameter: submissions_by_user : dict - Submissions by user id
+    @parameter: activity_type : str - Activity type, only "assignment" is supported
+    @returns list[list[tuple]] - Per file, its (qa_pair, question, answer) tuples
+        (None if the file could not be downloaded or extracted),
+        None if the user did not submit.
+    """
+    user_submission = submissions_by_user.get(user["id"])
     if not user_submission:
-        return {
-            "Full Name": user_fullname,
-            "User ID": user_id,
-            "Email": user_email,
-            "Total Score": 0,
-            "Feedback": "No submission",
-        }
-
-    total_score = 0
-    all_comments = []
+        return None
 
+    submitted_files = []
     if activity_type == "assignment":
         for plugin in user_submission["plugins"]:
             if plugin["type"] == "file":
                 for filearea in plugin["fileareas"]:
-                    for file in filearea["files"]:
-                        try:
-                            print(
-                                f"\nProcessing file: {file['filename']} for {user_fullname}..."
-                            )
-                            text = extract_text_from_submission(file)
-                            qa_pairs = extract_qa_pairs(text)
-                            print("QAPAIRS", qa_pairs)
-                            for i, qa_pair in enumerate(qa_pairs):
+                    submitted_files.extend(filearea["files"])
 
-                                try:
-                                    print(qa_pair)
-                                    question_req, answer_req = split_qa_pair(
-                                        qa_pair
-                                    )
-                                    print(question_req)
-                                    print(answer_req)
-                                    query_request_rubric = (
-                                        QueryRequestWithGroundTruth(
-                                            question=question_req,
-                                            answer=answer_req,
-                                            rubric=rubric_payload,
-                                            ground_truth=ground_truth_payload,
-                                        )
-                                    )
+    async def extract_file(file):
+        try:
+            print(f"\nProcessing file: {file['filename']} for {user['fullname']}...")
+            text = await extract_text_from_submission(file)
+            # Extraction errors (timeouts, crashed workers, ...) are returned as text
+            if text.startswith("Error extracting text"):
+                raise ValueError(text)
+            qa_pairs = extract_qa_pairs(text)
+            print("QAPAIRS", qa_pairs)
+            return [(qa_pair, *split_qa_pair(qa_pair)) for qa_pair in qa_pairs]
+        except Exception as e:
+            print(f"  Error extracting text for {user['fullname']}: {str(e)}")
+            return None
 
-                                    query_request = QueryRequest(query=qa_pair)
-                                    result_feedback = (
-                                        await ollama_aga_with_ground_truth(
-                                            query_request_rubric
-                                        )
-                                    )
+    # Files download and extract concurrently, keeping their order
+    return await asyncio.gather(*[extract_file(file) for file in submitted_files])
 
-                                    justification = result_feedback[
-                                        "justification"
-                                    ]
-                                    # result = await ollama_aga(query_request)
-                                    # avg_score = result.get("average_score")
-                                    total_score += result_feedback["score"]
-                                    comment = f"Q{i+1}: {justification}"
-                                    all_comments.append(comment)
 
-                                except Exception as e:
-                                    print(
-                                        f"  Error grading Q&A pair {i+1} for {user_fullname}: {str(e)}"
-                                    )
-                        except Exception as e:
-                            print(
-                                f"  Error extracting text for {user_fullname}: {str(e)}"
-                            )
+async def build_ground_truths(questions, course_id=None) -> dict:
+    """Builds the ground truth of every distinct question once, concurrently
+    @parameter: questions : list[str] - Distinct questions of the assignment
+    @parameter: course_id : str - Course to retrieve from
+    @returns dict - Ground truth by question, questions that failed are left out and
+        rebuilt when graded.
+    """
+    results = await asyncio.gather(
+        *[build_ground_truth(question, course_id) for question in questions],
+        return_exceptions=True,
+    )
+    ground_truths = {}
+    for question, result in zip(questions, results):
+        if isinstance(result, Exception):
+            print(f"  Error building ground truth for '{question}': {str(result)}")
+            continue
+        ground_truths[question] = result
+    return ground_truths
 
-    feedback = " | ".join(all_comments)
-    return {
-        "Full Name": user_fullname,
-        "User ID": user_id,
-        "Email": user_email,
-        "Total Score": total_score,
-        "Feedback": feedback,
-    }
+
+GRADING_MAX_CONCURRENCY = int(os.getenv("GRADING_MAX_CONCURRENCY", "4"))
+
+
+# Function to send Q&A pair to grading endpoint and get response
+async def grade_qa_pair(
+    rubric_payload,
+    ground_truth_payload,
+    ground_truths,
+    user,
+    i,
+    qa_pair,
+    question_req,
+    answer_req,
+):
+    """Grades one Q&A pair of a submission, see grade_submissions
+    @parameter: ground_truths : dict - Ground truth by question,
+        used when no ground_truth_payload is given
+    @parameter: user : dict - Student
+    @parameter: i : int - Index of the pair in its file
+    @returns tuple[float, str] - Score and comment, None if grading failed.
+    """
+    user_fullname = user["fullname"]
+    try:
+        print(qa_pair)
+        print(question_req)
+        print(answer_req)
+        query_request_rubric = QueryRequestWithGroundTruth(
+            question=question_req,
+            answer=answer_req,
+            rubric=rubric_payload,
+            # Precomputed once per question by the pipeline
+            ground_truth=ground_truth_payload or ground_truths.get(question_req, ""),
+        )
+
+        result_feedback = await ollama_aga_with_ground_truth(query_request_rubric)
+
+        justification = result_feedback["justification"]
+        if result_feedback["score"] is None:
+            # No spanda_final_score in the response, counted like a failed pair
+            raise ValueError("no score found in the grading response")
+        return result_feedback["score"], f"Q{i+1}: {justification}"
+
+    except Exception as e:
+        print(f"  Error grading Q&A pair {i+1} for {user_fullname}: {str(e)}")
+        return None
 
 
 # Function to get course details by ID
-def get_course_by_id(course_id):
+async def get_course_by_id(course_id):
     params = {
         "wstoken": TOKEN,
         "wsfunction": "core_course_get_courses",
         "moodlewsrestformat": "json",
         "options[ids][0]": course_id,
     }
-    return moodle_api_call(params)
+    return await moodle_api_call(params)
+
+
+CSV_COLUMNS = ["Full Name", "User ID", "Email", "Total Score", "Feedback"]
 
 
 # Function to write data to a CSV file in Moodle-compatible format
@@ -1849,20 +1996,20 @@ def write_to_csv(data, course_id, assignment_name):
     with open(filename, mode="w", newline="", encoding="utf-8") as file:
         writer = csv.writer(file)
         print("FILENAME", filename)
-        writer.writerow(
-            ["Full Name", "User ID", "Email", "Total Score", "Feedback"]
-        )
+        writer.writerow(CSV_COLUMNS)
         print("DATA", data, course_id, assignment_name)
         for row in data:
-            writer.writerow(
-                [
-                    row["Full Name"],
-                    row["User ID"],
-                    row["Email"],
-                    row["Total Score"],
-                    row["Feedback"],
-                ]
-            )
+            writer.writerow([row[column] for column in CSV_COLUMNS])
+
+
+# Function to format rows as CSV in the same format, e.g. for a partial export
+def format_csv(data) -> str:
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(CSV_COLUMNS)
+    for row in data:
+        writer.writerow([row[column] for column in CSV_COLUMNS])
+    return output.getvalue()
 
 
 async def process_user_submissions2(
@@ -1894,7 +2041,7 @@ async def process_user_submissions2(
                             print(
                                 f"\nProcessing file: {file['filename']} for {user_fullname}..."
                             )
-                            text = extract_text_from_submission(file)
+                            text = await extract_text_from_submission(file)
                             qa_pairs = extract_qa_pairs(text)
                             print("QAPAIRS", qa_pairs)
                             for i, qa_pair in enumerate(qa_pairs):
@@ -1934,7 +2081,7 @@ async def process_user_submissions2(
 
 
 # Function to update a user's grade in Moodle
-def update_grade(user_id, assignment_id, grade, feedback):
+async def update_grade(user_id, assignment_id, grade, feedback):
     params = {
         "wstoken": TOKEN,
         "wsfunction": "mod_assign_save_grade",
@@ -1944,24 +2091,29 @@ def update_grade(user_id, assignment_id, grade, feedback):
         "grade": grade,
         "feedback": feedback,
     }
-    response = moodle_api_call(params)
+    response = await moodle_api_call(params)
     print(f"Grade updated for User ID: {user_id}, Status: {response}")
 
 
 # Main function to integrate with Moodle
 async def moodle_integration_pipeline(
-    course_shortname, assignment_name, activity_type, rubric, ground_truth
+    course_shortname,
+    assignment_name,
+    activity_type,
+    rubric,
+    ground_truth,
+    job_id=None,
 ):
     try:
 
         print(
             f"\n=== Fetching Course Details for Shortname: {course_shortname} ==="
         )
-        course_id, course_name = get_course_info_by_shortname(course_shortname)
+        course_id, course_name = await get_course_info_by_shortname(course_shortname)
         print(f"Course ID: {course_id}, Course Name: {course_name}")
         # Fetching course details
         print(f"\n=== Fetching Course Details for Course ID: {course_id} ===")
-        course_details = get_course_by_id(course_id)
+        course_details = await get_course_by_id(course_id)
         if not course_details:
             raise Exception("Course not found.")
         course_name = course_details[0]["fullname"]
@@ -1969,13 +2121,13 @@ async def moodle_integration_pipeline(
 
         # Fetching enrolled users
         print("\n=== Fetching Enrolled Users ===")
-        users = get_enrolled_users(course_id)
+        users = await get_enrolled_users(course_id)
         print(f"Found {len(users)} enrolled users.")
 
         if activity_type == "assignment":
             # Fetching assignments
             print("\n=== Fetching Assignments ===")
-            activities = get_assignments(course_id)
+            activities = await get_assignments(course_id)
         else:
             raise Exception("Unsupported activity type.")
 
@@ -2000,21 +2152,130 @@ async def moodle_integration_pipeline(
 
         # Fetching submissions for the assignment
         print("\n=== Fetching Submissions ===")
-        submissions = get_assignment_submissions(activity_id)
+        submissions = await get_assignment_submissions(activity_id)
 
         print(f"Found {len(submissions)} submissions.")
 
         submissions_by_user = {s["userid"]: s for s in submissions}
 
+        def get_submitted(user):
+            submission = submissions_by_user.get(user["id"])
+            return submission.get("timemodified", 0) if submission else 0
+
+        # A resumed job reuses the ground truths it built before
+        ground_truths = grading_jobs.get_ground_truths(job_id) if job_id else {}
+
+        def is_current(user, result):
+            ground_truth_hash = get_ground_truth_hash(
+                rubric, ground_truth, result["questions"], ground_truths
+            )
+            return (
+                result["submitted"] == get_submitted(user)
+                and result["ground_truth_hash"] == ground_truth_hash
+            )
+
+        # Skipping students a resumed job already graded, unless they resubmitted
+        # since or the ground truth they were graded against changed
+        stored = grading_jobs.get_results(job_id) if job_id else {}
+        graded = {
+            user["id"]: stored[user["id"]]["row"]
+            for user in users
+            if user["id"] in stored and is_current(user, stored[user["id"]])
+        }
+        pending = [user for user in users if user["id"] not in graded]
+        if job_id:
+            grading_jobs.update_job(
+                job_id,
+                total=len(users),
+                graded=0,
+                skipped=len(graded),
+                incomplete=0,
+            )
+            print(f"Skipping {len(graded)} students already graded by this job.")
+
+        # Extracting every submission first, so all distinct questions are known
+        # before grading
+        print("\n=== Extracting Submissions ===")
+        # Downloads overlap, bounded by the Moodle client's concurrency limit
+        extracted = dict(
+            zip(
+                [user["id"] for user in pending],
+                await asyncio.gather(
+                    *[
+                        extract_user_submission(
+                            user, submissions_by_user, activity_type
+                        )
+                        for user in pending
+                    ]
+                ),
+            )
+        )
+
+        def get_questions(user_id):
+            return sorted(
+                {
+                    question
+                    for qa_pairs in extracted[user_id] or []
+                    if qa_pairs is not None
+                    for _, question, _ in qa_pairs
+                    if question
+                }
+            )
+
+        # Building the ground truth once per distinct question, not once per student
+        if not ground_truth:
+            questions = sorted(
+                {
+                    question
+                    for user_id in extracted
+                    for question in get_questions(user_id)
+                    if question not in ground_truths
+                }
+            )
+            print(f"\n=== Building Ground Truth for {len(questions)} Questions ===")
+            ground_truths.update(await build_ground_truths(questions))
+            if job_id:
+                grading_jobs.set_ground_truths(job_id, ground_truths)
+
+        def checkpoint(user, row, complete):
+            # Saved as soon as the student is graded, a failed or interrupted run
+            # keeps it. Rows with failed files or pairs (e.g. during an outage) are
+            # graded again.
+            if not job_id:
+                return
+            if complete:
+                questions = get_questions(user["id"])
+                grading_jobs.save_result(
+                    job_id,
+                    user["id"],
+                    get_submitted(user),
+                    questions,
+                    get_ground_truth_hash(
+                        rubric, ground_truth, questions, ground_truths
+                    ),
+                    row,
+                )
+            else:
+                grading_jobs.record_incomplete(job_id)
+
         # Processing submissions
         print("\n=== Processing Submissions ===")
-        tasks = [
-            process_user_submissions(
-                user, submissions_by_user, activity_type, rubric, ground_truth
+        pair_count = sum(
+            len(qa_pairs or [])
+            for files in extracted.values()
+            for qa_pairs in files or []
+        )
+        msg.info(f"Grading {pair_count} Q&A pairs of {len(pending)} students")
+        graded.update(
+            await grade_submissions(
+                pending,
+                extracted,
+                partial(grade_qa_pair, rubric, ground_truth, ground_truths),
+                GRADING_MAX_CONCURRENCY,
+                on_row=checkpoint,
             )
-            for user in users
-        ]
-        processed_data = await asyncio.gather(*tasks)
+        )
+        processed_data = [graded[user["id"]] for user in users]
 
         # Writing data to CSV
         print("\n=== Writing Data to CSV ===")
@@ -2036,12 +2297,12 @@ async def moodle_integration_pipeline2(
         print(
             f"\n=== Fetching Course Details for Shortname: {course_shortname} ==="
         )
-        course_id, course_name = get_course_info_by_shortname(course_shortname)
+        course_id, course_name = await get_course_info_by_shortname(course_shortname)
         print(f"Course ID: {course_id}, Course Name: {course_name}")
 
         # Fetching course details
         print(f"\n=== Fetching Course Details for Course ID: {course_id} ===")
-        course_details = get_course_by_id(course_id)
+        course_details = await get_course_by_id(course_id)
         if not course_details:
             raise Exception("Course not found.")
         course_name = course_details[0]["fullname"]
@@ -2049,13 +2310,13 @@ async def moodle_integration_pipeline2(
 
         # Fetching enrolled users
         print("\n=== Fetching Enrolled Users ===")
-        users = get_enrolled_users(course_id)
+        users = await get_enrolled_users(course_id)
         print(f"Found {len(users)} enrolled users.")
 
         if activity_type == "assignment":
             # Fetching assignments
             print("\n=== Fetching Assignments ===")
-            activities = get_assignments(course_id)
+            activities = await get_assignments(course_id)
         else:
             raise Exception("Unsupported activity type.")
 
@@ -2080,7 +2341,7 @@ async def moodle_integration_pipeline2(
 
         # Fetching submissions for the assignment
         print("\n=== Fetching Submissions ===")
-        submissions = get_assignment_submissions(activity_id)
+        submissions = await get_assignment_submissions(activity_id)
 
         print(f"Found {len(submissions)} submissions.")
 
@@ -2111,36 +2372,141 @@ async def moodle_integration_pipeline2(
 # Main function to integrate with Moodle
 
 
-@app.post("/api/process")
-async def grade_assignment(request: RequestAGA):
+# Running grading jobs by job id, holding a reference keeps the tasks from being garbage
+# collected
+grading_tasks: Dict[str, asyncio.Task] = {}
 
-    course_shortname = request.course_shortname
-    assignment_name = request.assignment_name
-    activity_type = "assignment"
-    rubric = request.rubric
-    ground_truth = request.ground_truth
 
+async def run_grading_job(job_id: str) -> list:
+    """Runs (or resumes) a grading job, see moodle_integration_pipeline for what a
+    resumed job skips
+    @parameter: job_id : str - Job created by grading_jobs.create_job
+    @returns list - Rows of all enrolled students.
+    """
+    llm_priority.set("batch")
+    request = grading_jobs.get_job(job_id)["request"]
+    grading_jobs.update_job(job_id, status="running", error=None)
     try:
         processed_data = await moodle_integration_pipeline(
-            course_shortname,
-            assignment_name,
-            activity_type,
-            rubric,
-            ground_truth,
+            request["course_shortname"],
+            request["assignment_name"],
+            "assignment",
+            request["rubric"],
+            request["ground_truth"],
+            job_id=job_id,
+        )
+    except BaseException as e:
+        grading_jobs.update_job(
+            job_id,
+            status="interrupted" if isinstance(e, asyncio.CancelledError) else "failed",
+            error=str(e),
         )
+        raise
+    grading_jobs.update_job(job_id, status="completed")
+    return processed_data
+
+
+def start_grading_job(job_id: str) -> asyncio.Task:
+    """Runs a grading job in the background, tracked in grading_tasks so it cannot be
+    resumed while it is still running
+    @parameter: job_id : str - Job created by grading_jobs.create_job
+    @returns asyncio.Task - Task returning the rows of all enrolled students.
+    """
+    task = asyncio.create_task(run_grading_job(job_id))
+    grading_tasks[job_id] = task
+
+    def forget(task):
+        grading_tasks.pop(job_id, None)
+        # The error is recorded on the job
+        if not task.cancelled():
+            task.exception()
+
+    task.add_done_callback(forget)
+    return task
+
+
+@app.post("/api/process")
+async def grade_assignment(request: RequestAGA):
+    # Checkpointed like a background job, a failed run can be resumed by its job_id
+    job_id = grading_jobs.create_job(request.model_dump())
+
+    try:
+        processed_data = await start_grading_job(job_id)
         return JSONResponse(
             content={
                 "status": "success",
                 "message": "Grading completed successfully",
+                "job_id": job_id,
                 "data": processed_data,
             }
         )
     except Exception as e:
         return JSONResponse(
-            content={"status": "error", "message": str(e)}, status_code=500
+            content={"status": "error", "message": str(e), "job_id": job_id},
+            status_code=500,
         )
 
 
+@app.post("/api/process/jobs")
+async def create_grading_job(request: RequestAGA):
+    job_id = grading_jobs.create_job(request.model_dump())
+    start_grading_job(job_id)
+    return JSONResponse(content={"job_id": job_id, "status": "queued"})
+
+
+def get_grading_job_or_404(job_id: str) -> dict:
+    job = grading_jobs.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Grading job not found")
+    return job
+
+
+@app.get("/api/process/jobs/{job_id}")
+async def get_grading_job(job_id: str):
+    job = get_grading_job_or_404(job_id)
+    return JSONResponse(
+        content={
+            "job_id": job_id,
+            "status": job["status"],
+            "course_shortname": job["request"]["course_shortname"],
+            "assignment_name": job["request"]["assignment_name"],
+            "total": job["total"],
+            "graded": job["graded"],
+            "skipped": job["skipped"],
+            "incomplete": job["incomplete"],
+            "done": job["graded"] + job["skipped"],
+            "error": job["error"],
+            "created": job["created"],
+            "updated": job["updated"],
+        }
+    )
+
+
+@app.post("/api/process/jobs/{job_id}/resume")
+async def resume_grading_job(job_id: str):
+    job = get_grading_job_or_404(job_id)
+    if job_id in grading_tasks:
+        raise HTTPException(status_code=409, detail="Grading job is still running")
+    start_grading_job(job_id)
+    return JSONResponse(content={"job_id": job_id, "status": "queued"})
+
+
+@app.get("/api/process/jobs/{job_id}/csv")
+async def export_grading_job(job_id: str):
+    """Exports every student graded so far, also while the job is still running."""
+    job = get_grading_job_or_404(job_id)
+    rows = sorted(
+        (result["row"] for result in grading_jobs.get_results(job_id).values()),
+        key=lambda row: row["Full Name"],
+    )
+    filename = f"{job['request']['assignment_name'].replace(' ', '_')}_autograded.csv"
+    return Response(
+        content=format_csv(rows),
+        media_type="text/csv",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
 @app.post("/api/process2")
 async def grade_assignment(
     request: RequestAGA, token: str = Depends(oauth2_scheme)
@@ -2169,20 +2535,31 @@ async def grade_assignment(
         )
 
 
+async def build_ground_truth(question: str, course_id: str = None) -> str:
+    """Retrieves the course context for a question and keeps it only if the relevance
+    filter accepts it
+    @parameter: question : str - Question to build the ground truth for
+    @parameter: course_id : str - Course to retrieve from
+    @returns str - Filtered context (" " if it was rejected).
+    """
+    ground_truth = await make_request(question, course_id)
+    print("stage 1")
+    print(ground_truth)
+    ground_truth = await context_relevance_filter(question, ground_truth)
+    print("stage 2")
+    print(ground_truth)
+    return ground_truth
+
+
 @app.post("/api/ollamaAGA_with_ground_truth")
 async def ollama_aga_with_ground_truth(request: QueryRequestWithGroundTruth):
 
     print("tttttttttttttt", request.question)
     print("pppppppppppppp", request.answer)
     if request.ground_truth == "":
-        request.ground_truth = await make_request(request.question)
-        print("stage 1")
-        print(request.ground_truth)
-        request.ground_truth = await context_relevance_filter(
-            request.question, request.ground_truth
+        request.ground_truth = await build_ground_truth(
+            request.question, request.course_id
         )
-        print("stage 2")
-        print(request.ground_truth)
 
     if request.rubric == None:
         request.rubric = request.default_rubric
@@ -2222,6 +2599,7 @@ async def ollama_aga_with_ground_truth(request: QueryRequestWithGroundTruth):
         request.ground_truth,
         aga_with_ground_truth_system_prompt,
         aga_with_ground_truth_user_prompt,
+        options=GRADING_OPTIONS,
     )
 
     relevance_filtered_response_for_aga_with_ground_truth = (
@@ -2254,7 +2632,7 @@ async def ollama_aga_with_ground_truth(request: QueryRequestWithGroundTruth):
 @app.post("/api/ollamaAGA")
 async def ollama_aga(request: QueryRequest):
     # Extract context
-    context = await make_request(request.query)
+    context = await make_request(request.query, request.course_id)
     if context is None:
         raise HTTPException(status_code=500, detail="Failed to fetch context")
     # Example custom prompts
@@ -2330,7 +2708,11 @@ async def ollama_aga(request: QueryRequest):
     # Generate the response using the utility function
     print(request.query)
     full_text = await generate_response(
-        request, context, aga_system_prompt, aga_user_prompt
+        request,
+        context,
+        aga_system_prompt,
+        aga_user_prompt,
+        options=GRADING_OPTIONS,
     )
 
     # Extract the response content
@@ -2381,7 +2763,7 @@ async def ollama_aga2(
     request: QueryRequest, current_user: TokenData = Depends(get_current_user)
 ):
     # Extract context
-    context = await make_request(request.query)
+    context = await make_request(request.query, request.course_id)
     if context is None:
         raise HTTPException(status_code=500, detail="Failed to fetch context")
     # Example custom prompts
@@ -2454,7 +2836,11 @@ async def ollama_aga2(
     # Generate the response using the utility function
     print(request.query)
     full_text = await generate_response(
-        request, context, aga_system_prompt, aga_user_prompt
+        request,
+        context,
+        aga_system_prompt,
+        aga_user_prompt,
+        options=GRADING_OPTIONS,
     )
 
     # Extract the response content
@@ -2484,23 +2870,12 @@ async def ollama_aga2(
     return response
 
 
-@app.post("/api/ollamaAQG")
-async def ollama_aqg(request: QueryRequestaqg):
+# Example custom prompts
+def build_aqg_prompts(
+    request: QueryRequestaqg, filtered_aqg_context: str
+) -> tuple[str, str]:
     query = request.query
     n = request.NumberOfVariants
-    # Extract context
-    context = await make_request(request.query)
-    if context is None:
-        raise HTTPException(status_code=500, detail="Failed to fetch context")
-
-    filtered_aqg_context = await context_relevance_filter(
-        request.query, context
-    )
-    print("FIltered AQG context: ")
-    print(filtered_aqg_context)
-    # print("FILTERED AQG CONTEXT:")
-    # print(context)
-    # Example custom prompts
     aqg_system_prompt = f"""
         **Task: Design a Variety of Mathematical and Conceptual Problem Scenarios**
 
@@ -2600,16 +2975,48 @@ async def ollama_aqg(request: QueryRequestaqg):
             In multi-part problems, maintain the original structure while ensuring each variant part is thoughtfully designed and distinct. Type 'Spanda' before the beggining of every variant. Make sure to add 'Spanda' before every variant, its important.
             Please change the numbers wherever possible.
         """
+    return aqg_system_prompt, aqg_user_prompt
+
+
+@app.post("/api/ollamaAQG")
+async def ollama_aqg(request: QueryRequestaqg):
+    query = request.query
+    # Extract context
+    context = await make_request(request.query, request.course_id)
+    if context is None:
+        raise HTTPException(status_code=500, detail="Failed to fetch context")
+
+    # print("FILTERED AQG CONTEXT:")
+    # print(context)
     # Generate the response using the utility function
-    full_text = await generate_response(
-        request, context, aqg_system_prompt, aqg_user_prompt
+    filtered_aqg_context, full_text = await generate_with_context_filter(
+        request, context, partial(build_aqg_prompts, request)
     )
+    print("FIltered AQG context: ")
+    print(filtered_aqg_context)
     # relevance_filtered_response_for_question_generation = await response_relevance_filter_for_question_generation(request.query, full_text)
     variants_dict = extract_variants(query, full_text)
     response = {"variants": full_text, "variants_dict": variants_dict}
     return response
 
 
+@app.post("/api/ollamaAQG/stream")
+async def ollama_aqg_stream(request: QueryRequestaqg):
+    context = await make_request(request.query, request.course_id)
+    if context is None:
+        raise HTTPException(status_code=500, detail="Failed to fetch context")
+
+    async def finish(full_text: str, filtered_context: str):
+        return "variants", {
+            "variants": full_text,
+            "variants_dict": extract_variants(request.query, full_text),
+        }
+
+    return sse_generation_response(
+        request, context, partial(build_aqg_prompts, request), finish
+    )
+
+
 # @app.post("/api/ollamaAQG")
 # async def ollama_aqg(request: QueryRequestaqg):
 #     query = request.query
@@ -2631,7 +3038,7 @@ async def ollama_aqg(
     query = request.query
     n = request.NumberOfVariants
     # Extract context
-    context = await make_request(request.query)
+    context = await make_request(request.query, request.course_id)
     if context is None:
         raise HTTPException(status_code=500, detail="Failed to fetch context")
     # Example custom prompts
@@ -2742,17 +3149,77 @@ async def ollama_aqg(
     return response
 
 
+# Greedy sampling for grading calls (GRADING_DETERMINISTIC), which makes regrading
+# reproducible and lets it be served from the completion cache. Off by default, grading
+# then keeps the model's own sampling and is not cached.
+GRADING_OPTIONS = (
+    DETERMINISTIC_OPTIONS
+    if os.getenv("GRADING_DETERMINISTIC", "false").lower() in ("1", "true", "yes")
+    else None
+)
+
+
 async def generate_response(
     request: QueryRequest,
     context: str,
     custom_system_prompt: str,
     custom_user_prompt: str,
+    metrics: dict = None,
+    format: dict = None,
+    options: dict = None,
 ) -> str:
+    # Keyed on exactly what the model sees
+    messages = OllamaGenerator().prepare_messages(
+        [request.query], [context], {}, custom_system_prompt, custom_user_prompt
+    )
+    key = completion_cache.get_key(
+        os.environ.get("OLLAMA_MODEL", ""), messages, options, format
+    )
+
+    # Greedy generations are reproducible, serve repeats (e.g. a regrading run) from the
+    # cache
+    deterministic = is_deterministic(options)
+    if deterministic:
+        cached = completion_cache.get(key)
+        if cached is not None:
+            if metrics is not None:
+                metrics["cached"] = True
+            return cached["text"]
+
+    # Identical concurrent generations share one call
+    full_text, stats = await generation_flight.do(
+        key,
+        lambda: stream_generation(
+            request,
+            context,
+            custom_system_prompt,
+            custom_user_prompt,
+            format,
+            options,
+        ),
+    )
+    if deterministic and full_text:
+        completion_cache.set(key, {"text": full_text, "stats": stats})
+    # Prompt/eval token counts and timings reported by the backend
+    if metrics is not None:
+        metrics.update(stats)
+    return full_text
+
+
+async def stream_generation(
+    request: QueryRequest,
+    context: str,
+    custom_system_prompt: str,
+    custom_user_prompt: str,
+    format: dict = None,
+    options: dict = None,
+) -> tuple[str, dict]:
     # Initialize the generator
     generator = OllamaGenerator()
 
     conversation = {}  # Replace with actual conversation data if available
     full_text = ""
+    stats = {}
     # Pass the custom prompts to generate_stream
     async for chunk in generator.generate_stream(
         [request.query],
@@ -2760,44 +3227,245 @@ async def generate_response(
         conversation,
         system_prompt=custom_system_prompt,  # Custom system prompt
         user_prompt=custom_user_prompt,  # Custom user prompt
+        format=format,  # JSON schema for structured output
+        options=options,
     ):
         full_text += chunk["message"]
         if chunk["finish_reason"] == "stop":
+            stats = chunk.get("stats", {})
             break
     print(full_text)
-    return full_text
+    return full_text, stats
 
 
-@app.post("/api/spandachat")
-async def spanda_chat(request: QueryRequest):
-    # Extract context
-    context = await make_request(request.query)
-    print(context)
-    if context is None:
-        raise HTTPException(status_code=500, detail="Failed to fetch context")
-    # user_context = " ".join(context)
-    # print("The context is -" + str(type(context)))
-    filtered_context = await context_relevance_filter(request.query, context)
-    # Example custom prompts
+# Off by default: a speculative generation holds a backend slot until the relevance
+# filter answers, and that work is thrown away whenever the filter rejects the context
+SPECULATIVE_GENERATION = os.getenv("SPECULATIVE_GENERATION", "false").lower() in (
+    "1",
+    "true",
+    "yes",
+)
+
+
+async def generate_with_context_filter(
+    request: QueryRequest, context: str, build_prompts
+) -> tuple[str, str]:
+    """Runs context_relevance_filter and answer generation, overlapped when
+    SPECULATIVE_GENERATION is on
+    @parameter: request : QueryRequest - Request, request.query is checked against the
+        context
+    @parameter: context : str - Retrieved context
+    @parameter: build_prompts : Callable[[str], tuple[str, str]] - Builds the system and
+        user prompt for a (filtered) context
+    @returns tuple[str, str] - Filtered context and generated text.
+    """
+    if not SPECULATIVE_GENERATION:
+        filtered_context = await context_relevance_filter(request.query, context)
+        full_text = await generate_response(
+            request, filtered_context, *build_prompts(filtered_context)
+        )
+        return filtered_context, full_text
+
+    # Start generating with the retrieved context right away, the filter usually keeps
+    # it
+    generation = asyncio.create_task(
+        generate_response(request, context, *build_prompts(context))
+    )
+    try:
+        filtered_context = await context_relevance_filter(request.query, context)
+    except BaseException:
+        generation.cancel()
+        raise
+
+    if filtered_context == context:
+        return filtered_context, await generation
+
+    # Context rejected: cancelling the task closes the upstream Ollama stream
+    generation.cancel()
+    try:
+        await generation
+    except asyncio.CancelledError:
+        pass
+    msg.info("Context filtered out, restarting generation without it")
+    full_text = await generate_response(
+        request, filtered_context, *build_prompts(filtered_context)
+    )
+    return filtered_context, full_text
+
+
+async def stream_response(
+    request: QueryRequest,
+    context: str,
+    custom_system_prompt: str,
+    custom_user_prompt: str,
+):
+    """Streaming counterpart of generate_response, yields the generated tokens as they
+    arrive."""
+    generator = OllamaGenerator()
+    async for chunk in generator.generate_stream(
+        [request.query],
+        [context],
+        {},
+        system_prompt=custom_system_prompt,
+        user_prompt=custom_user_prompt,
+    ):
+        if chunk["message"]:
+            yield chunk["message"]
+        if chunk["finish_reason"] == "stop":
+            break
+
+
+async def stream_with_context_filter(
+    request: QueryRequest, context: str, build_prompts
+):
+    """Streaming counterpart of generate_with_context_filter
+    @parameter: request : QueryRequest - Request, request.query is checked against the
+        context
+    @parameter: context : str - Retrieved context
+    @parameter: build_prompts : Callable[[str], tuple[str, str]] - Builds the system and
+        user prompt for a (filtered) context
+    @returns Iterator[tuple[str, str]] - ("context", filtered context) once, then
+        ("token", TOKEN) for every generated token.
+    """
+    if not SPECULATIVE_GENERATION:
+        filtered_context = await context_relevance_filter(request.query, context)
+        yield "context", filtered_context
+        async for token in stream_response(
+            request, filtered_context, *build_prompts(filtered_context)
+        ):
+            yield "token", token
+        return
+
+    # Speculative tokens are buffered until the filter keeps the context
+    tokens = asyncio.Queue()
+
+    async def produce():
+        try:
+            async for token in stream_response(
+                request, context, *build_prompts(context)
+            ):
+                tokens.put_nowait(token)
+        finally:
+            tokens.put_nowait(None)
+
+    producer = asyncio.create_task(produce())
+    try:
+        filtered_context = await context_relevance_filter(request.query, context)
+        yield "context", filtered_context
+
+        if filtered_context == context:
+            while (token := await tokens.get()) is not None:
+                yield "token", token
+            await producer  # Surface generation errors
+            return
+
+        producer.cancel()
+        msg.info("Context filtered out, restarting generation without it")
+        async for token in stream_response(
+            request, filtered_context, *build_prompts(filtered_context)
+        ):
+            yield "token", token
+    finally:
+        # Also runs when the client disconnects, closing the upstream Ollama stream
+        producer.cancel()
+
+
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def sse_generation_response(
+    request: QueryRequest,
+    context: str,
+    build_prompts,
+    finish,
+    no_context_preamble: str = "",
+) -> StreamingResponse:
+    """Streams a generation as server-sent events
+    Events: "context" ({relevant}), "token" ({token}) per generated token, the trailing
+    event returned by finish, "error" ({detail}) on failure and a final "done".
+    @parameter: request : QueryRequest - Request
+    @parameter: context : str - Retrieved context
+    @parameter: build_prompts : Callable[[str], tuple[str, str]] - Builds the system and
+        user prompt for a (filtered) context
+    @parameter: finish : Callable[[str, str], Awaitable[tuple[str, dict]]] - Turns the
+        full text and filtered context into the trailing event
+    @parameter: no_context_preamble : str - Token sent first when the context was
+        filtered out
+    @returns StreamingResponse - text/event-stream response.
+    """
+
+    async def events():
+        filtered_context = context
+        full_text = ""
+        try:
+            async for kind, value in stream_with_context_filter(
+                request, context, build_prompts
+            ):
+                if kind == "context":
+                    filtered_context = value
+                    yield sse_event("context", {"relevant": value != " "})
+                    if value == " " and no_context_preamble:
+                        yield sse_event("token", {"token": no_context_preamble})
+                    continue
+                full_text += value
+                yield sse_event("token", {"token": value})
+
+            event, data = await finish(full_text, filtered_context)
+            yield sse_event(event, data)
+        except Exception as e:
+            msg.fail(f"Streaming generation failed: {str(e)}")
+            yield sse_event("error", {"detail": str(e)})
+        yield sse_event("done", {})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+CHATBOT_NO_CONTEXT_PREAMBLE = (
+    "There is no specific information provided about this topic, "
+    "but I can answer with my intrinsic knowledge as follows: "
+)
+
+
+# Example custom prompts
+def build_chatbot_prompts(
+    request: QueryRequest, filtered_context: str
+) -> tuple[str, str]:
     chatbot_system_prompt = """You are an academic assistant chatbot. Your role is to answer questions based solely on the given content. 
         If a question is outside the provided content, politely inform the user that the given query is outside the provided content but provide an answer based on intrinsic knowledge.
         If someone asks about the chatbot or greets you, explain that you are an assistant designed to help users by answering academic and course-oriented questions. Do not mention irrelevant content."""
     # chatbot_system_prompt = (
     #     """You are an AI responsible for assessing whether the provided content is relevant to a specific query. Carefully analyze the content and determine if it directly addresses or provides pertinent information related to the query. Only respond with "YES" if the content is relevant, or "NO" if it is not. Do not provide any explanations, scores, or additional text—just a single word: "YES" or "NO"."""
     # )
-    print("FILTERED CONTEXT: " + filtered_context)
     chatbot_user_prompt = f"""
         Content: {filtered_context}
 
         Query: {request.query}
         """
-    response_preamble = ""
-    if filtered_context == " ":
-        response_preamble = "There is no specific information provided about this topic, but I can answer with my intrinsic knowledge as follows: "
+    return chatbot_system_prompt, chatbot_user_prompt
+
+
+@app.post("/api/spandachat")
+async def spanda_chat(request: QueryRequest):
+    # Extract context
+    context = await make_request(request.query, request.course_id)
+    print(context)
+    if context is None:
+        raise HTTPException(status_code=500, detail="Failed to fetch context")
+    # user_context = " ".join(context)
+    # print("The context is -" + str(type(context)))
     # Generate the response using the utility function
-    full_text = await generate_response(
-        request, filtered_context, chatbot_system_prompt, chatbot_user_prompt
+    filtered_context, full_text = await generate_with_context_filter(
+        request, context, partial(build_chatbot_prompts, request)
     )
+    print("FILTERED CONTEXT: " + filtered_context)
+    response_preamble = ""
+    if filtered_context == " ":
+        response_preamble = CHATBOT_NO_CONTEXT_PREAMBLE
 
     relevance_filtered_response = await response_relevance_filter_for_chatbot(
         request.query, full_text
@@ -2807,25 +3475,71 @@ async def spanda_chat(request: QueryRequest):
     return response
 
 
+@app.post("/api/spandachat/stream")
+async def spanda_chat_stream(request: QueryRequest):
+    context = await make_request(request.query, request.course_id)
+    if context is None:
+        raise HTTPException(status_code=500, detail="Failed to fetch context")
+
+    async def finish(full_text: str, filtered_context: str):
+        relevance_filtered_response = await response_relevance_filter_for_chatbot(
+            request.query, full_text
+        )
+        response_preamble = (
+            CHATBOT_NO_CONTEXT_PREAMBLE if filtered_context == " " else ""
+        )
+        return "verdict", {
+            "answer": response_preamble + relevance_filtered_response,
+            "relevant": relevance_filtered_response == full_text,
+        }
+
+    return sse_generation_response(
+        request,
+        context,
+        partial(build_chatbot_prompts, request),
+        finish,
+        CHATBOT_NO_CONTEXT_PREAMBLE,
+    )
+
+
 ##################################################################################################################################################################
 #################################################################################################################################################################
 #################################################################################################################################################################
 # Helper methods for post-generation filtering
 
 
-async def response_relevance_filter_for_chatbot(
-    query: str, response: str
-) -> str:
-    evaluate_system_prompt = """You are given a query and a response. Determine if the response is relevant, irrelevant or highly irrelevant to the query. Only respond with "Relevant", "Irrelevant" or "Highly Irrelevant"."""
-    evaluate_user_prompt = f"""
+async def response_relevance_filter(query: str, response: str, kind: str) -> str:
+    """Checks a generated response against its query, decided locally by the relevance
+    gate when the score is clear
+    @parameter: query : str - User query
+    @parameter: response : str - Generated response
+    @parameter: kind : str - Calling endpoint, used for the gate stats
+    @returns str - The response, prefixed with a disclaimer if irrelevant, or an
+        abstention if highly irrelevant.
+    """
+    is_relevant, score = await asyncio.to_thread(
+        relevance_gate.decide, kind, query, response, get_active_embedder()
+    )
+    if is_relevant is not None:
+        # The gate never abstains on its own, "highly irrelevant" is left to the LLM
+        is_response_relevant = "relevant" if is_relevant else "irrelevant"
+    else:
+        evaluate_system_prompt = """You are given a query and a response. Determine if the response is relevant, irrelevant or highly irrelevant to the query. Only respond with "Relevant", "Irrelevant" or "Highly Irrelevant"."""
+        evaluate_user_prompt = f"""
         Query: {query}
 
         Content: {response}
         """
-    request = QueryRequest(query=query)
-    is_response_relevant = await generate_response(
-        request, response, evaluate_system_prompt, evaluate_user_prompt
-    )
+        classification = await OllamaGenerator().classify(
+            ["Relevant", "Irrelevant", "Highly Irrelevant"],
+            evaluate_system_prompt,
+            evaluate_user_prompt,
+        )
+        # An unmatched answer keeps the response, as before
+        is_response_relevant = classification.label or "Relevant"
+        relevance_gate.record_escalation(
+            kind, is_response_relevant == "Relevant", score
+        )
     print("RELEVANCE OUTCOME")
     print(is_response_relevant)
     if is_response_relevant.lower() == "highly irrelevant":
@@ -2838,79 +3552,32 @@ async def response_relevance_filter_for_chatbot(
     return response
 
 
-async def response_relevance_filter_for_question_generation(
+async def response_relevance_filter_for_chatbot(
     query: str, response: str
 ) -> str:
-    evaluate_system_prompt = """You are given a query and a response. Determine if the response is relevant, irrelevant or highly irrelevant to the query. Only respond with "Relevant", "Irrelevant" or "Highly Irrelevant"."""
-    evaluate_user_prompt = f"""
-        Query: {query}
+    return await response_relevance_filter(query, response, "chatbot")
 
-        Content: {response}
-        """
-    request = QueryRequest(query=query)
-    is_response_relevant = await generate_response(
-        request, response, evaluate_system_prompt, evaluate_user_prompt
+
+async def response_relevance_filter_for_question_generation(
+    query: str, response: str
+) -> str:
+    return await response_relevance_filter(
+        query, response, "question_generation"
     )
-    print("RELEVANCE OUTCOME")
-    print(is_response_relevant)
-    if is_response_relevant.lower() == "highly irrelevant":
-        return "Given that the answer that I am able to retrieve with the information I have seems to be highly irrelevant to the query, I abstain from providing a response. I am sorry for not being helpful."  # Returns an empty coroutine
-    elif is_response_relevant.lower() == "irrelevant":
-        return (
-            "The answer I am able to retrieve with the information I have seems to be irrelevant to the query. Nevertheless, I will provide you with the response in the hope that it will be valuable. Apologies in advance if it turns out to be of no value: "
-            + response
-        )
-    return response
 
 
 async def response_relevance_filter_for_answer_generation(
     query: str, response: str
 ) -> str:
-    evaluate_system_prompt = """You are given a query and a response. Determine if the response is relevant, irrelevant or highly irrelevant to the query. Only respond with "Relevant", "Irrelevant" or "Highly Irrelevant"."""
-    evaluate_user_prompt = f"""
-        Query: {query}
-
-        Content: {response}
-        """
-    request = QueryRequest(query=query)
-    is_response_relevant = await generate_response(
-        request, response, evaluate_system_prompt, evaluate_user_prompt
-    )
-    print("RELEVANCE OUTCOME")
-    print(is_response_relevant)
-    if is_response_relevant.lower() == "highly irrelevant":
-        return "Given that the answer that I am able to retrieve with the information I have seems to be highly irrelevant to the query, I abstain from providing a response. I am sorry for not being helpful."  # Returns an empty coroutine
-    elif is_response_relevant.lower() == "irrelevant":
-        return (
-            "The answer I am able to retrieve with the information I have seems to be irrelevant to the query. Nevertheless, I will provide you with the response in the hope that it will be valuable. Apologies in advance if it turns out to be of no value: "
-            + response
-        )
-    return response
+    return await response_relevance_filter(query, response, "answer_generation")
 
 
 async def response_relevance_filter_for_faculty_evaluation(
     query: str, response: str
 ) -> str:
-    evaluate_system_prompt = """You are given a query and a response. Determine if the response is relevant, irrelevant or highly irrelevant to the query. Only respond with "Relevant", "Irrelevant" or "Highly Irrelevant"."""
-    evaluate_user_prompt = f"""
-        Query: {query}
-
-        Content: {response}
-        """
-    request = QueryRequest(query=query)
-    is_response_relevant = await generate_response(
-        request, response, evaluate_system_prompt, evaluate_user_prompt
+    return await response_relevance_filter(
+        query, response, "faculty_evaluation"
     )
-    print("RELEVANCE OUTCOME")
-    print(is_response_relevant)
-    if is_response_relevant.lower() == "highly irrelevant":
-        return "Given that the answer that I am able to retrieve with the information I have seems to be highly irrelevant to the query, I abstain from providing a response. I am sorry for not being helpful."  # Returns an empty coroutine
-    elif is_response_relevant.lower() == "irrelevant":
-        return (
-            "The answer I am able to retrieve with the information I have seems to be irrelevant to the query. Nevertheless, I will provide you with the response in the hope that it will be valuable. Apologies in advance if it turns out to be of no value: "
-            + response
-        )
-    return response
 
 
 async def response_relevance_filter_for_grading_assistant(
@@ -2926,16 +3593,14 @@ async def response_relevance_filter_for_grading_assistant(
 
     You are given a question, answer and evaluation for that answer. Determine if the evalution is "correct" or "incorrect". Answer only with "CORRECT" or "INCORRECT".
         """
-    request = QueryRequest(query=answer)
-    is_response_relevant = await generate_response(
-        request,
-        evaluation,
+    is_response_relevant = await OllamaGenerator().classify(
+        ["CORRECT", "INCORRECT"],
         evaluate_the_evaluation_for_aga_with_ground_truth_system_prompt,
         evaluate_the_evaluation_for_aga_with_ground_truth_user_prompt,
     )
     print("RELEVANCE OUTCOME")
-    print(is_response_relevant)
-    if is_response_relevant.lower() == "correct":
+    print(is_response_relevant.text)
+    if is_response_relevant.label == "CORRECT":
         return evaluation
     return "Due to lack of expertise, the system can not grade the answer."
 
@@ -2990,148 +3655,221 @@ async def response_relevance_filter_for_grading_assistant(
 #     }
 
 
-# REFACTOR
-@app.post("/api/ollamaAFE")
-async def ollama_afe(request: QueryRequest):
-    dimensions = dimensions_AFE
-    instructor_name = request.query
-    scores_dict = {}
-    all_responses = {}
+AFE_MAX_CONCURRENCY = int(os.getenv("AFE_MAX_CONCURRENCY", "4"))
+AFE_TASK_TIMEOUT = float(os.getenv("AFE_TASK_TIMEOUT", "600"))
 
-    for dimension, dimension_data in dimensions.items():
-        sub_dimensions = dimension_data["sub-dimensions"]
-        total_sub_weight = sum(
-            [sub_data["weight"] for sub_data in sub_dimensions.values()]
-        )
-        weighted_sub_scores = 0
 
-        all_responses[dimension] = {}
+async def evaluate_afe_sub_dimension(
+    request: QueryRequest, instructor_name: str, sub_dim_name: str, sub_dim_data
+) -> tuple[str, str]:
+    """Retrieves transcript context for one AFE sub-dimension and scores it
+    @returns tuple[str, str] - The extracted score (or N/A) and the full response.
+    """
+    query = f"""Judge {instructor_name} based on {sub_dim_name}."""
+    # query = f"""
+    # Evaluate the {sub_dim_name.lower()} of the instructor "{instructor_name}" based on the following criteria:
+    # Definition: {sub_dim_data['definition']}
+    # Example: {sub_dim_data['example']}
+    # Criteria:
+    # {json.dumps(sub_dim_data['criteria'], indent=4)}
+    # Provide a score between 1 and 5 based on the criteria.
+    # """
+    # Extract context
+    context = await make_request(query, request.course_id)
+    print(context)
+    if context is None:
+        raise HTTPException(status_code=500, detail="Failed to fetch context")
 
-        for sub_dim_name, sub_dim_data in sub_dimensions.items():
-            query = f"""Judge {instructor_name} based on {sub_dim_name}."""
-            # query = f"""
-            # Evaluate the {sub_dim_name.lower()} of the instructor "{instructor_name}" based on the following criteria:
-            # Definition: {sub_dim_data['definition']}
-            # Example: {sub_dim_data['example']}
-            # Criteria:
-            # {json.dumps(sub_dim_data['criteria'], indent=4)}
-            # Provide a score between 1 and 5 based on the criteria.
-            # """
-            # Extract context
-            context = await make_request(query)
-            print(context)
-            if context is None:
-                raise HTTPException(
-                    status_code=500, detail="Failed to fetch context"
-                )
+    # filtered_context_afe = await context_relevance_filter(query, context)
+
+    # Example custom prompts
+    afe_system_prompt = f"""
+        ### Instructions
 
-            # filtered_context_afe = await context_relevance_filter(query, context)
+        Evaluate the teacher's performance based on the criterion: **{sub_dim_name}** - {sub_dim_data}.
 
-            # Example custom prompts
-            afe_system_prompt = f"""
-                ### Instructions
+        #### Evaluation Details
 
-                Evaluate the teacher's performance based on the criterion: **{sub_dim_name}** - {sub_dim_data}.
+        - **Focus:** Only use the provided textual transcript.
+        - **Ignore:** Interruptions from student entries/exits and notifications of participants joining or leaving the meeting.
+        - **Scoring:** Assign scores from 1 to 5.
 
-                #### Evaluation Details
+        #### Criteria
 
-                - **Focus:** Only use the provided textual transcript.
-                - **Ignore:** Interruptions from student entries/exits and notifications of participants joining or leaving the meeting.
-                - **Scoring:** Assign scores from 1 to 5.
+        - **Criterion Explanation:** {sub_dim_data}
+        - If the transcript does not provide enough information to assess **{sub_dim_name}**, score as **N/A** and explain why.
+        - Justify any score below 5 with clear reasoning.
+        """
+    # afe_user_prompt = (
+    #     f"""
+    #     Here are given transcript snippets for {instructor_name}-
 
-                #### Criteria
+    #         [TRANSCRIPT START]
+    #         {filtered_context_afe}
+    #         [TRANSCRIPT END]
 
-                - **Criterion Explanation:** {sub_dim_data}
-                - If the transcript does not provide enough information to assess **{sub_dim_name}**, score as **N/A** and explain why.
-                - Justify any score below 5 with clear reasoning.
-                """
-            # afe_user_prompt = (
-            #     f"""
-            #     Here are given transcript snippets for {instructor_name}-
+    #     Please provide an evaluation of the teacher named '{instructor_name}' on the following criteria: '{sub_dim_name}'. Only include information from transcripts where '{instructor_name}' is the instructor. If the instructor's name is not present in the transcript, clearly mention that and do not evaluate.
 
-            #         [TRANSCRIPT START]
-            #         {filtered_context_afe}
-            #         [TRANSCRIPT END]
+    #     #### Output Format
 
-            #     Please provide an evaluation of the teacher named '{instructor_name}' on the following criteria: '{sub_dim_name}'. Only include information from transcripts where '{instructor_name}' is the instructor. If the instructor's name is not present in the transcript, clearly mention that and do not evaluate.
+    #     - **{sub_dim_name}:** score_obtained: score (1-5 or N/A) - Note: No special formatting should be used here.
 
-            #     #### Output Format
+    #     - **Detailed Explanation with Examples:**
+    #     - Example 1: "[Quoted text from transcript]" [Description] [Timestamp]
+    #     - Example 2: "[Quoted text from transcript]" [Description] [Timestamp]
+    #     - Example 3: "[Quoted text from transcript]" [Description] [Timestamp]
+    #     - ...
 
-            #     - **{sub_dim_name}:** score_obtained: score (1-5 or N/A) - Note: No special formatting should be used here.
+    #     - Provide both positive and negative examples.
+    #     - Highlight poor examples if the score is below 5.
+    #     - Consider the context of statements as context is crucial.
 
-            #     - **Detailed Explanation with Examples:**
-            #     - Example 1: "[Quoted text from transcript]" [Description] [Timestamp]
-            #     - Example 2: "[Quoted text from transcript]" [Description] [Timestamp]
-            #     - Example 3: "[Quoted text from transcript]" [Description] [Timestamp]
-            #     - ...
+    #     Rate strictly on a scale of 1 to 5, using whole numbers only. Ensure examples are directly relevant to the evaluation criterion.
+    #     """
+    # )
+    afe_user_prompt = f"""
+        Here are given transcript snippets for {instructor_name}-   
 
-            #     - Provide both positive and negative examples.
-            #     - Highlight poor examples if the score is below 5.
-            #     - Consider the context of statements as context is crucial.
+            [TRANSCRIPT START]
+            {context}
+            [TRANSCRIPT END]
 
-            #     Rate strictly on a scale of 1 to 5, using whole numbers only. Ensure examples are directly relevant to the evaluation criterion.
-            #     """
-            # )
-            afe_user_prompt = f"""
-                Here are given transcript snippets for {instructor_name}-   
+         ### Instructions
 
-                    [TRANSCRIPT START]
-                    {context}
-                    [TRANSCRIPT END]
+        Evaluate the teacher's performance based on the criterion: **{sub_dim_name}** - {sub_dim_data}.
 
-                 ### Instructions
+        #### Evaluation Details
 
-                Evaluate the teacher's performance based on the criterion: **{sub_dim_name}** - {sub_dim_data}.
+        - **Focus:** Only use the provided textual transcript.
+        - **Ignore:** Interruptions from student entries/exits and notifications of participants joining or leaving the meeting.
+        - **Scoring:** Assign scores from 1 to 5.
 
-                #### Evaluation Details
+        #### Criteria
 
-                - **Focus:** Only use the provided textual transcript.
-                - **Ignore:** Interruptions from student entries/exits and notifications of participants joining or leaving the meeting.
-                - **Scoring:** Assign scores from 1 to 5.
+        - **Criterion Explanation:** {sub_dim_data}
+        - If the transcript does not provide enough information to assess **{sub_dim_name}**, score as **N/A** and explain why.
+        - Justify any score below 5 with clear reasoning.
 
-                #### Criteria
+        #### Output format
 
-                - **Criterion Explanation:** {sub_dim_data}
-                - If the transcript does not provide enough information to assess **{sub_dim_name}**, score as **N/A** and explain why.
-                - Justify any score below 5 with clear reasoning.
+        -The score for {sub_dim_name} must be in the format:
+            spanda_{sub_dim_name}: followed by the score.
+        """
+    # Generate the response using the utility function
+    full_text = await generate_response(
+        request,
+        context,
+        afe_system_prompt,
+        afe_user_prompt,
+        options=GRADING_OPTIONS,
+    )
 
-                #### Output format
+    # relevance_filtered_response_for_faculty_evaluation = await response_relevance_filter_for_faculty_evaluation(request.query, full_text)
 
-                -The score for {sub_dim_name} must be in the format:
-                    spanda_{sub_dim_name}: followed by the score.
-                """
-            # Generate the response using the utility function
-            full_text = await generate_response(
-                request, context, afe_system_prompt, afe_user_prompt
-            )
+    response = full_text
+
+    pattern = rf"(score:\s*([\s\S]*?)(\d+)|\**{sub_dim_name}\**\s*:\s*(\d+))"
+    match = re.search(pattern, response, re.IGNORECASE)
+    if match:
+        # Check which group matched and extract the score
+        if match.group(3):  # This means 'Score:' pattern matched
+            # group(3) contains the number after 'Score:'
+            score_value = match.group(3).strip()
+        elif match.group(4):  # This means direct number pattern matched
+            # group(4) contains the number directly after score criterion
+            score_value = match.group(4).strip()
+        else:
+            # Fallback in case groups are not as expected
+            score_value = "N/A"
+    else:
+        score_value = "N/A"
 
-            # relevance_filtered_response_for_faculty_evaluation = await response_relevance_filter_for_faculty_evaluation(request.query, full_text)
+    return score_value, response
 
-            response = full_text
 
-            pattern = (
-                rf"(score:\s*([\s\S]*?)(\d+)|\**{sub_dim_name}\**\s*:\s*(\d+))"
+async def run_afe_sub_dimension(
+    semaphore: asyncio.Semaphore,
+    request: QueryRequest,
+    instructor_name: str,
+    sub_dim_name: str,
+    sub_dim_data,
+) -> dict:
+    """Runs one sub-dimension evaluation under the semaphore and records its outcome and
+    timing instead of raising."""
+    queued_at = time.time()
+    async with semaphore:
+        started_at = time.time()
+        result = {
+            "status": "ok",
+            "score": "N/A",
+            "response": "",
+            "queued": round(started_at - queued_at, 2),
+        }
+        try:
+            result["score"], result["response"] = await asyncio.wait_for(
+                evaluate_afe_sub_dimension(
+                    request, instructor_name, sub_dim_name, sub_dim_data
+                ),
+                timeout=AFE_TASK_TIMEOUT,
             )
-            match = re.search(pattern, response, re.IGNORECASE)
-            if match:
-                # Check which group matched and extract the score
-                if match.group(3):  # This means 'Score:' pattern matched
-                    score_value = match.group(
-                        3
-                    ).strip()  # group(3) contains the number after 'Score:'
-                elif match.group(
-                    4
-                ):  # This means direct number pattern matched
-                    score_value = match.group(
-                        4
-                    ).strip()  # group(4) contains the number directly after score criterion
-                else:
-                    score_value = (
-                        "N/A"  # Fallback in case groups are not as expected
-                    )
-                scores_dict[sub_dim_name] = score_value
-            else:
-                scores_dict[sub_dim_name] = "N/A"
+        except asyncio.TimeoutError:
+            result["status"] = "timeout"
+            result["response"] = (
+                f"Evaluation timed out after {AFE_TASK_TIMEOUT} seconds"
+            )
+        except Exception as e:
+            result["status"] = "error"
+            result["response"] = f"Evaluation failed: {str(e)}"
+        result["elapsed"] = round(time.time() - started_at, 2)
+        msg.info(
+            f"AFE {sub_dim_name}: {result['status']} in {result['elapsed']}s"
+        )
+        return result
+
+
+# REFACTOR
+@app.post("/api/ollamaAFE")
+async def ollama_afe(request: QueryRequest):
+    dimensions = dimensions_AFE
+    instructor_name = request.query
+    scores_dict = {}
+    all_responses = {}
+    timings = {}
+    failed = []
+
+    # Evaluate all sub-dimensions concurrently, bounded by AFE_MAX_CONCURRENCY
+    semaphore = asyncio.Semaphore(AFE_MAX_CONCURRENCY)
+    tasks = {
+        (dimension, sub_dim_name): run_afe_sub_dimension(
+            semaphore, request, instructor_name, sub_dim_name, sub_dim_data
+        )
+        for dimension, dimension_data in dimensions.items()
+        for sub_dim_name, sub_dim_data in dimension_data[
+            "sub-dimensions"
+        ].items()
+    }
+    results = dict(zip(tasks.keys(), await asyncio.gather(*tasks.values())))
+
+    for dimension, dimension_data in dimensions.items():
+        sub_dimensions = dimension_data["sub-dimensions"]
+        total_sub_weight = sum(
+            [sub_data["weight"] for sub_data in sub_dimensions.values()]
+        )
+        weighted_sub_scores = 0
+
+        all_responses[dimension] = {}
+
+        for sub_dim_name, sub_dim_data in sub_dimensions.items():
+            result = results[(dimension, sub_dim_name)]
+            response = result["response"]
+            scores_dict[sub_dim_name] = result["score"]
+            timings[sub_dim_name] = {
+                "status": result["status"],
+                "elapsed": result["elapsed"],
+                "queued": result["queued"],
+            }
+            if result["status"] != "ok":
+                failed.append(sub_dim_name)
 
             # Store the response and score
             all_responses[dimension][
@@ -3148,7 +3886,12 @@ async def ollama_afe(request: QueryRequest):
         ) * dimension_data["weight"]
         scores_dict[dimension] = dimension_score
 
-    return {"dimension_scores": scores_dict, "DOCUMENT": all_responses}
+    return {
+        "dimension_scores": scores_dict,
+        "DOCUMENT": all_responses,
+        "timings": timings,
+        "failed": failed,
+    }
 
 
 # # Modified import endpoint to handle transcript uploads
@@ -3200,7 +3943,7 @@ async def upload_transcript(payload: ImportPayload):
         try:
             set_config(manager, payload.config)
             documents, logging = manager.import_data(
-                payload.data, payload.textValues, logging
+                payload.data, payload.textValues, logging, payload.course_id
             )
 
             return JSONResponse(
@@ -3224,6 +3967,9 @@ async def upload_transcript(payload: ImportPayload):
         )
 
 
+TRANSCRIPT_MAX_CONCURRENCY = int(os.getenv("TRANSCRIPT_MAX_CONCURRENCY", "4"))
+
+
 @app.post("/api/evaluate_Transcipt")
 async def evaluate_Transcipt(request: QueryRequest):
     # dimensions = {
@@ -3295,25 +4041,43 @@ async def evaluate_Transcipt(request: QueryRequest):
     #     all_responses[dimension] = result_responses.get('content', "No response available")
     #     all_scores[dimension] = result_scores.get(dimension, "No score available")
 
+    timings = {}
+    semaphore = asyncio.Semaphore(TRANSCRIPT_MAX_CONCURRENCY)
+
+    async def evaluate_sub_trait(dimension, sub_trait, explanation_of_subtrait):
+        async with semaphore:
+            started_at = time.time()
+            metrics = {}
+            # retrieving feedback and computing score for the sub-dimension
+            result = await instructor_eval(
+                transcript, "", sub_trait, explanation_of_subtrait, metrics
+            )
+            metrics["elapsed"] = round(time.time() - started_at, 2)
+            timings.setdefault(dimension, {})[sub_trait] = metrics
+            return result
+
+    # Keyed by (dimension, sub_trait), sub-trait names may repeat across dimensions
+    sub_traits = [
+        (dimension, sub_trait, explanation_of_subtrait)
+        for dimension, sub_traits_and_explanations in dimensions.items()
+        for sub_trait, explanation_of_subtrait in sub_traits_and_explanations.items()
+    ]
+    # The first evaluation fills the backend's prompt cache with the transcript
+    # prefix, the remaining criteria then run concurrently on top of it
+    results = [await evaluate_sub_trait(*sub_traits[0])]
+    results += await asyncio.gather(
+        *[evaluate_sub_trait(*sub_trait) for sub_trait in sub_traits[1:]]
+    )
+    results = dict(
+        zip([(dimension, sub_trait) for dimension, sub_trait, _ in sub_traits], results)
+    )
+
     # iterates through master-trait and gets sub-trait dict.
     for dimension, sub_traits_and_explanations in dimensions.items():
-        # Iterating through each sub-trait and retrieving context
         count_of_subtrait = 0
         sum_of_all_sub_trait_scores = 0
-        for (
-            sub_trait,
-            explanation_of_subtrait,
-        ) in sub_traits_and_explanations.items():
-            query = (
-                f"Evaluate the transcript - {transcript} based on {sub_trait}."
-            )
-            # retrieving context
-            context = ""
-            # context = await make_request(query)  # Assuming make_request is defined elsewhere
-            # retrieving feedback and computing score for the sub-dimension
-            result_response, result_score = await instructor_eval(
-                query, context, sub_trait, explanation_of_subtrait
-            )
+        for sub_trait in sub_traits_and_explanations:
+            result_response, result_score = results[(dimension, sub_trait)]
             sum_of_all_sub_trait_scores += int(result_score)
             count_of_subtrait += 1
 
@@ -3335,7 +4099,11 @@ async def evaluate_Transcipt(request: QueryRequest):
     # print("Final Responses:", all_responses)
     # print("Final Scores:", all_scores)
 
-    response = {"DOCUMENT": all_responses, "SCORES": master_scores_dict}
+    response = {
+        "DOCUMENT": all_responses,
+        "SCORES": master_scores_dict,
+        "TIMINGS": timings,
+    }
 
     return response
 
@@ -3418,6 +4186,7 @@ async def resume_eval(
         context,
         resume_system_prompt,
         resume_user_prompt,
+        options=GRADING_OPTIONS,
     )
 
     responses[score_criterion] = full_text
@@ -3447,94 +4216,307 @@ def extract_score(response_content):
     return None
 
 
-@app.post("/api/evaluate_Resume")
-async def evaluate_Resume(request: QueryRequestResume):
-    print("RESUME")
-    print(request.resume)
-    print("JD")
-    print(request.jd)
-
-    dimensions = {
-        "Qualification Match": "The extent to which the candidate's educational background, certifications, and experience align with the specific requirements outlined in the job description.\n"
-        "0: Qualifications are largely unrelated to the position.\n"
-        "Example: The job requires a Master's degree in Computer Science, but the candidate has a Bachelor's in History.\n"
-        "1: Some relevant qualifications but significant gaps exist.\n"
-        "Example: The candidate has a Bachelor's in Computer Science but lacks the required 3 years of industry experience.\n"
-        "2: Mostly meets the qualifications with minor gaps.\n"
-        "Example: The candidate meets most qualifications but lacks experience with a specific programming language mentioned in the job description.\n"
-        "3: Exceeds qualifications, demonstrating additional relevant skills or experience.\n"
-        "Example: The candidate exceeds the required experience and has additional certifications in relevant areas.",
-        "Experience Relevance": "The degree to which the candidate's prior teaching, research, or industry experience is relevant to the courses they would be teaching.\n"
-        "0: Little to no relevant experience in the subject matter.\n"
-        "Example: The candidate has no prior experience teaching or working with the programming languages listed in the course syllabus.\n"
-        "1: Some relevant experience but mostly in unrelated areas.\n"
-        "Example: The candidate has experience in web development but the course focuses on mobile app development.\n"
-        "2: Solid experience in related fields but limited direct experience in the specific subject.\n"
-        "Example: The candidate has taught general computer science courses but not the specific advanced algorithms course they are applying for.\n"
-        "3: Extensive experience directly teaching or working in the subject area.\n"
-        "Example: The candidate has 5+ years of experience teaching the specific course they are applying for and has published research in the field.",
-        "Skillset Alignment": "How well the candidate's demonstrated skills (e.g., technical skills, communication, leadership) match the required competencies for the role.\n"
-        "0: Skills are largely misaligned with the job requirements.\n"
-        "Example: The job requires strong communication and presentation skills, but the candidate has no experience presenting or leading workshops.\n"
-        "1: Possesses some required skills but lacks others.\n"
-        "Example: The candidate has strong technical skills but lacks experience with collaborative project management tools.\n"
-        "2: Demonstrates most of the required skills with some room for improvement.\n"
-        "Example: The candidate has good communication skills but could benefit from additional training in public speaking.\n"
-        "3: Possesses all required skills and demonstrates advanced abilities in some areas.\n"
-        "Example: The candidate has excellent technical skills, is a highly effective communicator, and has a proven track record of mentoring junior developers.",
-        "Potential Impact": "An assessment of the candidate's potential to contribute positively to the department and the institution as a whole, based on their resume and cover letter.\n"
-        "0: Unclear or negative potential impact based on application materials.\n"
-        "Example: The candidate's application materials are vague and do not highlight any specific contributions they could make.\n"
-        "1: Potential for minimal impact or contribution.\n"
-        "Example: The candidate's resume shows basic qualifications but no indication of going above and beyond.\n"
-        "2: Demonstrates potential for moderate positive impact.\n"
-        "Example: The candidate has experience with relevant projects and expresses enthusiasm for contributing to the department's research initiatives.\n"
-        "3: Shows strong potential to significantly impact the department and institution through teaching, research, or other activities.\n"
-        "Example: The candidate has a strong publication record, outstanding references, and a clear vision for how they would enhance the curriculum.",
-        "Overall Fit": "A holistic assessment of how well the candidate aligns with the department's culture, values, and long-term goals.\n"
-        "0: Poor overall fit with the department.\n"
-        "Example: The candidate's values and goals conflict with the department's focus on collaborative learning.\n"
-        "1: Some alignment but significant differences in values or goals.\n"
-        "Example: The candidate is passionate about research but the department prioritizes teaching excellence.\n"
-        "2: Good fit with some areas of potential misalignment.\n"
-        "Example: The candidate aligns well with most of the department's values but has a different teaching style than is typical for the institution.\n"
-        "3: Excellent fit with the department's culture, values, and goals.\n"
-        "Example: The candidate's teaching philosophy, research interests, and collaborative spirit perfectly complement the department's existing strengths and future aspirations.",
-    }
-
-    all_responses = {}
-    all_scores = {}
-
-    for dimension, explanation in dimensions.items():
-        afe_resume_analysis_user_prompt = f"""
+RESUME_DIMENSIONS = {
+    "Qualification Match": "The extent to which the candidate's educational background, certifications, and experience align with the specific requirements outlined in the job description.\n"
+    "0: Qualifications are largely unrelated to the position.\n"
+    "Example: The job requires a Master's degree in Computer Science, but the candidate has a Bachelor's in History.\n"
+    "1: Some relevant qualifications but significant gaps exist.\n"
+    "Example: The candidate has a Bachelor's in Computer Science but lacks the required 3 years of industry experience.\n"
+    "2: Mostly meets the qualifications with minor gaps.\n"
+    "Example: The candidate meets most qualifications but lacks experience with a specific programming language mentioned in the job description.\n"
+    "3: Exceeds qualifications, demonstrating additional relevant skills or experience.\n"
+    "Example: The candidate exceeds the required experience and has additional certifications in relevant areas.",
+    "Experience Relevance": "The degree to which the candidate's prior teaching, research, or industry experience is relevant to the courses they would be teaching.\n"
+    "0: Little to no relevant experience in the subject matter.\n"
+    "Example: The candidate has no prior experience teaching or working with the programming languages listed in the course syllabus.\n"
+    "1: Some relevant experience but mostly in unrelated areas.\n"
+    "Example: The candidate has experience in web development but the course focuses on mobile app development.\n"
+    "2: Solid experience in related fields but limited direct experience in the specific subject.\n"
+    "Example: The candidate has taught general computer science courses but not the specific advanced algorithms course they are applying for.\n"
+    "3: Extensive experience directly teaching or working in the subject area.\n"
+    "Example: The candidate has 5+ years of experience teaching the specific course they are applying for and has published research in the field.",
+    "Skillset Alignment": "How well the candidate's demonstrated skills (e.g., technical skills, communication, leadership) match the required competencies for the role.\n"
+    "0: Skills are largely misaligned with the job requirements.\n"
+    "Example: The job requires strong communication and presentation skills, but the candidate has no experience presenting or leading workshops.\n"
+    "1: Possesses some required skills but lacks others.\n"
+    "Example: The candidate has strong technical skills but lacks experience with collaborative project management tools.\n"
+    "2: Demonstrates most of the required skills with some room for improvement.\n"
+    "Example: The candidate has good communication skills but could benefit from additional training in public speaking.\n"
+    "3: Possesses all required skills and demonstrates advanced abilities in some areas.\n"
+    "Example: The candidate has excellent technical skills, is a highly effective communicator, and has a proven track record of mentoring junior developers.",
+    "Potential Impact": "An assessment of the candidate's potential to contribute positively to the department and the institution as a whole, based on their resume and cover letter.\n"
+    "0: Unclear or negative potential impact based on application materials.\n"
+    "Example: The candidate's application materials are vague and do not highlight any specific contributions they could make.\n"
+    "1: Potential for minimal impact or contribution.\n"
+    "Example: The candidate's resume shows basic qualifications but no indication of going above and beyond.\n"
+    "2: Demonstrates potential for moderate positive impact.\n"
+    "Example: The candidate has experience with relevant projects and expresses enthusiasm for contributing to the department's research initiatives.\n"
+    "3: Shows strong potential to significantly impact the department and institution through teaching, research, or other activities.\n"
+    "Example: The candidate has a strong publication record, outstanding references, and a clear vision for how they would enhance the curriculum.",
+    "Overall Fit": "A holistic assessment of how well the candidate aligns with the department's culture, values, and long-term goals.\n"
+    "0: Poor overall fit with the department.\n"
+    "Example: The candidate's values and goals conflict with the department's focus on collaborative learning.\n"
+    "1: Some alignment but significant differences in values or goals.\n"
+    "Example: The candidate is passionate about research but the department prioritizes teaching excellence.\n"
+    "2: Good fit with some areas of potential misalignment.\n"
+    "Example: The candidate aligns well with most of the department's values but has a different teaching style than is typical for the institution.\n"
+    "3: Excellent fit with the department's culture, values, and goals.\n"
+    "Example: The candidate's teaching philosophy, research interests, and collaborative spirit perfectly complement the department's existing strengths and future aspirations.",
+}
+
+RESUME_SYSTEM_MESSAGE = """As an expert in resume and job description analysis, your task is to conduct a thorough evaluation of the provided resume against the job description. The goal is to determine the alignment between the candidate's qualifications, experience, and skills with the requirements and expectations outlined in the job description."""
+
+
+async def evaluate_resume_dimension(jd, resume, dimension, explanation):
+    afe_resume_analysis_user_prompt = f"""
         Please use the following Job Description as a basis:
 
-        {request.jd} 
+        {jd} 
          
         
         Compare the above Job Description with the below resume:
 
-        {request.resume}
+        {resume}
         
 
         Examples for the dimension - {explanation}
         Compare the given Job Description and resume based on {dimension}. 
          """
 
-        afe_resume_analysis_system_message = """As an expert in resume and job description analysis, your task is to conduct a thorough evaluation of the provided resume against the job description. The goal is to determine the alignment between the candidate's qualifications, experience, and skills with the requirements and expectations outlined in the job description."""
+    # context = await make_request(query)  # Assuming make_request is defined elsewhere to get the context
+
+    return await resume_eval(
+        RESUME_SYSTEM_MESSAGE,
+        afe_resume_analysis_user_prompt,
+        dimension,
+    )
+
+
+async def evaluate_resume_structured(jd, resume):
+    """Scores all resume dimensions in a single generation constrained to a JSON schema
+    @returns tuple[dict, dict, list] - Responses and scores in the per-dimension layout,
+        and the dimensions that failed validation.
+    """
+    schema = {
+        "type": "object",
+        "properties": {
+            dimension: ResumeDimensionScore.model_json_schema()
+            for dimension in RESUME_DIMENSIONS
+        },
+        "required": list(RESUME_DIMENSIONS),
+    }
+    rubric = "\n\n".join(
+        f"{dimension}: {explanation}"
+        for dimension, explanation in RESUME_DIMENSIONS.items()
+    )
+    user_prompt = f"""
+        Please use the following Job Description as a basis:
+
+        {jd}
+
+        Compare the above Job Description with the below resume:
+
+        {resume}
+
+        Evaluate the resume on each of the following dimensions, scored from 0 to 3:
+
+        {rubric}
+
+        Answer with a JSON object that has one entry per dimension, each with an
+        integer "score" from 0 to 3 (null if the documents do not allow a judgement)
+        and an "explanation" quoting the resume and job description.
+        """
+    full_text = await generate_response(
+        QueryRequest(query="Judge the Resume based on the Job Description."),
+        "",
+        RESUME_SYSTEM_MESSAGE,
+        user_prompt,
+        format=schema,
+        options=GRADING_OPTIONS or {"temperature": 0},
+    )
+
+    try:
+        result = json.loads(full_text)
+    except json.JSONDecodeError:
+        result = {}
+    if not isinstance(result, dict):
+        result = {}
 
-        # context = await make_request(query)  # Assuming make_request is defined elsewhere to get the context
+    responses = {}
+    scores = {}
+    failed = []
+    for dimension in RESUME_DIMENSIONS:
+        try:
+            dimension_score = ResumeDimensionScore.model_validate(
+                result.get(dimension)
+            )
+        except ValidationError:
+            failed.append(dimension)
+            continue
+        score = (
+            "N/A" if dimension_score.score is None else str(dimension_score.score)
+        )
+        responses[dimension] = {
+            dimension: f"{dimension}: Score: {score}\n\n{dimension_score.explanation}"
+        }
+        scores[dimension] = {dimension: score}
+
+    return responses, scores, failed
+
+
+async def evaluate_resume(jd: str, resume: str, mode: str = "per_dimension") -> dict:
+    """Scores a resume against a job description on all rubric dimensions
+    @parameter: jd : str - Job description
+    @parameter: resume : str - Resume text
+    @parameter: mode : str - per_dimension or structured
+    @returns dict - DOCUMENT and SCORES per dimension, plus FALLBACK in structured mode.
+    """
+    all_responses = {}
+    all_scores = {}
+    fallback = list(RESUME_DIMENSIONS)
 
-        result_responses, result_scores = await resume_eval(
-            afe_resume_analysis_system_message,
-            afe_resume_analysis_user_prompt,
-            dimension,
+    if mode == "structured":
+        all_responses, all_scores, fallback = await evaluate_resume_structured(
+            jd, resume
+        )
+        if fallback:
+            msg.warn(f"Structured resume scoring failed for {fallback}")
+
+    # Per-dimension generations, in structured mode only for dimensions that failed
+    # validation
+    for dimension in fallback:
+        result_responses, result_scores = await evaluate_resume_dimension(
+            jd, resume, dimension, RESUME_DIMENSIONS[dimension]
         )
 
         # Assuming result_responses is a string or dict containing the relevant message
         all_responses[dimension] = result_responses
         all_scores[dimension] = result_scores
 
-    response = {"DOCUMENT": all_responses, "SCORES": all_scores}
+    # Keep the dimension order of the rubric
+    response = {
+        "DOCUMENT": {
+            dimension: all_responses[dimension] for dimension in RESUME_DIMENSIONS
+        },
+        "SCORES": {
+            dimension: all_scores[dimension] for dimension in RESUME_DIMENSIONS
+        },
+    }
+    if mode == "structured":
+        response["FALLBACK"] = fallback
 
     return response
+
+
+@app.post("/api/evaluate_Resume")
+async def evaluate_Resume(request: QueryRequestResume):
+    print("RESUME")
+    print(request.resume)
+    print("JD")
+    print(request.jd)
+
+    return await evaluate_resume(request.jd, request.resume, request.mode)
+
+
+RESUME_BULK_MAX_CONCURRENCY = int(os.getenv("RESUME_BULK_MAX_CONCURRENCY", "4"))
+
+
+async def rank_resumes(jd: str, resumes: list[str]) -> list[tuple[int, float]]:
+    """Ranks resumes by embedding similarity to the job description with the active
+    embedder
+    @parameter: jd : str - Job description
+    @parameter: resumes : list[str] - Resume texts
+    @returns list[tuple[int, float]] - (resume index, similarity) best match first,
+        similarity is None when the embedder does not vectorize locally.
+    """
+    embedder = get_active_embedder()
+    if not embedder.get_need_vectorization():
+        # Weaviate's built-in vectorizers leave no local vectors to compare, keep the
+        # input order
+        msg.warn(
+            f"{embedder.name} does not vectorize locally, resumes are not pre-ranked"
+        )
+        return [(index, None) for index in range(len(resumes))]
+
+    vectors = await asyncio.to_thread(embedder.vectorize_texts, [jd] + resumes)
+    jd_vector = vectors[0]
+    similarities = [
+        (index, cosine_similarity(jd_vector, vector))
+        for index, vector in enumerate(vectors[1:])
+    ]
+    return sorted(similarities, key=lambda item: item[1], reverse=True)
+
+
+@app.post("/api/evaluate_Resume_bulk")
+async def evaluate_Resume_bulk(request: QueryRequestResumeBulk):
+    """Screens many resumes against one job description.
+    All resumes are embedded and ranked by similarity to the JD, only the top_k get the
+    full rubric evaluation. Streams newline-delimited JSON: one "ranking" line, one
+    "result" (or "error") line per shortlisted resume as it finishes, and a final "done"
+    line.
+    """
+    resumes = [candidate.resume for candidate in request.resumes]
+    ranking = await rank_resumes(request.jd, resumes)
+    shortlist = ranking[: request.top_k]
+    msg.info(
+        f"Bulk resume screening: {len(resumes)} resumes, "
+        f"evaluating top {len(shortlist)}"
+    )
+
+    def candidate_info(rank: int, index: int, similarity: float) -> dict:
+        return {
+            "rank": rank,
+            "index": index,
+            "name": request.resumes[index].name,
+            "similarity": similarity,
+        }
+
+    semaphore = asyncio.Semaphore(RESUME_BULK_MAX_CONCURRENCY)
+
+    async def evaluate_candidate(rank: int, index: int, similarity: float) -> dict:
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                result = await evaluate_resume(
+                    request.jd, resumes[index], request.mode
+                )
+            except Exception as e:
+                msg.fail(f"Resume {index} failed: {str(e)}")
+                return {
+                    "type": "error",
+                    **candidate_info(rank, index, similarity),
+                    "error": str(e),
+                }
+            return {
+                "type": "result",
+                **candidate_info(rank, index, similarity),
+                **result,
+                "elapsed": round(time.perf_counter() - start, 2),
+            }
+
+    async def stream_results():
+        yield json.dumps(
+            {
+                "type": "ranking",
+                "ranking": [
+                    candidate_info(rank, index, similarity)
+                    for rank, (index, similarity) in enumerate(ranking, start=1)
+                ],
+            }
+        ) + "\n"
+
+        tasks = [
+            asyncio.create_task(evaluate_candidate(rank, index, similarity))
+            for rank, (index, similarity) in enumerate(shortlist, start=1)
+        ]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield json.dumps(await task) + "\n"
+        finally:
+            # Client went away, stop the remaining evaluations
+            for task in tasks:
+                task.cancel()
+
+        yield json.dumps({"type": "done", "evaluated": len(shortlist)}) + "\n"
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
@@ -0,0 +1,173 @@
+import asyncio
+import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# The extractors import their libraries lazily, so pool workers only load what the files
+# they get need
+
+
+# Function to extract text from a PDF file
+def extract_text_from_pdf(file_content):
+    import fitz  # PyMuPDF
+
+    try:
+        doc = fitz.open(stream=file_content, filetype="pdf")
+        text = ""
+        for page in doc:
+            text += page.get_text()
+        return text
+    except Exception as e:
+        return f"Error extracting text from PDF: {str(e)}"
+
+
+# Function to extract text from a DOCX file
+def extract_text_from_docx(file_content):
+    from docx import Document
+
+    with io.BytesIO(file_content) as f:
+        doc = Document(f)
+        return "\n".join([para.text for para in doc.paragraphs])
+
+
+# Function to extract text from a TXT file
+def extract_text_from_txt(file_content):
+    return file_content.decode("utf-8")
+
+
+# Function to extract text from an image file
+def extract_text_from_image(file_content):
+    import pytesseract
+    from PIL import Image
+
+    image = Image.open(io.BytesIO(file_content))
+    return pytesseract.image_to_string(image)
+
+
+# Function to extract text from file content based on the file name
+def extract_text(file_name, file_content):
+    file_name = file_name.lower()
+    try:
+        if file_name.endswith(".pdf"):
+            return extract_text_from_pdf(file_content)
+        elif file_name.endswith(".docx"):
+            return extract_text_from_docx(file_content)
+        elif file_name.endswith(".txt"):
+            return extract_text_from_txt(file_content)
+        elif file_name.endswith((".png", ".jpg", ".jpeg")):
+            return extract_text_from_image(file_content)
+        else:
+            return "Unsupported file format."
+    except MemoryError:
+        return "Error extracting text: file exceeds the extraction memory limit"
+    except Exception as e:
+        return f"Error extracting text: {str(e)}"
+
+
+def init_worker(memory_limit: int) -> None:
+    """Caps the address space of a pool worker (and the tesseract processes it starts)
+    and keeps OCR single-threaded."""
+    # Parallelism comes from the pool, one core per file
+    os.environ["OMP_THREAD_LIMIT"] = "1"
+    if memory_limit > 0:
+        try:
+            import resource
+
+            resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+        except (ImportError, ValueError, OSError):
+            pass
+
+
+class ExtractionPool:
+    """
+    Runs submission text extraction (PyMuPDF, python-docx, tesseract OCR) in a pool of
+    worker processes, off the event loop and across all cores. Every file has a timeout
+    and every worker a memory cap. A file that times out takes the pool down with it:
+    the workers are killed and a new pool is started, the other files that were running
+    on it are retried once.
+    """
+
+    def __init__(
+        self, max_workers: int = None, timeout: float = 120.0, memory_limit: int = 0
+    ):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.memory_limit = memory_limit
+        self._pool = None
+        self._semaphore = None
+        self.stats = {"files": 0, "timeouts": 0, "restarts": 0}
+
+    def get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: forking the server process would copy its threads and model memory
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_worker,
+                initargs=(self.memory_limit,),
+            )
+        return self._pool
+
+    def restart(self, pool: ProcessPoolExecutor) -> None:
+        """Kills the workers of a pool that is stuck or broken, the next call starts a
+        new one."""
+        if self._pool is not pool:
+            return
+        self._pool = None
+        self.stats["restarts"] += 1
+        # ProcessPoolExecutor cannot cancel a running call, so its workers are killed
+        for process in list((pool._processes or {}).values()):
+            process.kill()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    async def extract(self, file_name: str, file_content: bytes) -> str:
+        """Extracts the text of a file in a worker process
+        @parameter: file_name : str - File name, its extension selects the extractor
+        @parameter: file_content : bytes - File content
+        @returns str - Extracted text, or an error message as returned by the
+            extractors.
+        """
+        self.stats["files"] += 1
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_workers)
+        loop = asyncio.get_running_loop()
+        # One file per worker at a time, so the timeout does not count time spent queued
+        async with self._semaphore:
+            for attempt in range(2):
+                pool = self.get_pool()
+                try:
+                    return await asyncio.wait_for(
+                        loop.run_in_executor(
+                            pool, extract_text, file_name, file_content
+                        ),
+                        self.timeout,
+                    )
+                except asyncio.TimeoutError:
+                    self.stats["timeouts"] += 1
+                    self.restart(pool)
+                    return f"Error extracting text: timed out after {self.timeout:g}s"
+                except BrokenProcessPool:
+                    # A worker died (e.g. killed by a restart or the OOM killer)
+                    self.restart(pool)
+                    if attempt == 1:
+                        return "Error extracting text: extraction worker crashed"
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        self._semaphore = None
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "max_workers": self.max_workers}
+
+
+extraction_pool = ExtractionPool(
+    max_workers=int(os.environ.get("EXTRACTION_WORKERS", "0")) or None,
+    timeout=float(os.environ.get("EXTRACTION_TIMEOUT", "120")),
+    memory_limit=int(os.environ.get("EXTRACTION_MEMORY_LIMIT_MB", "2048"))
+    * 1024
+    * 1024,
+)
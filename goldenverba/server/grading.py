@@ -0,0 +1,111 @@
+import asyncio
+from collections import deque
+
+
+def build_submission_row(user, results):
+    """Assembles a student's CSV row from the results of their Q&A pairs
+    @parameter: user : dict - Moodle user
+    @parameter: results : list - (score, comment) per Q&A pair in submission order,
+        None for failed pairs; None instead of a list if the user did not submit.
+        Pairs whose score is None are left out like failed ones
+    @returns dict - Row with Full Name, User ID, Email, Total Score and Feedback.
+    """
+    row = {
+        "Full Name": user["fullname"],
+        "User ID": user["id"],
+        "Email": user["email"],
+    }
+    if results is None:
+        return {**row, "Total Score": 0, "Feedback": "No submission"}
+
+    # A pair without a score (no spanda_final_score in the response) counts as failed
+    results = [
+        result for result in results if result is not None and result[0] is not None
+    ]
+    return {
+        **row,
+        "Total Score": sum(score for score, _ in results),
+        "Feedback": " | ".join(comment for _, comment in results),
+    }
+
+
+async def grade_submissions(
+    users, extracted, grade_pair, max_concurrency=4, on_row=None
+):
+    """Grades the Q&A pairs of all students through one work queue
+    Pairs are queued round-robin across students (every student's first pair, then
+    every second pair, ...), so that no student waits for the whole submission of
+    another, and max_concurrency workers take them from the queue.
+    @parameter: users : list[dict] - Moodle users to grade
+    @parameter: extracted : dict - Per user id, the (qa_pair, question, answer) tuples
+        of each submitted file (None for a file that could not be extracted),
+        None if the user did not submit
+    @parameter: grade_pair : Callable - Coroutine function called with
+        (user, i, qa_pair, question, answer), returns (score, comment) or None
+        if the pair could not be graded
+    @parameter: max_concurrency : int - Number of pairs graded at once
+    @parameter: on_row : Callable[[dict, dict, bool], None] - Called with
+        (user, row, complete) as soon as a student is graded, complete being False
+        if any of their files or Q&A pairs failed
+    @returns dict - Row by user id.
+    """
+    pairs = {
+        user["id"]: [
+            (i, *qa_pair)
+            for qa_pairs in extracted[user["id"]]
+            if qa_pairs is not None
+            for i, qa_pair in enumerate(qa_pairs)
+        ]
+        for user in users
+        if extracted[user["id"]] is not None
+    }
+    results = {user_id: [None] * len(tasks) for user_id, tasks in pairs.items()}
+    remaining = {user_id: len(tasks) for user_id, tasks in pairs.items()}
+    users_by_id = {user["id"]: user for user in users}
+    rows = {}
+
+    def finish(user):
+        user_results = results.get(user["id"])
+        rows[user["id"]] = build_submission_row(user, user_results)
+        if on_row is not None:
+            complete = user_results is None or (
+                None not in extracted[user["id"]]
+                and all(
+                    result is not None and result[0] is not None
+                    for result in user_results
+                )
+            )
+            on_row(user, rows[user["id"]], complete)
+
+    queue = deque()
+    for index in range(max(map(len, pairs.values()), default=0)):
+        for user_id, tasks in pairs.items():
+            if index < len(tasks):
+                queue.append((user_id, index))
+
+    # Nothing to grade: no submission or no Q&A pairs
+    for user in users:
+        if not remaining.get(user["id"]):
+            finish(user)
+
+    async def worker():
+        while queue:
+            user_id, index = queue.popleft()
+            user = users_by_id[user_id]
+            results[user_id][index] = await grade_pair(user, *pairs[user_id][index])
+            remaining[user_id] -= 1
+            if remaining[user_id] == 0:
+                finish(user)
+
+    workers = [
+        asyncio.ensure_future(worker())
+        for _ in range(min(max_concurrency, len(queue)))
+    ]
+    try:
+        await asyncio.gather(*workers)
+    except BaseException:
+        # One failing worker stops the run, the others must not keep grading unowned
+        for task in workers:
+            task.cancel()
+        raise
+    return rows
@@ -0,0 +1,230 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+
+def get_ground_truth_hash(
+    rubric: str, ground_truth: str, questions: list[str], ground_truths: dict
+) -> str:
+    """Identifies what a student was graded against
+    @parameter: rubric : str - Rubric of the run
+    @parameter: ground_truth : str - Ground truth given with the request, if any
+    @parameter: questions : list[str] - Questions of the student's submission
+    @parameter: ground_truths : dict - Ground truths built by question,
+        only used when no ground truth was given
+    @returns str - sha256 of the rubric and the ground truth of every question.
+    """
+    used = ground_truth or {
+        question: ground_truths.get(question) for question in questions
+    }
+    return hashlib.sha256(
+        json.dumps([rubric, used], sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+class GradingJobStore:
+    """
+    Persists Moodle grading jobs and their per-student results in sqlite, so that a
+    grading run survives timeouts and restarts. Results belong to their job: resuming a
+    job only grades the students that are missing, whose submission changed since, or
+    whose ground truth hash no longer matches. A new job always grades everyone.
+    The ground truths a job builds are stored with it and reused when it is resumed.
+    """
+
+    COLUMNS = [
+        "job_id",
+        "request",
+        "status",
+        "total",
+        "graded",
+        "skipped",
+        "incomplete",
+        "error",
+        "created",
+        "updated",
+    ]
+
+    def __init__(self, path: str = "grading_jobs.db"):
+        self.path = path
+        self._connection = None
+        self._lock = threading.Lock()
+
+    def get_connection(self):
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS grading_jobs ("
+                "job_id TEXT PRIMARY KEY, request TEXT, status TEXT, "
+                "total INTEGER, graded INTEGER, skipped INTEGER, incomplete INTEGER, "
+                "error TEXT, created REAL, updated REAL, ground_truths TEXT)"
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS grading_results ("
+                "job_id TEXT, user_id INTEGER, submitted INTEGER, questions TEXT, "
+                "ground_truth_hash TEXT, row TEXT, graded_at REAL, "
+                "PRIMARY KEY (job_id, user_id))"
+            )
+            self._connection.commit()
+        return self._connection
+
+    def create_job(self, request: dict) -> str:
+        """Registers a queued job
+        @parameter: request : dict - course_shortname, assignment_name, rubric
+            and ground_truth of the run
+        @returns str - Job id.
+        """
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            connection = self.get_connection()
+            connection.execute(
+                "INSERT INTO grading_jobs VALUES "
+                "(?, ?, 'queued', 0, 0, 0, 0, NULL, ?, ?, '{}')",
+                (job_id, json.dumps(request), now, now),
+            )
+            connection.commit()
+        return job_id
+
+    def get_job(self, job_id: str) -> dict:
+        """Returns a job with its request and progress, None if it does not exist."""
+        with self._lock:
+            row = (
+                self.get_connection()
+                .execute(
+                    f"SELECT {', '.join(self.COLUMNS)} FROM grading_jobs "
+                    "WHERE job_id = ?",
+                    (job_id,),
+                )
+                .fetchone()
+            )
+        if row is None:
+            return None
+        job = dict(zip(self.COLUMNS, row))
+        job["request"] = json.loads(job["request"])
+        return job
+
+    def update_job(self, job_id: str, **fields) -> None:
+        """Sets status, total, graded, skipped, incomplete or error of a job."""
+        fields["updated"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            connection = self.get_connection()
+            connection.execute(
+                f"UPDATE grading_jobs SET {assignments} WHERE job_id = ?",
+                (*fields.values(), job_id),
+            )
+            connection.commit()
+
+    def interrupt_running(self) -> int:
+        """Marks jobs that were running when the process stopped as interrupted
+        @returns int - Number of interrupted jobs.
+        """
+        with self._lock:
+            connection = self.get_connection()
+            count = connection.execute(
+                "UPDATE grading_jobs SET status = 'interrupted', updated = ? "
+                "WHERE status IN ('queued', 'running')",
+                (time.time(),),
+            ).rowcount
+            connection.commit()
+        return count
+
+    def get_ground_truths(self, job_id: str) -> dict:
+        """Returns the ground truths built by a job, by question."""
+        with self._lock:
+            row = (
+                self.get_connection()
+                .execute(
+                    "SELECT ground_truths FROM grading_jobs WHERE job_id = ?",
+                    (job_id,),
+                )
+                .fetchone()
+            )
+        return json.loads(row[0]) if row else {}
+
+    def set_ground_truths(self, job_id: str, ground_truths: dict) -> None:
+        with self._lock:
+            connection = self.get_connection()
+            connection.execute(
+                "UPDATE grading_jobs SET ground_truths = ? WHERE job_id = ?",
+                (json.dumps(ground_truths), job_id),
+            )
+            connection.commit()
+
+    def record_incomplete(self, job_id: str) -> None:
+        """Counts a student whose row was not saved because a file or pair failed."""
+        with self._lock:
+            connection = self.get_connection()
+            connection.execute(
+                "UPDATE grading_jobs SET incomplete = incomplete + 1, updated = ? "
+                "WHERE job_id = ?",
+                (time.time(), job_id),
+            )
+            connection.commit()
+
+    def get_results(self, job_id: str) -> dict:
+        """Returns the results a job has saved
+        @parameter: job_id : str - Job id
+        @returns dict - By user id, a dict with submitted (the submission's
+            timemodified), questions, ground_truth_hash and row.
+        """
+        with self._lock:
+            rows = (
+                self.get_connection()
+                .execute(
+                    "SELECT user_id, submitted, questions, ground_truth_hash, row "
+                    "FROM grading_results WHERE job_id = ?",
+                    (job_id,),
+                )
+                .fetchall()
+            )
+        return {
+            user_id: {
+                "submitted": submitted,
+                "questions": json.loads(questions),
+                "ground_truth_hash": ground_truth_hash,
+                "row": json.loads(row),
+            }
+            for user_id, submitted, questions, ground_truth_hash, row in rows
+        }
+
+    def save_result(
+        self,
+        job_id: str,
+        user_id: int,
+        submitted: int,
+        questions: list[str],
+        ground_truth_hash: str,
+        row: dict,
+    ) -> None:
+        """Saves one student's result and counts it towards the job's progress."""
+        now = time.time()
+        with self._lock:
+            connection = self.get_connection()
+            connection.execute(
+                "INSERT OR REPLACE INTO grading_results VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    job_id,
+                    user_id,
+                    submitted,
+                    json.dumps(questions),
+                    ground_truth_hash,
+                    json.dumps(row),
+                    now,
+                ),
+            )
+            connection.execute(
+                "UPDATE grading_jobs SET graded = graded + 1, updated = ? "
+                "WHERE job_id = ?",
+                (now, job_id),
+            )
+            connection.commit()
+
+
+grading_jobs = GradingJobStore(os.environ.get("GRADING_JOBS_PATH", "grading_jobs.db"))
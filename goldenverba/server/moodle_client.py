@@ -0,0 +1,236 @@
+import os
+import json
+import asyncio
+import random
+
+from bs4 import BeautifulSoup
+from dotenv import load_dotenv
+from wasabi import msg
+
+try:
+    import aiohttp
+except Exception:
+    msg.warn("aiohttp not installed, the Moodle client will not be available.")
+
+load_dotenv()
+
+# Worth retrying: Moodle or its proxy is overloaded or restarting
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class MoodleError(Exception):
+    """Raised when Moodle answers with an error or a response that is not JSON.
+    errorcode is set when Moodle itself rejected the call (e.g. accessexception for a
+    function not enabled for the token).
+    """
+
+    def __init__(self, message: str, errorcode: str = None):
+        super().__init__(message)
+        self.errorcode = errorcode
+
+
+class MoodleClient:
+    """
+    Async client for the Moodle web services, replacing blocking requests calls inside
+    async endpoints. All calls share one keep-alive connection pool, at most
+    max_concurrency run against Moodle at once, every call has its own timeout and
+    failed calls are retried with exponentially growing, jittered backoff.
+    """
+
+    def __init__(
+        self,
+        base_url: str = "",
+        max_concurrency: int = 8,
+        timeout: float = 30.0,
+        download_timeout: float = 120.0,
+        retries: int = 3,
+        backoff: float = 0.5,
+        max_backoff: float = 8.0,
+        max_connections: int = 32,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.download_timeout = download_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_connections = max_connections
+        self._session = None
+        self._semaphore = None
+        self.stats = {"calls": 0, "retries": 0, "failures": 0, "in_flight": 0}
+
+    def get_endpoint(self) -> str:
+        return self.base_url + "/webservice/rest/server.php"
+
+    def get_login_url(self) -> str:
+        return self.base_url + "/login/index.php?altlogin=1"
+
+    async def start(self) -> None:
+        """Opens the connection pool, called on FastAPI startup."""
+        self.get_session()
+        msg.info(
+            f"Moodle client pool started ({self.max_connections} connections, "
+            f"{self.max_concurrency} concurrent calls)"
+        )
+
+    async def close(self) -> None:
+        """Closes all pooled connections, called on FastAPI shutdown."""
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._semaphore = None
+
+    def get_session(self) -> "aiohttp.ClientSession":
+        """Returns the shared session, created lazily if startup did not run (e.g.
+        scripts)."""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_connections),
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    def get_delay(self, attempt: int) -> float:
+        """Full-jitter backoff: a random delay up to backoff * 2^attempt, capped at
+        max_backoff."""
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+
+    async def request(self, method: str, url: str, timeout: float, **kwargs):
+        """Sends one request with retries, inside the concurrency limit
+        @parameter: method : str - HTTP method
+        @parameter: url : str - Full url
+        @parameter: timeout : float - Total seconds allowed per attempt
+        @returns tuple[int, bytes] - Status code and body of the last attempt.
+        """
+        session = self.get_session()
+        self.stats["calls"] += 1
+        for attempt in range(self.retries + 1):
+            try:
+                async with self._semaphore:
+                    self.stats["in_flight"] += 1
+                    try:
+                        async with session.request(
+                            method,
+                            url,
+                            timeout=aiohttp.ClientTimeout(total=timeout),
+                            **kwargs,
+                        ) as response:
+                            status, body = response.status, await response.read()
+                    finally:
+                        self.stats["in_flight"] -= 1
+                if status not in RETRY_STATUSES or attempt == self.retries:
+                    return status, body
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                if attempt == self.retries:
+                    self.stats["failures"] += 1
+                    raise
+            self.stats["retries"] += 1
+            await asyncio.sleep(self.get_delay(attempt))
+
+    async def call(self, params: dict):
+        """Calls a Moodle web service function
+        @parameter: params : dict - Query parameters including wstoken, wsfunction and
+            moodlewsrestformat
+        @returns Any - Decoded JSON result.
+        """
+        status, body = await self.request(
+            "GET", self.get_endpoint(), self.timeout, params=params
+        )
+        print(f"API Call to {params.get('wsfunction')} - Status Code: {status}")
+        if status >= 400:
+            raise MoodleError(
+                f"Moodle returned {status} for {params.get('wsfunction')}"
+            )
+
+        try:
+            result = json.loads(body)
+        except ValueError as e:
+            raise MoodleError(
+                f"Error parsing JSON response: {body.decode('utf-8', 'replace')}"
+            ) from e
+
+        if isinstance(result, dict) and "exception" in result:
+            raise MoodleError(
+                f"Error: {result.get('message', result['exception'])}",
+                result.get("errorcode") or result["exception"],
+            )
+
+        return result
+
+    async def download(self, url: str) -> bytes:
+        """Downloads a file, e.g. a submission (the url carries the token)
+        @parameter: url : str - File url
+        @returns bytes - File content.
+        """
+        status, body = await self.request("GET", url, self.download_timeout)
+        if status != 200:
+            raise MoodleError(f"Failed to download file: {status}, URL: {url}")
+        return body
+
+    async def login(self, username: str, password: str) -> bool:
+        """Logs into the Moodle web login with a fresh cookie jar, over the shared pool
+        @parameter: username : str - Moodle username
+        @parameter: password : str - Moodle password
+        @returns bool - Whether Moodle accepted the credentials.
+        """
+        self.get_session()
+        async with aiohttp.ClientSession(
+            connector=self._session.connector,
+            connector_owner=False,
+            cookie_jar=aiohttp.CookieJar(unsafe=True),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        ) as session:
+            try:
+                async with self._semaphore:
+                    async with session.get(self.get_login_url()) as response:
+                        response.raise_for_status()
+                        page = await response.text()
+                print("Login page fetched successfully.")
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"Failed to get login page: {e}")
+                return False
+
+            logintoken = BeautifulSoup(page, "html.parser").find(
+                "input", {"name": "logintoken"}
+            )
+            if not logintoken:
+                print(
+                    "Login token not found. "
+                    "Check if the login page structure has changed."
+                )
+                return False
+
+            credentials = {
+                "username": username,
+                "password": password,
+                "logintoken": logintoken["value"],
+            }
+            try:
+                async with self._semaphore:
+                    async with session.post(
+                        self.get_login_url(), data=credentials
+                    ) as response:
+                        response.raise_for_status()
+                        print(
+                            "Login attempt response status code:", response.status
+                        )
+                        page = await response.text()
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                print(f"Login failed: {e}")
+                return False
+
+        return "Log out" in page
+
+    def get_stats(self) -> dict:
+        return {**self.stats, "max_concurrency": self.max_concurrency}
+
+
+moodle_client = MoodleClient(
+    os.environ.get("MOODLE_URL", ""),
+    max_concurrency=int(os.environ.get("MOODLE_MAX_CONCURRENCY", "8")),
+    timeout=float(os.environ.get("MOODLE_TIMEOUT", "30")),
+    download_timeout=float(os.environ.get("MOODLE_DOWNLOAD_TIMEOUT", "120")),
+    retries=int(os.environ.get("MOODLE_RETRIES", "3")),
+    backoff=float(os.environ.get("MOODLE_BACKOFF", "0.5")),
+)
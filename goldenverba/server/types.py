@@ -1,6 +1,6 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from goldenverba.components.types import FileData
-from typing import List, Optional
+from typing import List, Literal, Optional
 
 
 class QueryPayload(BaseModel):
@@ -50,6 +50,7 @@ class ImportPayload(BaseModel):
     data: list[FileData]
     textValues: list[str]
     config: dict
+    course_id: str = None
 
 
 class QueryRequest(BaseModel):
@@ -129,6 +130,29 @@ class QueryRequestResume(BaseModel):
     resume: str
     jd: str
     course_id: str = None
+    # "per_dimension": one generation per dimension, "structured": all dimensions in one
+    # JSON answer
+    mode: Literal["per_dimension", "structured"] = "per_dimension"
+
+
+class ResumeDimensionScore(BaseModel):
+    # None when the documents do not allow a judgement (N/A)
+    score: Optional[int] = Field(None, ge=0, le=3)
+    explanation: str
+
+
+class ResumeCandidate(BaseModel):
+    resume: str
+    # Caller's identifier for the applicant, echoed back in the results
+    name: str = None
+
+
+class QueryRequestResumeBulk(BaseModel):
+    jd: str
+    resumes: List[ResumeCandidate]
+    # Number of best matching resumes that get the full rubric evaluation
+    top_k: int = Field(10, ge=1)
+    mode: Literal["per_dimension", "structured"] = "per_dimension"
 
 
 class QueryRequestaqg(BaseModel):
@@ -169,7 +169,7 @@ def set_config(manager: VerbaManager, combined_config: dict):
             embedders[_embedder].set_config(
                 config.get("Embedder", {})
                 .get("components", {})
-                .get(_chunker, {})
+                .get(_embedder, {})
                 .get("config", {})
             )
 
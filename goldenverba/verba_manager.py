@@ -8,6 +8,7 @@ from weaviate.embedded import EmbeddedOptions
 
 import goldenverba.components.schema.schema_generation as schema_manager
 
+from goldenverba.components.cache import chunk_cache
 from goldenverba.components.chunk import Chunk
 from goldenverba.components.document import Document
 from goldenverba.components.types import FileData
@@ -61,12 +62,17 @@ class VerbaManager:
         fileData: list[FileData],
         textValues: list[str],
         logging: list[dict],
+        course_id: str = None,
     ) -> list[Document]:
 
         loaded_documents, logging = self.reader_manager.load(
             fileData, textValues, logging
         )
 
+        if course_id:
+            for document in loaded_documents:
+                document.meta["course_id"] = course_id
+
         filtered_documents = []
 
         # Check if document names exist in DB
@@ -307,8 +313,11 @@ class VerbaManager:
         Checks which environment variables are installed and fills out the self.environment_variables dictionary for the frontend to access.
         """
 
-        # Ollama URL
-        if os.environ.get("OLLAMA_URL", "") != "":
+        # Ollama URL (OLLAMA_URLS lists several hosts)
+        if (
+            os.environ.get("OLLAMA_URL", "") != ""
+            or os.environ.get("OLLAMA_URLS", "") != ""
+        ):
             self.environment_variables["OLLAMA_URL"] = True
         else:
             self.environment_variables["OLLAMA_URL"] = False
@@ -512,7 +521,6 @@ class VerbaManager:
     def retrieve_chunks(
         self, queries: list[str], course_id: str = None
     ) -> tuple[list[Chunk], str]:
-        # print(f"Initial course_id: {course_id}")
         chunks, context = self.retriever_manager.retrieve(
             queries,
             self.client,
@@ -522,22 +530,9 @@ class VerbaManager:
             self.generator_manager.generators[
                 self.generator_manager.selected_generator
             ],
+            course_id,
         )
 
-        if course_id:
-            course_id = course_id.strip().lower()
-            # print(f"Filtering chunks with course_id: {course_id}")
-
-            # Debug print each chunk's doc_name
-            # for chunk in chunks:
-            # print(f"Chunk doc_name: {chunk.doc_name.lower()}")
-
-            chunks = [
-                chunk
-                for chunk in chunks
-                if chunk.doc_name.lower().startswith(course_id)
-            ]
-
         # Debug print to verify filtered chunks
         print(f"Filtered chunks: {chunks}")
 
@@ -720,6 +715,7 @@ class VerbaManager:
                 ].add_to_semantic_cache(self.client, semantic_query, full_text)
 
     def reset(self):
+        chunk_cache.clear()
         self.client.schema.delete_class("VERBA_Suggestion")
         # Check if all schemas exist for all possible vectorizers
         for vectorizer in schema_manager.VECTORIZERS:
@@ -735,6 +731,7 @@ class VerbaManager:
             schema_manager.init_schemas(self.client, embedding, False, True)
 
     def reset_documents(self):
+        chunk_cache.clear()
         # Check if all schemas exist for all possible vectorizers
         for vectorizer in schema_manager.VECTORIZERS:
             document_class_name = (
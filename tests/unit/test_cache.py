@@ -0,0 +1,127 @@
+import os
+import tempfile
+import unittest
+
+from goldenverba.components.cache import (
+    CompletionCache,
+    DocumentChunkCache,
+    EmbeddingCache,
+    LRUCache,
+    TTLCache,
+    is_deterministic,
+)
+from goldenverba.components.chunk import Chunk
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(maxsize=2)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        cache.get("a")
+        cache.set("c", 3)
+        self.assertIn("a", cache)
+        self.assertNotIn("b", cache)
+        self.assertIn("c", cache)
+
+
+class TestTTLCache(unittest.TestCase):
+    def test_entries_expire(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.set("a", [])
+        self.assertEqual(cache.get("a"), [])
+        cache.ttl = -1
+        cache.set("b", ["editingteacher"])
+        self.assertIsNone(cache.get("b"))
+        self.assertNotIn("b", cache)
+        self.assertIn("a", cache)
+
+
+class TestDocumentChunkCache(unittest.TestCase):
+    def test_invalidate_by_name_and_uuid(self):
+        cache = DocumentChunkCache(maxsize=4)
+        cache.add_chunks(
+            "VERBA_Chunk_OLLAMA", "doc_a", {0: Chunk("a", "doc_a", "", "uuid-a", 0)}
+        )
+        cache.add_chunks(
+            "VERBA_Chunk_OLLAMA",
+            "doc_b",
+            {0: Chunk("b", "doc_b", "", "uuid-b", 0), 1: None},
+        )
+        self.assertEqual(cache.get_chunks("VERBA_Chunk_OLLAMA", "doc_b")[1], None)
+
+        cache.invalidate("VERBA_Chunk_OLLAMA", doc_name="doc_a")
+        self.assertEqual(cache.get_chunks("VERBA_Chunk_OLLAMA", "doc_a"), {})
+
+        cache.invalidate("VERBA_Chunk_OLLAMA", doc_uuid="uuid-b")
+        self.assertEqual(cache.get_chunks("VERBA_Chunk_OLLAMA", "doc_b"), {})
+
+
+class TestEmbeddingCache(unittest.TestCase):
+    def test_vectors_survive_restart(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "embeddings.sqlite")
+            key = EmbeddingCache.get_key("OLLAMA", "nomic-embed-text", "hello")
+
+            cache = EmbeddingCache(maxsize=4, path=path)
+            self.assertEqual(cache.get_many([key]), {})
+            cache.set_many({key: [0.5, -1.0]})
+
+            restarted = EmbeddingCache(maxsize=4, path=path)
+            self.assertEqual(restarted.get_many([key]), {key: [0.5, -1.0]})
+            self.assertEqual(restarted.hits, 1)
+
+    def test_disk_store_is_bounded(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "embeddings.sqlite")
+            cache = EmbeddingCache(maxsize=4, path=path, disk_maxsize=10)
+            cache.set_many(
+                {
+                    EmbeddingCache.get_key("OLLAMA", "model", str(i)): [float(i)]
+                    for i in range(100)
+                }
+            )
+            count = cache.get_connection().execute(
+                "SELECT COUNT(*) FROM embeddings"
+            ).fetchone()[0]
+            self.assertEqual(count, 10)
+
+    def test_key_depends_on_model(self):
+        self.assertNotEqual(
+            EmbeddingCache.get_key("OLLAMA", "a", "text"),
+            EmbeddingCache.get_key("OLLAMA", "b", "text"),
+        )
+
+
+class TestCompletionCache(unittest.TestCase):
+    def test_persists_expires_and_counts_per_endpoint(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "completions.sqlite")
+            messages = [{"role": "user", "content": "Grade this"}]
+            key = CompletionCache.get_key("llama3.1", messages, {"temperature": 0})
+
+            cache = CompletionCache(maxsize=4, path=path)
+            self.assertIsNone(cache.get(key, "/api/process"))
+            cache.set(key, {"text": "spanda_final_score = 3", "stats": {}})
+
+            restarted = CompletionCache(maxsize=4, path=path)
+            self.assertEqual(
+                restarted.get(key, "/api/process")["text"], "spanda_final_score = 3"
+            )
+            self.assertEqual(
+                restarted.get_stats()["endpoints"]["/api/process"],
+                {"hits": 1, "misses": 0, "hit_ratio": 1.0},
+            )
+
+            expired = CompletionCache(maxsize=4, ttl=-1)
+            expired.set(key, {"text": "old"})
+            self.assertIsNone(expired.get(key))
+
+    def test_only_greedy_sampling_is_cached(self):
+        self.assertTrue(is_deterministic({"temperature": 0, "seed": 0}))
+        self.assertFalse(is_deterministic({"temperature": 0.7}))
+        self.assertFalse(is_deterministic(None))
+
+
+if __name__ == "__main__":
+    unittest.main()
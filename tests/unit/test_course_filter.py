@@ -0,0 +1,44 @@
+import fnmatch
+import unittest
+
+try:
+    from goldenverba.components.schema.schema_generation import (
+        course_where_filter,
+        get_course_properties,
+    )
+except ImportError:
+    course_where_filter = None
+
+
+def matches(where: dict, properties: dict) -> bool:
+    """Evaluates the Equal/Like/And/Or subset of a Weaviate where filter."""
+    if where["operator"] == "And":
+        return all(matches(operand, properties) for operand in where["operands"])
+    if where["operator"] == "Or":
+        return any(matches(operand, properties) for operand in where["operands"])
+    value = properties[where["path"][0]]
+    if where["operator"] == "Like":
+        return fnmatch.fnmatchcase(value, where["valueText"])
+    return value == where.get("valueText", where.get("valueBoolean"))
+
+
+@unittest.skipIf(course_where_filter is None, "weaviate-client is not installed")
+class TestCourseFilter(unittest.TestCase):
+    def test_course_ids_with_separators(self):
+        notes = get_course_properties("CS-101_notes.pdf")
+        self.assertTrue(matches(course_where_filter("CS-101"), notes))
+        self.assertTrue(matches(course_where_filter("cs"), notes))
+        self.assertFalse(matches(course_where_filter("cs-102"), notes))
+
+        imported = get_course_properties("notes.pdf", " Math_2.1 ")
+        self.assertTrue(matches(course_where_filter("math_2.1"), imported))
+        self.assertFalse(matches(course_where_filter("math_2.10"), imported))
+
+    def test_explicit_course_ids_match_exactly(self):
+        imported = get_course_properties("cs1_intro.pdf", "cs101")
+        self.assertTrue(matches(course_where_filter("cs101"), imported))
+        self.assertFalse(matches(course_where_filter("cs1"), imported))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,38 @@
+import asyncio
+import unittest
+
+from goldenverba.server.extraction import ExtractionPool, extract_text
+
+
+class TestExtraction(unittest.TestCase):
+    def test_extract_text_by_extension(self):
+        self.assertEqual(
+            extract_text("A.TXT", b"Q1: Why?\nA1: So."), "Q1: Why?\nA1: So."
+        )
+        self.assertEqual(extract_text("a.odt", b""), "Unsupported file format.")
+        self.assertTrue(
+            extract_text("a.txt", b"\xff").startswith("Error extracting text")
+        )
+
+    def test_pool_extracts_and_recovers_from_timeouts(self):
+        pool = ExtractionPool(max_workers=2, timeout=0.001)
+
+        async def run():
+            timed_out = await pool.extract("a.txt", b"slow")
+            pool.timeout = 60
+            texts = await asyncio.gather(
+                *[pool.extract(f"{i}.txt", f"text {i}".encode()) for i in range(4)]
+            )
+            return timed_out, texts
+
+        try:
+            timed_out, texts = asyncio.run(run())
+        finally:
+            pool.close()
+        self.assertIn("timed out", timed_out)
+        self.assertEqual(texts, [f"text {i}" for i in range(4)])
+        self.assertEqual(pool.get_stats()["restarts"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,96 @@
+import asyncio
+import unittest
+
+from goldenverba.server.grading import build_submission_row, grade_submissions
+
+USERS = [
+    {"id": 1, "fullname": "Ada", "email": "ada@example.com"},
+    {"id": 2, "fullname": "Bob", "email": "bob@example.com"},
+    {"id": 3, "fullname": "Cy", "email": "cy@example.com"},
+]
+
+
+class TestGrading(unittest.TestCase):
+    def test_build_submission_row_skips_failed_pairs(self):
+        row = build_submission_row(
+            USERS[0], [(3, "Q1: ok"), None, (None, "Q3: no score"), (2, "Q4: ok")]
+        )
+        self.assertEqual(row["Total Score"], 5)
+        self.assertEqual(row["Feedback"], "Q1: ok | Q4: ok")
+        self.assertEqual(
+            build_submission_row(USERS[1], None)["Feedback"], "No submission"
+        )
+        self.assertEqual(build_submission_row(USERS[1], [None])["Total Score"], 0)
+
+    def test_grades_round_robin_with_failed_and_unscored_pairs(self):
+        extracted = {
+            1: [[("p", "good", "a"), ("p", "unscored", "a")], [("p", "good", "a")]],
+            2: [[("p", "failing", "a")]],
+            3: None,
+            4: [[("p", "good", "a")], None],
+            5: [[("p", "good", "a")]],
+        }
+        users = USERS + [
+            {"id": 4, "fullname": "Di", "email": "di@example.com"},
+            {"id": 5, "fullname": "Ed", "email": "ed@example.com"},
+        ]
+        order = []
+        running = {"now": 0, "peak": 0}
+
+        async def grade_pair(user, i, qa_pair, question, answer):
+            order.append((user["id"], i))
+            running["now"] += 1
+            running["peak"] = max(running["peak"], running["now"])
+            await asyncio.sleep(0.01)
+            running["now"] -= 1
+            if question == "failing":
+                return None
+            if question == "unscored":
+                return None, f"Q{i+1}: no score"
+            return 2, f"Q{i+1}: ok"
+
+        finished = {}
+        rows = asyncio.run(
+            grade_submissions(
+                users,
+                extracted,
+                grade_pair,
+                max_concurrency=2,
+                on_row=lambda user, row, complete: finished.update(
+                    {user["id"]: complete}
+                ),
+            )
+        )
+        self.assertEqual(order[:4], [(1, 0), (2, 0), (4, 0), (5, 0)])
+        self.assertEqual(running["peak"], 2)
+        # Failed pairs, unscored pairs and failed files leave a row incomplete
+        self.assertEqual(
+            finished, {1: False, 2: False, 3: True, 4: False, 5: True}
+        )
+        self.assertEqual(rows[1]["Total Score"], 4)
+        self.assertEqual(rows[1]["Feedback"], "Q1: ok | Q1: ok")
+        self.assertEqual(rows[2]["Total Score"], 0)
+        self.assertEqual(rows[3]["Feedback"], "No submission")
+
+    def test_failing_worker_cancels_the_others(self):
+        extracted = {1: [[("p", "q", "a")] * 4]}
+        graded = []
+
+        async def grade_pair(user, i, qa_pair, question, answer):
+            if i == 0:
+                raise RuntimeError("backend down")
+            await asyncio.sleep(0.05)
+            graded.append(i)
+            return 1, "ok"
+
+        async def run():
+            with self.assertRaises(RuntimeError):
+                await grade_submissions(USERS[:1], extracted, grade_pair, 2)
+            await asyncio.sleep(0.1)
+
+        asyncio.run(run())
+        self.assertEqual(graded, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import os
+import tempfile
+import unittest
+
+from goldenverba.server.grading_jobs import GradingJobStore, get_ground_truth_hash
+
+
+class TestGradingJobStore(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "jobs.db")
+        self.request = {
+            "course_shortname": "CS101",
+            "assignment_name": "Quiz 1",
+            "rubric": "Correctness",
+            "ground_truth": "",
+        }
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_results_survive_restart_and_belong_to_their_job(self):
+        store = GradingJobStore(self.path)
+        job_id = store.create_job(self.request)
+        store.update_job(job_id, status="running", total=2)
+        store.set_ground_truths(job_id, {"Why?": "Because."})
+        store.save_result(job_id, 7, 1700000000, ["Why?"], "hash", {"Total Score": 3})
+
+        # Restarted process: the running job is interrupted, its results kept
+        store = GradingJobStore(self.path)
+        self.assertEqual(store.interrupt_running(), 1)
+        job = store.get_job(job_id)
+        self.assertEqual(
+            (job["status"], job["total"], job["graded"]), ("interrupted", 2, 1)
+        )
+        self.assertEqual(job["request"], self.request)
+        self.assertEqual(store.get_ground_truths(job_id), {"Why?": "Because."})
+        self.assertEqual(
+            store.get_results(job_id),
+            {
+                7: {
+                    "submitted": 1700000000,
+                    "questions": ["Why?"],
+                    "ground_truth_hash": "hash",
+                    "row": {"Total Score": 3},
+                }
+            },
+        )
+
+        # A new job for the same request grades everyone again
+        new_job_id = store.create_job(self.request)
+        self.assertEqual(store.get_results(new_job_id), {})
+        self.assertEqual(store.get_ground_truths(new_job_id), {})
+        self.assertIsNone(store.get_job("missing"))
+
+    def test_ground_truth_hash(self):
+        built = {"Why?": "Because.", "How?": "Like so."}
+        hash = get_ground_truth_hash("Correctness", "", ["Why?"], built)
+        self.assertEqual(
+            hash,
+            get_ground_truth_hash("Correctness", "", ["Why?"], {"Why?": "Because."}),
+        )
+        for rubric, ground_truths in [
+            ("Correctness", {"Why?": "So."}),
+            ("Correctness", {}),
+            ("Style", built),
+        ]:
+            self.assertNotEqual(
+                hash, get_ground_truth_hash(rubric, "", ["Why?"], ground_truths)
+            )
+        # A ground truth given with the request replaces the built ones
+        self.assertEqual(
+            get_ground_truth_hash("Correctness", "Given", ["Why?"], built),
+            get_ground_truth_hash("Correctness", "Given", ["How?"], {}),
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+import asyncio
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from goldenverba.components.hedging import RequestHedger
+from goldenverba.components.ollama_router import OllamaRequestError, OllamaRouter
+
+try:
+    import aiohttp  # noqa: F401
+
+    from goldenverba.components import ollama_client
+except ImportError:
+    ollama_client = None
+
+
+def start_chat_stub(status: int, tokens: list[str]) -> ThreadingHTTPServer:
+    """Starts a local server answering /api/chat with the given status and, for a
+    200, the tokens as an Ollama NDJSON stream."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers["Content-Length"]))
+            self.hits.append(self.path)
+            lines = [{"message": {"content": token}, "done": False} for token in tokens]
+            lines.append({"message": {"content": ""}, "done": True})
+            body = "".join(json.dumps(line) + "\n" for line in lines)
+            if status != 200:
+                body = json.dumps({"error": "stub error"})
+            self.send_response(status)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body.encode("utf-8"))
+
+        def log_message(self, *args):
+            pass
+
+    Handler.hits = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.hits = Handler.hits
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def get_url(server: ThreadingHTTPServer) -> str:
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+class TestRequestHedger(unittest.TestCase):
+    def test_delay_follows_ttft_percentile(self):
+        hedger = RequestHedger(
+            enabled=True, percentile=90, min_delay=0.5, max_delay=10, min_samples=10
+        )
+        self.assertEqual(hedger.get_delay(), 10)
+        for seconds in range(1, 11):
+            hedger.record_ttft(seconds / 10)
+        self.assertEqual(hedger.get_delay(), 1.0)
+        hedger.record_ttft(0.1)
+        hedger.min_delay = 2
+        self.assertEqual(hedger.get_delay(), 2)
+
+    def test_budget_caps_hedges(self):
+        hedger = RequestHedger(enabled=True, budget=0.1)
+        for _ in range(20):
+            hedger.record_request()
+        self.assertTrue(hedger.try_hedge())
+        self.assertTrue(hedger.try_hedge())
+        self.assertFalse(hedger.try_hedge())
+        hedger.record_win(True)
+        stats = hedger.get_stats()
+        self.assertEqual(stats["hedges"], 2)
+        self.assertEqual(stats["hedge_wins"], 1)
+        self.assertEqual(stats["budget_exhausted"], 1)
+
+
+@unittest.skipIf(ollama_client is None, "aiohttp is not installed")
+class TestHedgedStream(unittest.TestCase):
+    def setUp(self):
+        self.failing = start_chat_stub(500, [])
+        self.healthy = start_chat_stub(200, ["Hello", " world"])
+        self.router = OllamaRouter(
+            [get_url(self.failing), get_url(self.healthy)], eject_seconds=60
+        )
+        self.default_router = ollama_client.ollama_router
+        ollama_client.ollama_router = self.router
+
+    def tearDown(self):
+        ollama_client.ollama_router = self.default_router
+        for server in [self.failing, self.healthy]:
+            server.shutdown()
+            server.server_close()
+
+    def stream(self) -> list[str]:
+        async def collect():
+            client = ollama_client.OllamaClient()
+            try:
+                return [
+                    result["message"]
+                    async for result in client.hedged_stream("llama3", {})
+                ]
+            finally:
+                await client.close()
+
+        return asyncio.run(collect())
+
+    def test_fast_failure_moves_to_another_backend(self):
+        self.assertEqual(self.stream(), ["Hello", " world", ""])
+        self.assertEqual((self.failing.hits, self.healthy.hits), (["/api/chat"],) * 2)
+        failing, healthy = self.router.get_stats()["backends"]
+        self.assertEqual((failing["failures"], healthy["failures"]), (1, 0))
+
+    def test_request_errors_are_not_retried(self):
+        self.failing.shutdown()
+        self.failing.server_close()
+        self.failing = start_chat_stub(404, [])
+        self.router.set_urls([get_url(self.failing), get_url(self.healthy)])
+        with self.assertRaises(OllamaRequestError):
+            self.stream()
+        self.assertEqual((self.failing.hits, self.healthy.hits), (["/api/chat"], []))
+
+
+if __name__ == "__main__":
+    unittest.main()
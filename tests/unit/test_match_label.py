@@ -0,0 +1,53 @@
+import unittest
+
+try:
+    from goldenverba.components.interfaces import Generator
+except ImportError:
+    Generator = None
+
+
+@unittest.skipIf(Generator is None, "goldenverba dependencies are not installed")
+class TestMatchLabel(unittest.TestCase):
+    def setUp(self):
+        self.generator = Generator()
+
+    def test_waits_while_a_longer_label_continues_the_text(self):
+        labels = ["Relevant", "Irrelevant", "Highly Irrelevant"]
+        self.assertIsNone(self.generator.match_label("Highly", labels))
+        self.assertEqual(self.generator.match_label("Irrelevant", labels), "Irrelevant")
+        self.assertEqual(
+            self.generator.match_label("Highly irrelevant.", labels),
+            "Highly Irrelevant",
+        )
+        self.assertEqual(
+            self.generator.match_label("highly", ["Highly", "Highly Irrelevant"], True),
+            "Highly",
+        )
+
+    def test_correct_does_not_match_incorrect(self):
+        labels = ["CORRECT", "INCORRECT"]
+        self.assertEqual(self.generator.match_label("Incorrect", labels), "INCORRECT")
+        self.assertEqual(self.generator.match_label("correct!", labels), "CORRECT")
+        self.assertEqual(
+            self.generator.match_label("The answer is incorrect", labels, final=True),
+            "INCORRECT",
+        )
+
+    def test_final_takes_the_earliest_label(self):
+        labels = ["YES", "NO"]
+        text = "No, although yes could be argued"
+        self.assertIsNone(self.generator.match_label(text, labels))
+        self.assertEqual(self.generator.match_label(text, labels, final=True), "NO")
+        self.assertEqual(
+            self.generator.match_label(
+                "It is highly irrelevant, not relevant",
+                ["Relevant", "Irrelevant", "Highly Irrelevant"],
+                final=True,
+            ),
+            "Highly Irrelevant",
+        )
+        self.assertIsNone(self.generator.match_label("Maybe", labels, final=True))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,148 @@
+import asyncio
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+try:
+    import aiohttp  # noqa: F401
+
+    from goldenverba.server.moodle_client import MoodleClient, MoodleError
+except ImportError:
+    aiohttp = None
+
+
+def start_stub(failures: int = 0) -> ThreadingHTTPServer:
+    """Starts a local Moodle stub: web service calls, a file and the web login, failing
+    the first calls with 503."""
+    state = {"failures": failures, "requests": 0, "in_flight": 0, "peak": 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def reply(self, status: int, body: str, content_type="application/json"):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body.encode("utf-8"))))
+            self.send_header("Set-Cookie", "MoodleSession=stub; Path=/")
+            self.end_headers()
+            self.wfile.write(body.encode("utf-8"))
+
+        def do_GET(self):
+            with lock:
+                state["requests"] += 1
+                state["in_flight"] += 1
+                state["peak"] = max(state["peak"], state["in_flight"])
+                fail = state["failures"] > 0
+                state["failures"] -= 1
+            try:
+                url = urlparse(self.path)
+                params = {k: v[0] for k, v in parse_qs(url.query).items()}
+                if fail:
+                    self.reply(503, "busy")
+                elif url.path == "/login/index.php":
+                    self.reply(
+                        200,
+                        '<form><input name="logintoken" value="abc"></form>',
+                        "text/html",
+                    )
+                elif url.path == "/file.txt":
+                    self.reply(200, "Q1: What?\nA1: That.", "text/plain")
+                elif params.get("wsfunction") == "core_course_get_courses":
+                    threading.Event().wait(0.05)
+                    self.reply(200, json.dumps([{"id": 2, "fullname": "Course"}]))
+                else:
+                    self.reply(
+                        200,
+                        json.dumps(
+                            {
+                                "exception": "moodle_exception",
+                                "message": "Invalid token",
+                            }
+                        ),
+                    )
+            finally:
+                with lock:
+                    state["in_flight"] -= 1
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers["Content-Length"])).decode()
+            form = parse_qs(body)
+            ok = (
+                form.get("logintoken") == ["abc"]
+                and form.get("password") == ["secret"]
+                and "MoodleSession=stub" in (self.headers.get("Cookie") or "")
+            )
+            self.reply(200, "Log out" if ok else "Invalid login", "text/html")
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.state = state
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@unittest.skipUnless(aiohttp, "aiohttp not installed")
+class TestMoodleClient(unittest.TestCase):
+    def setUp(self):
+        self.server = start_stub(failures=2)
+        self.client = MoodleClient(
+            f"http://127.0.0.1:{self.server.server_address[1]}",
+            max_concurrency=2,
+            retries=3,
+            backoff=0.01,
+        )
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def run_with_client(self, coroutine):
+        async def run():
+            try:
+                return await coroutine
+            finally:
+                await self.client.close()
+
+        return asyncio.run(run())
+
+    def test_retries_and_limits_concurrency(self):
+        params = {"wstoken": "t", "wsfunction": "core_course_get_courses"}
+
+        async def run():
+            return await asyncio.gather(
+                *[self.client.call(dict(params)) for _ in range(6)]
+            )
+
+        results = self.run_with_client(run())
+        self.assertEqual(results, [[{"id": 2, "fullname": "Course"}]] * 6)
+        self.assertEqual(self.client.get_stats()["retries"], 2)
+        self.assertLessEqual(self.server.state["peak"], 2)
+
+    def test_raises_moodle_errors_without_retrying(self):
+        self.server.state["failures"] = 0
+        with self.assertRaises(MoodleError):
+            self.run_with_client(
+                self.client.call({"wstoken": "t", "wsfunction": "unknown"})
+            )
+        self.assertEqual(self.server.state["requests"], 1)
+
+    def test_download_and_login(self):
+        async def run():
+            content = await self.client.download(self.client.base_url + "/file.txt")
+            return (
+                content,
+                await self.client.login("teacher", "secret"),
+                await self.client.login("teacher", "wrong"),
+            )
+
+        content, accepted, rejected = self.run_with_client(run())
+        self.assertEqual(content, b"Q1: What?\nA1: That.")
+        self.assertTrue(accepted)
+        self.assertFalse(rejected)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from goldenverba.components.ollama_router import OllamaRequestError, OllamaRouter
+
+
+def start_stub(models: list[str], port: int = 0) -> ThreadingHTTPServer:
+    """Starts a local server answering /api/tags like an Ollama host with the given
+    models."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = json.dumps({"models": [{"name": name} for name in models]})
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.end_headers()
+            self.wfile.write(body.encode("utf-8"))
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def get_url(server: ThreadingHTTPServer) -> str:
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+class TestOllamaRouter(unittest.TestCase):
+    def setUp(self):
+        self.llama = start_stub(["llama3.1:latest"])
+        self.dolphin = start_stub(["dolphin-llama3:latest", "llama3.1:8b"])
+
+    def tearDown(self):
+        for server in [self.llama, self.dolphin]:
+            server.shutdown()
+            server.server_close()
+
+    def test_routes_by_model_and_outstanding_requests(self):
+        router = OllamaRouter([get_url(self.llama), get_url(self.dolphin)])
+        router.probe_all(force=True)
+
+        with router.route("dolphin-llama3") as route:
+            self.assertEqual(route.url, get_url(self.dolphin))
+        with router.route("llama3.1") as route:
+            self.assertEqual(route.url, get_url(self.llama))
+
+        first = router.acquire()
+        second = router.acquire()
+        self.assertNotEqual(first.url, second.url)
+        router.release(first, True)
+        router.release(second, True)
+        self.assertEqual(
+            [b["outstanding"] for b in router.get_stats()["backends"]], [0, 0]
+        )
+
+    def test_ejects_and_readmits_failing_hosts(self):
+        flaky = start_stub(["llama3.1:latest"])
+        port = flaky.server_address[1]
+        flaky.shutdown()
+        flaky.server_close()
+
+        router = OllamaRouter(
+            [get_url(flaky), get_url(self.llama)], max_failures=2, eject_seconds=60
+        )
+        router.probe_all(force=True)
+        with router.route() as route:
+            route.failed = True
+        self.assertFalse(router.get_stats()["backends"][0]["available"])
+        for _ in range(3):
+            with router.route() as route:
+                self.assertEqual(route.url, get_url(self.llama))
+
+        # Back up: a successful probe re-admits the host
+        flaky = start_stub(["llama3.1:latest"], port)
+        try:
+            router.probe_all(force=True)
+            self.assertTrue(router.get_stats()["backends"][0]["available"])
+        finally:
+            flaky.shutdown()
+            flaky.server_close()
+
+    def test_request_errors_do_not_eject_hosts(self):
+        router = OllamaRouter([get_url(self.llama)], max_failures=2, eject_seconds=60)
+        for _ in range(3):
+            with self.assertRaises(OllamaRequestError):
+                with router.route() as route:
+                    raise OllamaRequestError(404, "model not found")
+        backend = router.get_stats()["backends"][0]
+        self.assertTrue(backend["available"])
+        self.assertEqual((backend["failures"], backend["outstanding"]), (0, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
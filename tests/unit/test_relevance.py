@@ -0,0 +1,79 @@
+import unittest
+
+from goldenverba.components.relevance import RelevanceGate
+
+
+class StubEmbedder:
+    """Embeds texts by keyword counts, enough to exercise the gate thresholds."""
+
+    def __init__(self, need_vectorization: bool = True):
+        self.need_vectorization = need_vectorization
+
+    def get_need_vectorization(self) -> bool:
+        return self.need_vectorization
+
+    def vectorize_chunks(self, texts: list[str]) -> list[list[float]]:
+        return [
+            [float(text.count("graph")), float(text.count("recipe")), 1.0]
+            for text in texts
+        ]
+
+
+class TestRelevanceGate(unittest.TestCase):
+    def test_decides_clear_cases_and_escalates_the_band(self):
+        gate = RelevanceGate("embedder", low=0.5, high=0.85, mode="on")
+        embedder = StubEmbedder()
+
+        self.assertEqual(
+            gate.decide("context", "graph", "graph graph graph", embedder)[0], True
+        )
+        self.assertEqual(
+            gate.decide("context", "graph", "recipe recipe recipe", embedder)[0],
+            False,
+        )
+        is_relevant, score = gate.decide("context", "graph", "graph recipe", embedder)
+        self.assertIsNone(is_relevant)
+        self.assertTrue(0.5 <= score < 0.85)
+        gate.record_escalation("context", True, score)
+
+        stats = gate.get_stats()["filters"]["context"]
+        self.assertEqual(stats["relevant"], 1)
+        self.assertEqual(stats["irrelevant"], 1)
+        self.assertEqual(stats["escalated"], 1)
+        self.assertEqual(stats["escalated_relevant"], 1)
+        self.assertAlmostEqual(stats["local_ratio"], 0.667)
+
+    def test_escalates_without_local_vectors(self):
+        gate = RelevanceGate("embedder", mode="on")
+        self.assertEqual(
+            gate.decide("chatbot", "q", "text", StubEmbedder(False)), (None, None)
+        )
+        self.assertEqual(
+            gate.decide("chatbot", "q", " ", StubEmbedder(False))[0], False
+        )
+        self.assertEqual(gate.get_stats()["filters"]["chatbot"]["unscored"], 1)
+
+    def test_shadow_mode_only_records(self):
+        embedder = StubEmbedder()
+        self.assertEqual(
+            RelevanceGate("embedder").decide("context", "graph", "graph", embedder),
+            (None, None),
+        )
+
+        gate = RelevanceGate("embedder", low=0.5, high=0.85, mode="shadow")
+        is_relevant, score = gate.decide("context", "graph", "graph graph", embedder)
+        self.assertIsNone(is_relevant)
+        gate.record_escalation("context", False, score)
+        is_relevant, score = gate.decide("context", "graph", "recipe recipe", embedder)
+        self.assertIsNone(is_relevant)
+        gate.record_escalation("context", False, score)
+
+        stats = gate.get_stats()
+        self.assertEqual(stats["mode"], "shadow")
+        stats = stats["filters"]["context"]
+        self.assertEqual((stats["relevant"], stats["irrelevant"]), (1, 1))
+        self.assertEqual((stats["shadow_agreed"], stats["shadow_disagreed"]), (1, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+import asyncio
+import unittest
+
+from goldenverba.components.scheduler import PriorityScheduler, llm_priority
+
+
+class TestPriorityScheduler(unittest.TestCase):
+    def test_admits_higher_priority_first(self):
+        async def run():
+            scheduler = PriorityScheduler(max_parallel=1)
+            order = []
+
+            async def call(priority):
+                async with scheduler.slot(priority):
+                    order.append(priority)
+                    await asyncio.sleep(0)
+
+            await scheduler.acquire("single")
+            tasks = [
+                asyncio.create_task(call("batch")),
+                asyncio.create_task(call("single")),
+                asyncio.create_task(call("interactive")),
+            ]
+            await asyncio.sleep(0)
+            self.assertEqual(scheduler.get_stats()["classes"]["batch"]["queued"], 1)
+            scheduler.release("single")
+            await asyncio.gather(*tasks)
+            return order, scheduler
+
+        order, scheduler = asyncio.run(run())
+        self.assertEqual(order, ["interactive", "single", "batch"])
+        self.assertEqual(scheduler.running, 0)
+        self.assertEqual(scheduler.get_stats()["classes"]["single"]["running"], 0)
+
+    def test_cancelled_waiter_does_not_leak_slot(self):
+        async def run():
+            scheduler = PriorityScheduler(max_parallel=1)
+            await scheduler.acquire("single")
+            waiter = asyncio.create_task(scheduler.acquire("batch"))
+            await asyncio.sleep(0)
+            waiter.cancel()
+            await asyncio.gather(waiter, return_exceptions=True)
+            scheduler.release("single")
+
+            llm_priority.set("interactive")
+            async with scheduler.slot():
+                stats = scheduler.get_stats()
+            return scheduler, stats
+
+        scheduler, stats = asyncio.run(run())
+        self.assertEqual(scheduler.running, 0)
+        self.assertEqual(stats["classes"]["interactive"]["running"], 1)
+        self.assertEqual(stats["classes"]["batch"]["queued"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,76 @@
+import asyncio
+import unittest
+
+from goldenverba.components.scheduler import llm_priority
+from goldenverba.components.singleflight import SingleFlight, make_key
+
+
+class TestSingleFlight(unittest.TestCase):
+    def test_concurrent_duplicates_share_one_call(self):
+        async def run():
+            flight = SingleFlight("test")
+            started = []
+
+            async def call(value):
+                started.append(value)
+                await asyncio.sleep(0.01)
+                return value * 2
+
+            key = make_key("query", "course")
+            results = await asyncio.gather(
+                *[flight.do(key, lambda: call(21)) for _ in range(5)],
+                flight.do(make_key("other", "course"), lambda: call(1)),
+            )
+            # Finished calls are not cached
+            again = await flight.do(key, lambda: call(5))
+            return results, again, started, flight.get_stats()
+
+        results, again, started, stats = asyncio.run(run())
+        self.assertEqual(results, [42] * 5 + [2])
+        self.assertEqual(again, 10)
+        self.assertEqual(started, [21, 1, 5])
+        self.assertEqual(stats, {"calls": 3, "shared": 4, "in_flight": 0})
+
+    def test_shared_call_survives_one_cancelled_caller(self):
+        async def run():
+            flight = SingleFlight()
+
+            async def call():
+                await asyncio.sleep(0.02)
+                return "done"
+
+            first = asyncio.create_task(flight.do("key", call))
+            second = asyncio.create_task(flight.do("key", call))
+            await asyncio.sleep(0)
+            first.cancel()
+            return await second, first.cancelled()
+
+        self.assertEqual(asyncio.run(run()), ("done", True))
+
+    def test_calls_are_not_shared_across_priorities(self):
+        async def run():
+            flight = SingleFlight()
+            started = []
+
+            async def call():
+                started.append(llm_priority.get())
+                await asyncio.sleep(0.01)
+                return "done"
+
+            async def caller(priority):
+                llm_priority.set(priority)
+                return await flight.do("key", call)
+
+            results = await asyncio.gather(
+                caller("batch"), caller("interactive"), caller("batch")
+            )
+            return results, started, flight.get_stats()["shared"]
+
+        results, started, shared = asyncio.run(run())
+        self.assertEqual(results, ["done"] * 3)
+        self.assertEqual(started, ["batch", "interactive"])
+        self.assertEqual(shared, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()